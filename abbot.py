@@ -5,7 +5,7 @@ from discord.ext.commands.bot import _get_variable
 
 from config import Config, ConfigDefaults
 from permissions import Permissions, PermissionsDefaults
-from utils import load_file, write_file, sane_round_int
+from utils import load_file, write_file, sane_round_int, unique_mentions
 import exceptions
 import inspect
 import asyncio
@@ -25,6 +25,7 @@ from constants import VERSION as BOTVERSION
 from constants import DISCORD_MSG_CHAR_LIMIT, AUDIO_CACHE_PATH
 import praw
 import db
+from members import MemberIndex
 
 import event
 
@@ -38,8 +39,14 @@ class Response:
 
 class Abbot(discord.Client):
     def __init__(self, config_file=ConfigDefaults.options_file, perms_file=PermissionsDefaults.perms_file):
+        self.startup_timings = [] # (step, seconds) for the startup report in on_ready.
+        started = time.monotonic()
         self.config = Config(config_file)
+        self.startup_timings.append(('Config load', time.monotonic() - started))
+        started = time.monotonic()
         self.permissions = Permissions(perms_file, grant_all=[self.config.owner_id])
+        self.startup_timings.append(('Permissions load', time.monotonic() - started))
+        self.login_started = None
 
         self.blacklist = set(load_file(self.config.blacklist_file))
 
@@ -55,8 +62,44 @@ class Abbot(discord.Client):
             logger.info("AutoStatus set.  Creating task.")
             self.loop.create_task(self._auto_presence_task())
         
+        journal = None
         if self.config.database_name:
-            self.database = db.AbbotDatabase(self.config.database_name)
+            if self.config.usage_journal:
+                journal = db.UsageJournal(self.config.database_name + '.usagelog', sync=self.config.usage_journal_sync)
+            profile = db.ConnectionProfile(
+                journalMode=self.config.database_journal_mode,
+                synchronous=self.config.database_synchronous,
+                cacheSize=self.config.database_cache_size,
+                mmapSize=self.config.database_mmap_size,
+                tempStore=self.config.database_temp_store,
+                busyTimeout=self.config.database_busy_timeout)
+            started = time.monotonic()
+            try:
+                self.database = db.AsyncAbbotDatabase(self.config.database_name, loop=self.loop, profile=profile,
+                    readers=self.config.database_readers,
+                    groupCommitWindow=self.config.group_commit_window / 1000,
+                    groupCommitSize=self.config.group_commit_size,
+                    usageCacheSize=self.config.usage_cache_size,
+                    journal=journal,
+                    rankCacheTTL=self.config.rank_cache_ttl)
+            except db.MigrationError as ex:
+                raise exceptions.HelpfulError(
+                    "The database could not be updated.  {0}".format(ex),
+
+                    "None of update {0} was applied, and the updates before it were.  "
+                    "Fix the problem with the update and start the bot again.  "
+                    "Run 'python db.py --dry-run {1}' to try the updates on a copy of the database first.".format(ex.update, self.config.database_name))
+            self.startup_timings.append(('Database check', time.monotonic() - started))
+
+        self.member_index = MemberIndex()
+        self.usage = db.UsageAggregator(flushSize=self.config.usage_flush_size, journal=journal)
+        self.reactions = db.ReactionCoalescer(window=self.config.reaction_window / 1000)
+        self.archiving = False
+        self.auto_archived_on = None # The day _auto_archive_task last ran an archive.
+        if self.config.auto_archive:
+            self.loop.create_task(self._auto_archive_task())
+        if self.config.usage_flush_interval > 0:
+            self.loop.create_task(self._usage_flush_task())
 
     # TODO: Add some sort of `denied` argument for a message to send when someone else tries to use it
     def owner_only(func):
@@ -168,6 +211,15 @@ class Abbot(discord.Client):
         except: # Can be ignored
             pass
 
+        # logout() flushes the usage, but make sure nothing is left behind if it failed.
+        try:
+            self.loop.run_until_complete(self.flush_usage())
+        except Exception as e:
+            logger.error("Could not flush usage: %s" % e)
+
+        # Let the database finish any queued writes.
+        self.database.close()
+
         pending = asyncio.Task.all_tasks()
         gathered = asyncio.gather(*pending)
 
@@ -260,6 +312,7 @@ class Abbot(discord.Client):
     # noinspection PyMethodOverriding
     def run(self):
         try:
+            self.login_started = time.monotonic()
             self.loop.run_until_complete(self.start(*self.config.auth))
 
         except discord.errors.LoginFailure:
@@ -279,7 +332,21 @@ class Abbot(discord.Client):
             if self.exit_signal:
                 raise self.exit_signal
 
+    def log_startup_timings(self):
+        """
+        Log how long each step of starting up took, ending with logging in to the gateway.
+        """
+        timings = list(self.startup_timings)
+        if self.login_started != None:
+            timings.append(('Gateway login', time.monotonic() - self.login_started))
+
+        logger.info("Startup timings:")
+        for step, seconds in timings:
+            logger.info("  {0}: {1:.1f} ms".format(step, seconds * 1000))
+        logger.info("  Total: {0:.1f} ms".format(sum(seconds for step, seconds in timings) * 1000))
+
     async def logout(self):
+        await self.flush_usage()
         await self.disconnect_all_voice_clients()
         return await super().logout()
 
@@ -316,8 +383,13 @@ class Abbot(discord.Client):
                 "The OwnerID is the id of the owner, not the bot.  "
                 "Figure out which one is which and use the correct information.")
 
+        if not self.init_ok:
+            self.log_startup_timings()
         self.init_ok = True
 
+        for server in self.servers:
+            self.member_index.addServer(server)
+
         logger.info("Bot:   %s/%s#%s" % (self.user.id, self.user.name, self.user.discriminator))
 
         owner = self._get_owner(voice=True) or self._get_owner()
@@ -370,6 +442,14 @@ class Abbot(discord.Client):
             logger.info("    Delete Invoking: " + ['Disabled', 'Enabled'][self.config.delete_invoking])
         logger.info("  Debug Mode: " + ['Disabled', 'Enabled'][self.config.debug_mode])
 
+        logger.info("Database: " + self.config.database_name)
+        for name, value in await self.database.write(db.AbbotDatabase.getSettings):
+            logger.info("  {0}: {1}".format(name, value))
+
+        if not self.archiving and await self.database.read(db.UsageArchiver.progress) != None:
+            logger.info("Continuing the database archive that was interrupted.")
+            self.loop.create_task(self.archive_usage())
+
         # maybe option to leave the ownerid blank and generate a random command for the owner to use
         # wait_for_message is pretty neato
 
@@ -502,7 +582,7 @@ class Abbot(discord.Client):
             member = author
         elif len(user_mentions) >= 1:
             # if more than one mention is supplied, we only grab the first one.
-            member = discord.utils.get(message.server.members, id=user_mentions[0].id)
+            member = self.member_index.get(message.server.id, user_mentions[0].id) or user_mentions[0]
         
         # Build the message
         iterRoles = iter(member.roles)
@@ -529,8 +609,8 @@ class Abbot(discord.Client):
         """
         text = " ".join(leftover_args)
         
-        idea = db.Idea(self.database, message.author.id, message.server.id, message.channel.id, text)
-        success = idea.insert()
+        success = await self.database.write(
+            lambda database: db.Idea(database, message.author.id, message.server.id, message.channel.id, text).insert())
         
         if success:
             return Response("Thanks for your submission.", reply=True, delete_after=30 if message.channel != 'Direct Message' else 0)
@@ -725,7 +805,7 @@ class Abbot(discord.Client):
         """
         Gets usage information.  By default, shows your own usage for the current channel.
         Usage:
-            {command_prefix}usage [user mention|rank] [server]
+            {command_prefix}usage [user mention|rank|activity] [server] [days] [since YYYY[-MM]] [until YYYY[-MM]]
         Examples:
             {command_prefix}usage 
             Gets your own usage information for the current channel.
@@ -737,35 +817,111 @@ class Abbot(discord.Client):
             Shows usage rankings for the current channel.
             {command_prefix}usage server rank
             Shows usage rankings for the current server (for all channels the bot is in).
+            {command_prefix}usage server rank since 2026-01 until 2026-03
+            Shows usage rankings for the current server from January to March 2026, including archived months.
+            {command_prefix}usage rank since 2025
+            Shows usage rankings for the current channel from the start of 2025 on.
+            {command_prefix}usage server since 2026-01 until 2026-03
+            Gets your own usage information for the current server from January to March 2026.
+            {command_prefix}usage activity server 30
+            Shows the message activity for the current server over the last 30 days (7 by default).
             """
         if len(user_mentions) == 1:
-            member = discord.utils.get(message.server.members, id=user_mentions[0].id)
+            member = self.member_index.get(message.server.id, user_mentions[0].id) or user_mentions[0]
         else:
             member = author
 
-        messageUsage = None
-        reactionUsage = None
         rank = False
+        activity = False
+        days = 7
         queryServer = False
+        since = None
+        until = None
         target = "#" + message.channel.name
-        for arg in leftover_args:
-            if arg.lower() == "server":
+        args = iter(leftover_args)
+        for arg in args:
+            if arg.lower() in ("since", "until"):
+                value = next(args, "")
+                month = db.UsageRank.parseMonth(value, last=arg.lower() == "until")
+                if month == None:
+                    return Response("'{0}' is not a month, use YYYY-MM or YYYY.".format(value), delete_after=30)
+                if arg.lower() == "since":
+                    since = month
+                else:
+                    until = month
+            elif arg.lower() == "server":
                 queryServer = True
                 target = message.server.name
             elif arg.lower() == "rank":
                 rank = True
+            elif arg.lower() == "activity":
+                activity = True
+            elif arg.isdigit() and int(arg) > 0:
+                days = min(int(arg), 365, self.config.activity_retention or 365)
             else:
                 logger.debug("Unsupported usage argument '{0}'".format(arg))
 
-        if not rank:
-            messageUsage = db.MessageUsage(database=self.database, user=member.id, server=message.server.id, channel=None if queryServer else message.channel.id)
-            reactionUsage = db.ReactionUsage(database=self.database, user=member.id, server=message.server.id, channel=None if queryServer else message.channel.id)
-            mentionUsage = db.MentionUsage(database=self.database, user=member.id, server=message.server.id, channel=None if queryServer else message.channel.id)
-            validCommandUsage = db.CommandUsage(database=self.database, user=member.id, server=message.server.id, channel=None if queryServer else message.channel.id, valid=1)
-            invalidCommandUsage = db.CommandUsage(database=self.database, user=member.id, server=message.server.id, channel=None if queryServer else message.channel.id, valid=0)
+        if (since != None or until != None) and activity:
+            return Response("Months can not be given for the activity, give a number of days instead, for example: {0}usage activity 30".format(self.config.command_prefix), delete_after=30)
+        if since != None and until != None and since > until:
+            return Response("The since month has to be before the until month.", delete_after=30)
+        monthRange = ""
+        if since != None or until != None:
+            monthRange = ' ({0} to {1})'.format('{0}-{1:02}'.format(*since) if since != None else 'the start',
+                '{0}-{1:02}'.format(*until) if until != None else 'now')
+
+        if activity:
+            em = discord.Embed(
+                title='{0} activity for the last {1} {2}'.format(target.upper(), days, inflect.engine().plural("day", days)), colour=0x2e456b)
+            until = db.UsageActivity.hourBucket()
+            hours = await self.database.read(db.UsageActivity.fetch, message.server.id, None if queryServer else message.channel.id,
+                since=until - days * 24 + 1, until=until)
+            if hours == None:
+                return Response("There was a problem getting the activity, try again in a little while.", delete_after=30)
+
+            if len(hours) > 0:
+                # Add the hours up by day and by hour of the day.
+                perDay = {}
+                perHourOfDay = [0] * 24
+                for hourBucket, messages, words in hours:
+                    day = datetime.datetime.utcfromtimestamp(hourBucket * 3600).date()
+                    perDay[day] = perDay.get(day, 0) + messages
+                    perHourOfDay[hourBucket % 24] += messages
+
+                em.add_field(name="# of Messages", value=sum(hour[1] for hour in hours), inline=True)
+                em.add_field(name="# of Words", value=sum(hour[2] for hour in hours), inline=True)
+                busiestHour = max(hours, key=lambda hour: hour[1])
+                em.add_field(name="Busiest Hour",
+                    value="{0:%Y-%m-%d %H:00} UTC ({1} messages)".format(datetime.datetime.utcfromtimestamp(busiestHour[0] * 3600), busiestHour[1]),
+                    inline=False)
+                busiestHours = sorted(range(24), key=lambda hour: perHourOfDay[hour], reverse=True)[:3]
+                em.add_field(name="Busiest Times of Day",
+                    value="\n".join("{0:02}:00-{0:02}:59 UTC: {1}".format(hour, perHourOfDay[hour]) for hour in busiestHours if perHourOfDay[hour] > 0),
+                    inline=True)
+                # Only the most recent days fit in a field.
+                em.add_field(name="Messages per Day",
+                    value="\n".join("{0:%a %b %d}: {1}".format(day, messages) for day, messages in list(perDay.items())[-14:]),
+                    inline=True)
+            else:
+                em.description = "Nothing to see here yet."
+            em.set_footer(text='Requested by {0.name}#{0.discriminator}'.format(message.author), icon_url=author.avatar_url)
+            return Response(em, reply=False, embed=True)
+        elif not rank:
+            if since != None or until != None:
+                snapshot = await self.database.read(db.UsageSnapshot.fetchRange, member.id, message.server.id, None if queryServer else message.channel.id,
+                    since=since, until=until)
+            else:
+                snapshot = await self.database.read(db.UsageSnapshot.fetch, member.id, message.server.id, None if queryServer else message.channel.id)
+            if snapshot == None:
+                return Response("There was a problem getting the usage, try again in a little while.", delete_after=30)
+            messageUsage = snapshot.messages
+            reactionUsage = snapshot.reactions
+            mentionUsage = snapshot.mentions
+            validCommandUsage = snapshot.validCommands
+            invalidCommandUsage = snapshot.invalidCommands
 
             em = discord.Embed(
-                title='{0} usage summary for {1.name}#{1.discriminator}'.format(target.upper(), member), colour=0x2e456b)
+                title='{0} usage summary for {1.name}#{1.discriminator}{2}'.format(target.upper(), member, monthRange), colour=0x2e456b)
             if not messageUsage.newRecord: # If newRecord is true, then there is no reaction usage yet.
                 if messageUsage.messageCount > 0:
                     em.add_field(name="Message Summary", value="A summarized view of how chatty {0} is.".format(member.display_name), inline=False)
@@ -774,7 +930,8 @@ class Abbot(discord.Client):
                     em.add_field(name='# of Characters', value=messageUsage.characterCount, inline=True)
                     em.add_field(name='Max Message', value=messageUsage.maxMessageLength, inline=True)
                     em.add_field(name='# of Shared URLs', value=messageUsage.urlCount, inline=True)
-                    em.add_field(name='Last Message', value=messageUsage.lastMessageTimestamp, inline=False)
+                    if messageUsage.lastMessageTimestamp != None:
+                        em.add_field(name='Last Message', value=messageUsage.lastMessageTimestamp, inline=False)
             
             if not reactionUsage.newRecord: # If newRecord is true, then there is no reaction usage yet.
                 if reactionUsage.userReacted > 0 or reactionUsage.reactionsReceived > 0:
@@ -785,6 +942,8 @@ class Abbot(discord.Client):
                     if reactionUsage.reactionsReceived > 0:
                         em.add_field(name="# of Reactions Received", value=reactionUsage.reactionsReceived, inline=True)
                         # em.add_field(name="# Messages Receiving Actions", value=reactionUsage.messagesReacted, inline=True)
+                    if snapshot.uniqueReactors > 0:
+                        em.add_field(name="# of Users Reacting (approx.)", value=snapshot.uniqueReactors, inline=True)
 
             if not mentionUsage.newRecord: # If newRecord is true, then there is not reaction usage.
                 if mentionUsage.userMentioned > 0 or mentionUsage.userMentions > 0 or mentionUsage.channelMentions > 0 or mentionUsage.roleMentions > 0:
@@ -793,6 +952,8 @@ class Abbot(discord.Client):
                         em.add_field(name="# of Times Mentioned", value=mentionUsage.userMentioned, inline=True)
                     if mentionUsage.userMentions > 0:
                         em.add_field(name="# of Users Mentioned", value=mentionUsage.userMentions, inline=True)
+                    if snapshot.uniqueMentioned > 0:
+                        em.add_field(name="# of Different Users Mentioned (approx.)", value=snapshot.uniqueMentioned, inline=True)
                     if mentionUsage.channelMentions > 0:
                         em.add_field(name="# of Channels Mentioned", value=mentionUsage.channelMentions, inline=True)
                     if mentionUsage.roleMentions > 0:
@@ -816,213 +977,42 @@ class Abbot(discord.Client):
             em.set_thumbnail(url=member.avatar_url)
             return Response(em, reply=False, embed=True)
         else: # Rank
-            em = discord.Embed(
-                title='{0} Rankings'.format(target.upper()), colour=0x2e456b)
-            
-            # --------------------------------------------------------------------------------------------------------------
-            # Message Rankings
-            # --------------------------------------------------------------------------------------------------------------
-            messageUsageRank = db.MessageUsageRank(database=self.database, server=message.server.id, channel=None if queryServer else message.channel.id, maxRankings=5)
-
-            # Get message count rankings
-            rankingsOutput = ""
-            messageUsageRank.getRankingsByMessageCount()
-            numRankings = len(messageUsageRank.rankings)
-            p = inflect.engine()
-            if numRankings > 0:
-                currentRank = 1
-                for rank in messageUsageRank.rankings:
-                    # TODO: Pretty up the output!
-                    rankWord = db.GenericRank.rankIndicator(currentRank, numRankings)
-
-                    rankingsOutput += "{0}: {1}........**{2}**\n".format(rankWord, 
-                        (discord.utils.get(message.server.members, id=rank.user)).display_name, 
-                        rank.value)
-                    currentRank += 1
-
-                em.add_field(name="Most Messages", value=rankingsOutput + "\n", inline=True)
-
-            # Get word count rankings
-            rankingsOutput = ""
-            messageUsageRank.getRankingsByWordCount()
-            numRankings = len(messageUsageRank.rankings)
-            p = inflect.engine()
-            if numRankings > 0:
-                currentRank = 1
-                for rank in messageUsageRank.rankings:
-                    # TODO: Pretty up the output!
-                    rankWord = db.GenericRank.rankIndicator(currentRank, numRankings)
-
-                    rankingsOutput += "{0}: {1}........**{2}**\n".format(rankWord, 
-                        (discord.utils.get(message.server.members, id=rank.user)).display_name, 
-                        rank.value)
-                    currentRank += 1
-
-                em.add_field(name="Most Words", value=rankingsOutput + "\n", inline=True)
-
-            # Get character count rankings
-            rankingsOutput = ""
-            messageUsageRank.getRankingsByCharacterCount()
-            numRankings = len(messageUsageRank.rankings)
-            if len(messageUsageRank.rankings) > 0:
-                currentRank = 1
-                for rank in messageUsageRank.rankings:
-                    # TODO: Pretty up the output!
-                    rankWord = db.GenericRank.rankIndicator(currentRank, numRankings)
-
-                    rankingsOutput += "{0}: {1}........**{2}**\n".format(rankWord, 
-                        (discord.utils.get(message.server.members, id=rank.user)).display_name, 
-                        rank.value)
-                    currentRank += 1
-
-                em.add_field(name="Most Characters", value=rankingsOutput + "\n", inline=True)
-
-            # Get character count rankings
-            rankingsOutput = ""
-            messageUsageRank.getRankingsByLongestMessage()
-            numRankings = len(messageUsageRank.rankings)
-            if len(messageUsageRank.rankings) > 0:
-                currentRank = 1
-                for rank in messageUsageRank.rankings:
-                    # TODO: Pretty up the output!
-                    rankWord = db.GenericRank.rankIndicator(currentRank, numRankings)
-
-                    rankingsOutput += "{0}: {1}........**{2}**\n".format(rankWord, 
-                        (discord.utils.get(message.server.members, id=rank.user)).display_name, 
-                        rank.value)
-                    currentRank += 1
-
-                em.add_field(name="Longest Message", value=rankingsOutput + "\n", inline=True)
-
-            # Get url count rankings
-            rankingsOutput = ""
-            messageUsageRank.getRankingsByUrlCount()
-            numRankings = len(messageUsageRank.rankings)
-            if len(messageUsageRank.rankings) > 0:
-                currentRank = 1
-                for rank in messageUsageRank.rankings:
-                    # TODO: Pretty up the output!
-                    rankWord = db.GenericRank.rankIndicator(currentRank, numRankings)
-
-                    rankingsOutput += "{0}: {1}........**{2}**\n".format(rankWord, 
-                        (discord.utils.get(message.server.members, id=rank.user)).display_name, 
-                        rank.value)
-                    currentRank += 1
-
-                em.add_field(name="Most Shared Urls", value=rankingsOutput + "\n", inline=True)
-
-            # --------------------------------------------------------------------------------------------------------------
-            # Mentions Rankings
-            # --------------------------------------------------------------------------------------------------------------
-            mentionUsageRank = db.MentionUsageRank(database=self.database, server=message.server.id, channel=None if queryServer else message.channel.id, maxRankings=5)
-
-            # Get most mentioned user/role/channel
-            rankingsOutput = ""
-            mentionUsageRank.getRankingsByUserMentioned()
-            numRankings = len(mentionUsageRank.rankings)
-            p = inflect.engine()
-            if numRankings > 0:
-                currentRank = 1
-                for rank in mentionUsageRank.rankings:
-                    # TODO: Pretty up the output!
-                    rankWord = db.GenericRank.rankIndicator(currentRank, numRankings)
-
-                    rankingsOutput += "{0}: {1}........**{2}**\n".format(rankWord, 
-                        (discord.utils.get(message.server.members, id=rank.user)).display_name, 
-                        rank.value)
-                    currentRank += 1
-
-                if currentRank > 0:
-                    em.add_field(name="Most Mentioned Users", value=rankingsOutput + "\n", inline=True)
-
-            rankingsOutput = ""
-            mentionUsageRank.getRankingsByUserMentions()
-            numRankings = len(mentionUsageRank.rankings)
-            p = inflect.engine()
-            if numRankings > 0:
-                currentRank = 0
-                for rank in mentionUsageRank.rankings:
-                    # TODO: Pretty up the output!
-                    if rank.value > 0:
-                        currentRank += 1
-                        rankWord = db.GenericRank.rankIndicator(currentRank, numRankings)
-
-                        rankingsOutput += "{0}: {1}........**{2}**\n".format(rankWord, 
-                            (discord.utils.get(message.server.members, id=rank.user)).display_name, 
-                            rank.value)
-
-                if currentRank > 0:
-                    em.add_field(name="Most User Mentions", value=rankingsOutput + "\n", inline=True)
-
-            # --------------------------------------------------------------------------------------------------------------
-            # Reactions Rankings
-            # --------------------------------------------------------------------------------------------------------------
-            reactionUsageRank = db.ReactionUsageRank(database=self.database, server=message.server.id, channel=None if queryServer else message.channel.id, maxRankings=5)
-
-            # Get user reacted rankings
-            rankingsOutput = ""
-            reactionUsageRank.getRankingsByUserReacted()
-            numRankings = len(reactionUsageRank.rankings)
-            p = inflect.engine()
-            if numRankings > 0:
-                currentRank = 0
-                for rank in reactionUsageRank.rankings:
-                    # TODO: Pretty up the output!
-                    if rank.value > 0:
-                        currentRank += 1
-                        rankWord = db.GenericRank.rankIndicator(currentRank, numRankings)
-
-                        rankingsOutput += "{0}: {1}........**{2}**\n".format(rankWord, 
-                            (discord.utils.get(message.server.members, id=rank.user)).display_name, 
-                            rank.value)
-
-
-                if currentRank > 0:
-                    em.add_field(name="Reacted Most", value=rankingsOutput + "\n", inline=True)
-
-            # Get user reactions rankings
-            rankingsOutput = ""
-            reactionUsageRank.getRankingsByUserReactionsReceived()
-            numRankings = len(reactionUsageRank.rankings)
-            if len(reactionUsageRank.rankings) > 0:
-                currentRank = 0
-                for rank in reactionUsageRank.rankings:
-                    # TODO: Pretty up the output!
-                    if rank.value > 0:
-                        currentRank += 1
-                        rankWord = db.GenericRank.rankIndicator(currentRank, numRankings)
-
-                        rankingsOutput += "{0}: {1}........**{2}**\n".format(rankWord, 
-                            (discord.utils.get(message.server.members, id=rank.user)).display_name, 
-                            rank.value)
-
-
-                if currentRank > 0:
-                    em.add_field(name="Most Reacted User", value=rankingsOutput + "\n", inline=True)
-
-            # --------------------------------------------------------------------------------------------------------------
-            # Command Rankings
-            # --------------------------------------------------------------------------------------------------------------
-            commandUsageRank = db.CommandUsageRank(database=self.database, server=message.server.id, channel=None if queryServer else message.channel.id, maxRankings=5)
-
-            # Get user reacted rankings
-            rankingsOutput = ""
-            commandUsageRank.getRankingsByCount()
-            numRankings = len(commandUsageRank.rankings)
-            p = inflect.engine()
-            if numRankings > 0:
-                currentRank = 0
-                for rank in commandUsageRank.rankings:
-                    if rank.value > 0:
-                        currentRank += 1
-                        rankWord = db.GenericRank.rankIndicator(currentRank, numRankings)
-
-                        rankingsOutput += "{0}: {1}........**{2}**\n".format(rankWord, 
-                            (discord.utils.get(message.server.members, id=rank.user)).display_name, 
-                            rank.value)
-
-                if currentRank > 0:
-                    em.add_field(name="Most Commands Issued", value=rankingsOutput + "\n", inline=True)
+            em = discord.Embed(title='{0} Rankings{1}'.format(target.upper(), monthRange), colour=0x2e456b)
+            rankChannel = None if queryServer else message.channel.id
+
+            # Each section is (table, column, title, whether to leave out users with nothing to rank).
+            sections = [
+                (db.MessageUsageRank.tableName, 'message_count', "Most Messages", False),
+                (db.MessageUsageRank.tableName, 'word_count', "Most Words", False),
+                (db.MessageUsageRank.tableName, 'character_count', "Most Characters", False),
+                (db.MessageUsageRank.tableName, 'max_message_length', "Longest Message", False),
+                (db.MessageUsageRank.tableName, 'url_count', "Most Shared Urls", False),
+                (db.MentionUsageRank.tableName, 'user_mentioned', "Most Mentioned Users", False),
+                (db.MentionUsageRank.tableName, 'user_mentions', "Most User Mentions", True),
+                (db.ReactionUsageRank.tableName, 'user_reacted_count', "Reacted Most", True),
+                (db.ReactionUsageRank.tableName, 'reactions_received_count', "Most Reacted User", True),
+                (db.CommandUsageRank.tableName, 'count', "Most Commands Issued", True)]
+
+            # All of the rankings for a table come from one query, and the tables are ranked at the same time on the reader threads.
+            columns = {}
+            for tableName, column, title, skipZero in sections:
+                columns.setdefault(tableName, []).append(column)
+            rankClasses = [db.MessageUsageRank, db.MentionUsageRank, db.ReactionUsageRank, db.CommandUsageRank]
+            try:
+                results = await asyncio.wait_for(
+                    asyncio.gather(*[self.database.read(rankClass.fetchAll, message.server.id, rankChannel, columns=columns[rankClass.tableName],
+                            since=since, until=until)
+                        for rankClass in rankClasses]),
+                    self.config.rank_deadline)
+            except asyncio.TimeoutError:
+                logger.warning("Usage rankings for {0} took longer than {1} seconds.".format(target, self.config.rank_deadline))
+                return Response("The rankings are taking too long to put together, try again in a little while.", delete_after=30)
+            allRankings = {rankClass.tableName: rankings for rankClass, rankings in zip(rankClasses, results)}
+
+            for tableName, column, title, skipZero in sections:
+                rankingsOutput = self.format_rankings(message.server, allRankings[tableName][column], skipZero)
+                if rankingsOutput:
+                    em.add_field(name=title, value=rankingsOutput + "\n", inline=True)
 
             # --------------------------------------------------------------------------------------------------------------
             # Wrap it up.
@@ -1181,19 +1171,155 @@ class Abbot(discord.Client):
         return Response(":ok_hand: '{0} sent to all servers.".format(args), delete_after=20)
 
     @owner_only
-    async def cmd_archivedb(self, message):
+    async def cmd_archivedb(self, message, leftover_args):
         """
-        Archives the current database into archive tables.
+        Archives the current usage into a database file for last month (in the archive folder).  If last month
+        has already been archived, the usage is only added to it when "again" is given.
         Usage:
-            {command_prefix}archivedb
+            {command_prefix}archivedb [again]
         """
-        archived = self.database.archive()
+        if self.archiving:
+            return Response(":hourglass: The database is already being archived.", reply=True, delete_after=20)
+
+        if "again" not in [arg.lower() for arg in leftover_args] and await self.database.read(db.UsageArchiver.archived):
+            return Response(":warning: Last month has already been archived.  Use `{0}archivedb again` to add the current usage to it.".format(
+                self.config.command_prefix), reply=True, delete_after=30)
 
-        if archived:
-            return Response(":ok_hand: Database has been archived.", reply=True, delete_after=20)
+        status = await self.safe_send_message(message.channel, ":hourglass: Archiving the database...")
+
+        async def report(progress, elapsed):
+            if status:
+                try:
+                    await self.edit_message(status, ":hourglass: Archiving the database... {0}% ({1} of {2} rows) after {3:.1f} seconds.".format(
+                        progress.percent(), progress.rowsMoved, progress.totalRows, elapsed))
+                except discord.HTTPException:
+                    pass
+
+        progress, elapsed = await self.archive_usage(report)
+        if status:
+            await self.safe_delete_message(status, quiet=True)
+
+        if progress != None:
+            return Response(":ok_hand: Database has been archived: {0} rows moved to {1} in {2:.1f} seconds.".format(
+                progress.rowsMoved, db.UsageArchiver.fileName(progress.year, progress.month), elapsed), reply=True, delete_after=20)
         else:
             return Response(":interrobang: Something went wrong with the database archiving.", reply=True, delete_after=20)
 
+    async def archive_usage(self, report=None, report_interval=5):
+        """
+        Archive the usage tables a batch at a time, continuing an archive that was interrupted.  Each batch is
+        a separate write, so usage keeps being written in between.  report(progress, elapsed) is awaited every
+        report_interval seconds.  Returns the final ArchiveProgress (None if the archive failed) and the
+        number of seconds it took.
+        """
+        self.archiving = True
+        started = time.time()
+        lastReport = started
+        try:
+            progress = await self.database.write(db.UsageArchiver.start)
+            while progress != None and not progress.done:
+                progress = await self.database.write(db.UsageArchiver.step, self.config.archive_batch_size)
+                if report and progress != None and time.time() - lastReport >= report_interval:
+                    lastReport = time.time()
+                    await report(progress, lastReport - started)
+
+            # Months archived by older versions are moved out of the database too, one at a time.
+            if progress != None:
+                while await self.database.write(db.UsageArchiver.moveLegacyArchive) != None:
+                    pass
+
+            # Old hourly activity is deleted rather than archived.
+            if progress != None and self.config.activity_retention > 0:
+                deleted = self.config.archive_batch_size
+                while deleted == self.config.archive_batch_size:
+                    deleted = await self.database.write(db.UsageActivity.prune, self.config.activity_retention, self.config.archive_batch_size)
+        finally:
+            self.archiving = False
+
+        elapsed = time.time() - started
+        if progress != None:
+            logger.info("Archived {0} usage rows for {1}-{2:02} in {3:.1f} seconds.".format(progress.rowsMoved, progress.year, progress.month, elapsed))
+        else:
+            logger.error("Archiving the usage tables failed after {0:.1f} seconds.".format(elapsed))
+        return progress, elapsed
+
+    @owner_only
+    async def cmd_exportarchive(self, leftover_args):
+        """
+        Exports archived months to compressed, column-oriented files, which are much smaller and faster
+        to read for historical stats.  By default, exports every month that hasn't been exported yet.
+        Usage:
+            {command_prefix}exportarchive [YYYY-MM] [remove]
+        Examples:
+            {command_prefix}exportarchive 2017-09 remove
+            Exports September 2017 and deletes its SQLite archive file.
+        """
+        month = None
+        remove = False
+        for arg in leftover_args:
+            if arg.lower() == "remove":
+                remove = True
+            elif re.match(r'^\d{4}-\d{2}$', arg):
+                month = tuple(int(part) for part in arg.split('-'))
+            else:
+                logger.debug("Unsupported exportarchive argument '{0}'".format(arg))
+
+        catalog = await self.database.read(db.UsageArchiver.catalog)
+        if month != None:
+            months = [(year, monthNumber) for year, monthNumber, fileName, rows, columnarFile in catalog if (year, monthNumber) == month]
+        else:
+            months = [(year, monthNumber) for year, monthNumber, fileName, rows, columnarFile in catalog if columnarFile == None]
+        if len(months) == 0:
+            return Response("There are no archived months to export.", reply=True, delete_after=20)
+
+        started = time.time()
+        exported = []
+        for year, monthNumber in months:
+            columnarFile = await self.database.read(db.UsageArchiver.exportColumnar, year, monthNumber)
+            if columnarFile != None and await self.database.write(db.UsageArchiver.setColumnar, year, monthNumber, columnarFile, remove):
+                exported.append(columnarFile)
+
+        if len(exported) < len(months):
+            return Response(":interrobang: Exported {0} of {1} archived months, check the log for problems.".format(len(exported), len(months)),
+                reply=True, delete_after=20)
+        return Response(":ok_hand: Exported {0} in {1:.1f} seconds.".format(", ".join(exported), time.time() - started), reply=True, delete_after=20)
+
+    @owner_only
+    async def cmd_dbstats(self, author):
+        """
+        Shows database write and usage cache statistics.
+        Usage:
+            {command_prefix}dbstats
+        """
+        em = discord.Embed(title='Database Statistics', colour=0x2e456b)
+        em.add_field(name="Group Commit", value="Usage writes committed together.", inline=False)
+        for name, value in self.database.groupCommitStats.summary():
+            em.add_field(name=name, value=value, inline=True)
+        em.add_field(name="Usage Cache", value="Usage records kept in memory.", inline=False)
+        for name, value in self.database.usageCache.summary():
+            em.add_field(name=name, value=value, inline=True)
+        em.set_footer(text='Requested by {0.name}#{0.discriminator}'.format(author), icon_url=author.avatar_url)
+        return Response(em, reply=False, embed=True, delete_after=60)
+
+    def format_rankings(self, server, rankings, skip_zero=False):
+        """
+        Format a list of GenericRank for an embed field, one line per user.
+        """
+        rankingsOutput = ""
+        currentRank = 0
+        for rank in rankings:
+            # TODO: Pretty up the output!
+            if skip_zero and rank.value <= 0:
+                continue
+
+            currentRank += 1
+            rankWord = db.GenericRank.rankIndicator(currentRank, len(rankings))
+            rankingsOutput += "{0}: {1}........**{2}**\n".format(rankWord,
+                self.member_index.displayName(server.id, rank.user),
+                rank.value)
+
+        return rankingsOutput
+
     async def try_add_reaction(self, message):
         """Check the message content.  If certain criteria are met, react with appropriate reaction."""
         emoji = None
@@ -1254,27 +1380,14 @@ class Abbot(discord.Client):
 
         urlPattern = re.compile(r'((https?|ftps?|telnet|ssh)://[^\s]+)\s?', re.IGNORECASE)
         content = message.content
-        messageUsage = db.MessageUsage(self.database, message.author.id, message.server.id, message.channel.id)
         messageUrls = urlPattern.findall(content)
         # Remove the URLs from the message so they do not get counted in the stats.
         content = urlPattern.sub('', content) if len(messageUrls) > 0 else content
 
-        if messageUsage.lastMessageTimestamp == None:
-            messageUsage.wordCount = len(content.split())
-            messageUsage.characterCount = len(content)
-            messageUsage.maxMessageLength = messageUsage.characterCount
-            messageUsage.messageCount = 1
-            messageUsage.urlCount = len(messageUrls)
-            messageUsage.insert()
-        else:
-            contentSize = len(content.split())
-            charCount = len(content)
-            messageUsage.wordCount += contentSize
-            messageUsage.characterCount += charCount
-            messageUsage.maxMessageLength = charCount if charCount > messageUsage.maxMessageLength else messageUsage.maxMessageLength
-            messageUsage.messageCount += 1
-            messageUsage.urlCount += len(messageUrls)
-            messageUsage.update()
+        self.usage.addMessage(message.author.id, message.server.id, message.channel.id,
+            words=len(content.split()),
+            chars=len(content),
+            urls=len(messageUrls))
 
         await self.log_mention_usage(message)
 
@@ -1287,69 +1400,51 @@ class Abbot(discord.Client):
         user     -- The user performing the reaction.
         add      -- If the reaction is being added or removed.
         """
-        # First log the user that is reacting.
-        reactingUserUsage = db.ReactionUsage(self.database, user.id, reaction.message.server.id, reaction.message.channel.id)
-        if reactingUserUsage.newRecord and add: # Nothing recorded yet.
-            reactingUserUsage.messagesReacted = 1
-            reactingUserUsage.userReacted = 1
-            reactingUserUsage.insert()
-        else:
-            reactingUserUsage.messagesReacted += 1 if add else -1
-            reactingUserUsage.userReacted += 1 if add else -1
-            reactingUserUsage.update()
-
-        # Then log the user that is being reacted to.
-        reactedUserUsage = db.ReactionUsage(self.database, reaction.message.author.id, reaction.message.server.id, reaction.message.channel.id)
-        if reactedUserUsage.newRecord and add: # Nothing recorded yet.
-            reactedUserUsage.messageReactionsReceived = 1
-            reactedUserUsage.reactionsReceived = 1
-            reactedUserUsage.insert()
-        else:
-            reactedUserUsage.messageReactionsReceived += 1 if add else -1
-            reactedUserUsage.reactionsReceived += 1 if add else -1
-            reactedUserUsage.update()
+        # Reactions are netted for a short time first, so toggled reactions are not written at all.
+        self.reactions.add(user.id, reaction.message.author.id, reaction.message.server.id, reaction.message.channel.id,
+            1 if add else -1)
+        if add: # Removing a reaction does not take the user out of the sketch of users that have reacted.
+            self.usage.addReactor(reaction.message.author.id, reaction.message.server.id, reaction.message.channel.id, user.id)
+
+        if self.reactions.isDue():
+            self.reactions.drain(self.usage)
+            await self.check_usage_flush()
 
     async def log_command_usage(self, command, validCommand, message):
         """
         Log the command usage for the user.
         """
-        commandUsage = db.CommandUsage(database=self.database, user=message.author.id, server=message.server.id, channel=message.channel.id, commandName=command, valid=validCommand)
-        if commandUsage.newRecord:
-            commandUsage.insert()
-        else:
-            commandUsage.count += 1
-            commandUsage.update()
+        self.usage.addCommand(message.author.id, message.server.id, message.channel.id, command, validCommand)
+        await self.check_usage_flush()
 
     async def log_mention_usage(self, message):
         """
         Log the mention usage for the user as well as the user(s), channel(s), and role(s) being mentioned.
-        Note that this does not log unique mentions, just how many times a user has mentioned something or has been mentioned.
+        The users mentioned are also added to a sketch of the distinct users the author has mentioned.
         """
-        # First log the mention usage for the author of the message.
-
-        # the raw_X_mentions arrays are not unique, so we can convert it to a set, then a list to make it a unique list.
-        userMentionUsage = db.MentionUsage(self.database, message.author.id, message.server.id, message.channel.id)
-        if userMentionUsage.newRecord:
-            userMentionUsage.userMentions = len(list(set(message.raw_mentions)))
-            userMentionUsage.channelMentions = len(list(set(message.raw_channel_mentions)))
-            userMentionUsage.roleMentions = len(list(set(message.raw_role_mentions)))
-            userMentionUsage.insert()
-        else:
-            userMentionUsage.userMentions += len(list(set(message.raw_mentions)))
-            userMentionUsage.channelMentions += len(list(set(message.raw_channel_mentions)))
-            userMentionUsage.roleMentions += len(list(set(message.raw_role_mentions)))
-            userMentionUsage.update()
-
-        # Now update the count for users mentioned.
-        for mentioned in list(set(message.raw_mentions)):
-            userMentioned = db.MentionUsage(self.database, mentioned, message.server.id, message.channel.id)
-            if userMentioned.newRecord:
-                userMentioned.userMentioned = 1
-                userMentioned.insert()
-            else:
-                userMentioned.userMentioned += 1
-                userMentioned.update()
-            userMentioned = None
+        # the raw_X_mentions arrays are not unique, so convert them to sets once.
+        mentioned, channels, roles = unique_mentions(message)
+
+        # The author's mentions and the count for each user mentioned are written together.
+        self.usage.addMentions(message.author.id, message.server.id, message.channel.id, mentioned,
+            channelMentions=len(channels), roleMentions=len(roles))
+
+        await self.check_usage_flush()
+
+    async def check_usage_flush(self):
+        """
+        Write the collected usage to the database if enough of it has built up.
+        """
+        if self.usage.isFull():
+            await self.flush_usage()
+
+    async def flush_usage(self):
+        """
+        Write the collected usage to the database.
+        """
+        self.reactions.drain(self.usage)
+        if self.usage.pendingEvents > 0:
+            await self.database.groupWrite(self.usage.flush)
 
 # -----------
 # Secret-Gifter Event Commands
@@ -1411,6 +1506,8 @@ class Abbot(discord.Client):
 # Events
 # -----------
     async def on_member_update(self, before, after):
+        self.member_index.add(after)
+
         if not (before.bot or after.bot) and before.game != None and after.game != None and before.game.name != after.game.name:
             logger.debug(" Before (After): {0.display_name} ({2.display_name}) Status: {0.status} ({2.status}) Game: {1} ({3}).".format(
                 before, 
@@ -1421,6 +1518,7 @@ class Abbot(discord.Client):
 # ---------
 #
     async def on_member_join(self, member):
+        self.member_index.add(member)
         server = member.server
         channel = server.get_channel
         logger.debug("Server {0}; Channel {1}; Member {2.name}".format(server, channel, member))
@@ -1440,11 +1538,18 @@ class Abbot(discord.Client):
 
     
     async def on_member_remove(self, member):
+        self.member_index.remove(member)
         server = member.server
         channel = server.get_channel
         fmt = '{0.mention} has left/been kicked from the server.'
         await self.safe_send_message(channel, fmt.format(member, server))
 
+    async def on_server_join(self, server):
+        self.member_index.addServer(server)
+
+    async def on_server_remove(self, server):
+        self.member_index.removeServer(server)
+
     async def update_presence(self, message):
         game = None
         if self.user.bot:
@@ -1629,6 +1734,40 @@ class Abbot(discord.Client):
     # async def on_message_edit(self, before, after):
     #     logger.debug("Before: {0}\nAfter: {1}.".format(before.content, after.content))
 
+    async def _usage_flush_task(self):
+        await self.wait_until_ready()
+
+        while not self.is_closed:
+            await asyncio.sleep(self.config.usage_flush_interval) # Number of seconds between usage writes
+            await self.flush_usage()
+
+    async def _auto_archive_task(self):
+        await self.wait_until_ready()
+
+        while not self.is_closed:
+            await asyncio.sleep(600) # Check every ten minutes if last month needs to be archived.
+            now = datetime.datetime.now()
+            if self.archiving or self.auto_archived_on == now.date() or not self.in_archive_window(now.time()):
+                continue
+            if await self.database.read(db.UsageArchiver.archived):
+                continue
+
+            logger.info("Starting the automatic archive of last month's usage.")
+            await self.flush_usage() # Include the usage collected but not written yet.
+            progress, elapsed = await self.archive_usage()
+            if progress != None:
+                self.auto_archived_on = now.date() # Even if there was nothing to archive, don't try again until tomorrow.
+                logger.info("Automatic archive of {0}-{1:02} finished in {2:.1f} seconds.".format(progress.year, progress.month, elapsed))
+
+    def in_archive_window(self, now):
+        """
+        Check if the time is inside AutoArchiveWindow, which may wrap past midnight.
+        """
+        start, end = self.config.auto_archive_window
+        if start <= end:
+            return start <= now < end
+        return now >= start or now < end
+
     async def _auto_presence_task(self):
         await self.wait_until_ready()
 
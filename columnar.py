@@ -0,0 +1,212 @@
+import array
+import heapq
+import json
+import os
+import struct
+import sys
+import zlib
+
+MAGIC = b'ABBOTCOL'
+FORMAT_VERSION = 1
+
+# Column types.  Ids (and other text) are stored as indexes into the file's dictionary of strings.
+ID = 'id'
+INTEGER = 'int'
+BLOB = 'blob'
+
+def _pack(values, typecode):
+    """Compress a list of numbers as a little-endian array."""
+    packed = array.array(typecode, values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return zlib.compress(packed.tobytes())
+
+def _unpack(data, typecode):
+    """Decompress an array written by _pack()."""
+    unpacked = array.array(typecode)
+    unpacked.frombytes(zlib.decompress(data))
+    if sys.byteorder == 'big':
+        unpacked.byteswap()
+    return unpacked
+
+def writeArchive(path, year, month, tables):
+    """
+    Write a month of archived usage to a column-oriented file.  tables is a dictionary of table name to
+    (columns, rows), where columns is a list of (name, type) and rows are sequences in column order,
+    sorted by server.  Each column is compressed separately, text is stored in a dictionary shared by
+    all of the tables, and NULL numbers are stored as 0.  The file is written to a temporary file
+    first and then renamed, so a partly written file is never left at path.
+    """
+    dictionary = []
+    dictionaryIndex = {}
+    def encode(value):
+        if value not in dictionaryIndex:
+            dictionaryIndex[value] = len(dictionary)
+            dictionary.append(value)
+        return dictionaryIndex[value]
+
+    blocks = []
+    offset = 0
+    def addBlock(data):
+        nonlocal offset
+        blocks.append(data)
+        offset += len(data)
+        return [offset - len(data), len(data)]
+
+    header = {'year': year, 'month': month, 'tables': {}}
+    for tableName, (columns, rows) in tables.items():
+        tableHeader = {'rows': len(rows), 'columns': {}, 'servers': {}}
+        for position, (name, columnType) in enumerate(columns):
+            values = [row[position] for row in rows]
+            if columnType == ID:
+                block = {'type': ID, 'data': addBlock(_pack([encode(value) for value in values], 'I'))}
+            elif columnType == BLOB:
+                values = [bytes(value) if value != None else b'' for value in values]
+                block = {'type': BLOB, 'lengths': addBlock(_pack([len(value) for value in values], 'I')),
+                    'data': addBlock(zlib.compress(b''.join(values)))}
+            else:
+                block = {'type': INTEGER, 'data': addBlock(_pack([value or 0 for value in values], 'q'))}
+            tableHeader['columns'][name] = block
+
+            if name == 'server':
+                # The rows are sorted by server, so each server's rows can be found without a scan.
+                for index, value in enumerate(values):
+                    tableHeader['servers'].setdefault(value, [index, index])[1] = index + 1
+        header['tables'][tableName] = tableHeader
+
+    header['dictionary'] = addBlock(zlib.compress(json.dumps(dictionary).encode('utf-8')))
+    headerData = json.dumps(header).encode('utf-8')
+
+    temporaryPath = path + '.tmp'
+    with open(temporaryPath, 'wb') as archiveFile:
+        archiveFile.write(MAGIC + struct.pack('<BI', FORMAT_VERSION, len(headerData)))
+        archiveFile.write(headerData)
+        for block in blocks:
+            archiveFile.write(block)
+        archiveFile.flush()
+        os.fsync(archiveFile.fileno())
+    os.replace(temporaryPath, path)
+
+class ColumnarArchive(object):
+    """
+    Reads a file written by writeArchive().  Columns are only read and decompressed when they are
+    first used, and then kept.
+    """
+    def __init__(self, path):
+        """Open the file and read its header."""
+        self.path = path
+        with open(path, 'rb') as archiveFile:
+            prefix = archiveFile.read(len(MAGIC) + 5)
+            if prefix[:len(MAGIC)] != MAGIC:
+                raise ValueError("{0} is not a columnar archive.".format(path))
+            version, headerLength = struct.unpack('<BI', prefix[len(MAGIC):])
+            if version != FORMAT_VERSION:
+                raise ValueError("{0} is version {1}, expected {2}.".format(path, version, FORMAT_VERSION))
+            self.header = json.loads(archiveFile.read(headerLength).decode('utf-8'))
+        self.dataStart = len(MAGIC) + 5 + headerLength
+        self.year = self.header['year']
+        self.month = self.header['month']
+        self._dictionary = None
+        self._dictionaryIndex = None
+        self._columns = {}
+
+    def _read(self, block):
+        """Read the bytes of a block."""
+        with open(self.path, 'rb') as archiveFile:
+            archiveFile.seek(self.dataStart + block[0])
+            return archiveFile.read(block[1])
+
+    def dictionary(self):
+        """Get the list of strings that id columns index into."""
+        if self._dictionary == None:
+            self._dictionary = json.loads(zlib.decompress(self._read(self.header['dictionary'])).decode('utf-8'))
+        return self._dictionary
+
+    def tables(self):
+        """Get the names of the tables in the file."""
+        return list(self.header['tables'])
+
+    def rows(self, tableName):
+        """Get the number of rows in a table."""
+        return self.header['tables'][tableName]['rows']
+
+    def columns(self, tableName):
+        """Get the names of a table's columns."""
+        return list(self.header['tables'][tableName]['columns'])
+
+    def column(self, tableName, name):
+        """
+        Get the values of a column: an array of numbers, a list of bytes for blobs, or an array of
+        dictionary indexes for ids (see dictionary()).
+        """
+        key = (tableName, name)
+        if key not in self._columns:
+            block = self.header['tables'][tableName]['columns'][name]
+            if block['type'] == BLOB:
+                data = zlib.decompress(self._read(block['data']))
+                values = []
+                start = 0
+                for length in _unpack(self._read(block['lengths']), 'I'):
+                    values.append(data[start:start + length])
+                    start += length
+            else:
+                values = _unpack(self._read(block['data']), 'I' if block['type'] == ID else 'q')
+            self._columns[key] = values
+        return self._columns[key]
+
+    def _serverRange(self, tableName, server):
+        """Get the (start, end) rows of a server in a table, or None if it has no rows."""
+        return self.header['tables'][tableName]['servers'].get(server)
+
+    def _indexOf(self, value):
+        """Get the dictionary index of a string, or None if it is not in the file."""
+        if self._dictionaryIndex == None:
+            self._dictionaryIndex = {text: index for index, text in enumerate(self.dictionary())}
+        return self._dictionaryIndex.get(value)
+
+    def userTotals(self, tableName, server, channel=None, columns=None, match=None):
+        """
+        Add up the columns (all of the number columns by default) for each user on the server, or only
+        the channel if one is given.  match is an optional dictionary of column to value that rows must
+        have to be added.  Returns a dictionary of user id to a dictionary of column to total.
+        """
+        rowRange = self._serverRange(tableName, server)
+        if rowRange == None:
+            return {}
+        start, end = rowRange
+        tableColumns = self.header['tables'][tableName]['columns']
+        if columns == None:
+            columns = [name for name, block in tableColumns.items() if block['type'] == INTEGER]
+
+        users = self.column(tableName, 'user')[start:end]
+        match = dict(match or {})
+        if channel != None:
+            match['channel'] = channel
+        keep = None
+        for name, value in match.items():
+            if tableColumns[name]['type'] == ID:
+                value = self._indexOf(value)
+            matched = [rowValue == value for rowValue in self.column(tableName, name)[start:end]]
+            keep = matched if keep == None else [kept and rowMatched for kept, rowMatched in zip(keep, matched)]
+
+        totals = {}
+        for name in columns:
+            values = self.column(tableName, name)[start:end]
+            rows = zip(users, values) if keep == None else ((user, value) for user, value, kept in zip(users, values, keep) if kept)
+            for user, value in rows:
+                userTotals = totals.get(user)
+                if userTotals == None:
+                    userTotals = totals[user] = dict.fromkeys(columns, 0)
+                userTotals[name] += value
+
+        dictionary = self.dictionary()
+        return {dictionary[user]: userTotal for user, userTotal in totals.items()}
+
+    def topUsers(self, tableName, column, server, channel=None, maxRankings=5):
+        """
+        Get the users with the largest total of a column on the server, or only the channel if one is
+        given.  Returns up to maxRankings (user id, total), largest first.
+        """
+        totals = self.userTotals(tableName, server, channel, [column])
+        return heapq.nsmallest(maxRankings, ((user, total[column]) for user, total in totals.items()),
+            key=lambda ranking: (-ranking[1], ranking[0]))
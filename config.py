@@ -2,7 +2,8 @@ import os
 import shutil
 import traceback
 import configparser
-from db import AbbotDatabase
+import datetime
+from db import AbbotDatabase, ConnectionProfile
 
 import logging
 logger = logging.getLogger('abbot')
@@ -89,6 +90,28 @@ class Config:
         self.auto_statuses =  config.get('Abbot', 'AutoStatuses', fallback=ConfigDefaults.auto_statuses)
         self.database_name = config.get('Abbot', 'Database', fallback=ConfigDefaults.database_name)
 
+        self.usage_flush_interval = config.getint('Database', 'UsageFlushInterval', fallback=ConfigDefaults.usage_flush_interval)
+        self.usage_flush_size = config.getint('Database', 'UsageFlushSize', fallback=ConfigDefaults.usage_flush_size)
+        self.usage_journal = config.getboolean('Database', 'UsageJournal', fallback=ConfigDefaults.usage_journal)
+        self.usage_journal_sync = config.getboolean('Database', 'UsageJournalSync', fallback=ConfigDefaults.usage_journal_sync)
+        self.database_journal_mode = config.get('Database', 'JournalMode', fallback=ConfigDefaults.database_journal_mode)
+        self.database_synchronous = config.get('Database', 'Synchronous', fallback=ConfigDefaults.database_synchronous)
+        self.database_cache_size = config.getint('Database', 'CacheSize', fallback=ConfigDefaults.database_cache_size)
+        self.database_mmap_size = config.getint('Database', 'MmapSize', fallback=ConfigDefaults.database_mmap_size)
+        self.database_temp_store = config.get('Database', 'TempStore', fallback=ConfigDefaults.database_temp_store)
+        self.database_busy_timeout = config.getint('Database', 'BusyTimeout', fallback=ConfigDefaults.database_busy_timeout)
+        self.group_commit_window = config.getint('Database', 'GroupCommitWindow', fallback=ConfigDefaults.group_commit_window)
+        self.group_commit_size = config.getint('Database', 'GroupCommitSize', fallback=ConfigDefaults.group_commit_size)
+        self.usage_cache_size = config.getint('Database', 'UsageCacheSize', fallback=ConfigDefaults.usage_cache_size)
+        self.database_readers = config.getint('Database', 'Readers', fallback=ConfigDefaults.database_readers)
+        self.rank_deadline = config.getint('Database', 'RankDeadline', fallback=ConfigDefaults.rank_deadline)
+        self.rank_cache_ttl = config.getint('Database', 'RankCacheTTL', fallback=ConfigDefaults.rank_cache_ttl)
+        self.reaction_window = config.getint('Database', 'ReactionWindow', fallback=ConfigDefaults.reaction_window)
+        self.archive_batch_size = config.getint('Database', 'ArchiveBatchSize', fallback=ConfigDefaults.archive_batch_size)
+        self.auto_archive = config.getboolean('Database', 'AutoArchive', fallback=ConfigDefaults.auto_archive)
+        self.auto_archive_window = config.get('Database', 'AutoArchiveWindow', fallback=ConfigDefaults.auto_archive_window)
+        self.activity_retention = config.getint('Database', 'ActivityRetention', fallback=ConfigDefaults.activity_retention)
+
         self.blacklist_file = config.get('Files', 'BlacklistFile', fallback=ConfigDefaults.blacklist_file)
         self.auto_playlist_file = config.get('Files', 'AutoPlaylistFile', fallback=ConfigDefaults.auto_playlist_file)
 
@@ -177,6 +200,50 @@ class Config:
                 print("[Warning] JokeSubbreditList data invalid, will not bind to any status.")
                 self.reddit_joke_subreddit_list = set()
 
+        if self.usage_flush_size < 1:
+            logger.warning("UsageFlushSize must be at least 1, usage will be written for every event.")
+            self.usage_flush_size = 1
+
+        if self.database_journal_mode.upper() not in ConnectionProfile.JOURNAL_MODES:
+            logger.warning("JournalMode '%s' is invalid, using %s." % (self.database_journal_mode, ConfigDefaults.database_journal_mode))
+            self.database_journal_mode = ConfigDefaults.database_journal_mode
+
+        if self.database_synchronous.upper() not in ConnectionProfile.SYNCHRONOUS_LEVELS:
+            logger.warning("Synchronous '%s' is invalid, using %s." % (self.database_synchronous, ConfigDefaults.database_synchronous))
+            self.database_synchronous = ConfigDefaults.database_synchronous
+
+        if self.database_temp_store.upper() not in ConnectionProfile.TEMP_STORES:
+            logger.warning("TempStore '%s' is invalid, using %s." % (self.database_temp_store, ConfigDefaults.database_temp_store))
+            self.database_temp_store = ConfigDefaults.database_temp_store
+
+        if self.group_commit_size < 1:
+            logger.warning("GroupCommitSize must be at least 1, each write will be committed on its own.")
+            self.group_commit_size = 1
+
+        if self.database_readers < 1:
+            logger.warning("Readers must be at least 1, using 1.")
+            self.database_readers = 1
+
+        if self.archive_batch_size < 1:
+            logger.warning("ArchiveBatchSize must be at least 1, using {0}.".format(ConfigDefaults.archive_batch_size))
+            self.archive_batch_size = ConfigDefaults.archive_batch_size
+
+        try:
+            start, end = (datetime.datetime.strptime(x.strip(), "%H:%M").time() for x in self.auto_archive_window.split("-"))
+            self.auto_archive_window = (start, end)
+        except ValueError:
+            logger.warning("AutoArchiveWindow '{0}' is invalid, using {1}.".format(self.auto_archive_window, ConfigDefaults.auto_archive_window))
+            start, end = (datetime.datetime.strptime(x, "%H:%M").time() for x in ConfigDefaults.auto_archive_window.split("-"))
+            self.auto_archive_window = (start, end)
+
+        if self.activity_retention < 0:
+            logger.warning("ActivityRetention cannot be negative, hourly activity will be kept.")
+            self.activity_retention = 0
+
+        if self.usage_cache_size < 0:
+            logger.warning("UsageCacheSize cannot be negative, the usage cache will be disabled.")
+            self.usage_cache_size = 0
+
         if not self.database_name:
             raise HelpfulError(
                 "No database name specified in the config.",
@@ -203,6 +270,27 @@ class ConfigDefaults:
     password = None # This is not where you put your login info, go away.
     token = None    #
     database_name = 'abbot.sqlite3'
+    usage_flush_interval = 10
+    usage_flush_size = 100
+    usage_journal = True
+    usage_journal_sync = False
+    database_journal_mode = 'WAL'
+    database_synchronous = 'NORMAL'
+    database_cache_size = -16000
+    database_mmap_size = 67108864
+    database_temp_store = 'MEMORY'
+    database_busy_timeout = 5000
+    group_commit_window = 50
+    group_commit_size = 500
+    usage_cache_size = 1000
+    database_readers = 4
+    rank_deadline = 10
+    rank_cache_ttl = 60
+    reaction_window = 2000
+    archive_batch_size = 500
+    auto_archive = True
+    auto_archive_window = '03:00-06:00'
+    activity_retention = 90
 
     owner_id = None
     command_prefix = '!'
@@ -1,27 +1,120 @@
+import asyncio
+import concurrent.futures
 import datetime
+import functools
+import hashlib
 import inflect
+import json
 import logging
 logger = logging.getLogger('abbot')
 import os
+import queue
+import re
+import shutil
 import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
 from pathlib import Path
+from sketches import HyperLogLog
+import columnar
 
 DATABASE_DDL = 'config/abbot.sqlite3.sql'
-ARCHIVE_SQL = 'sql/archive_db.sql'
 DATABASE_UPDATE_FOLDER = 'sql/updates'
+ARCHIVE_DDL = 'sql/archive_month.sql'
+
+class ConnectionProfile:
+    """
+    The SQLite settings applied once to each connection when it is opened.
+    """
+    JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+    SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+    TEMP_STORES = ('DEFAULT', 'FILE', 'MEMORY')
+
+    def __init__(self, journalMode='WAL', synchronous='NORMAL', cacheSize=-16000, mmapSize=67108864, tempStore='MEMORY', busyTimeout=5000):
+        """
+        Create a connection profile.
+        journalMode -- One of JOURNAL_MODES.  WAL lets readers continue while the writer commits.
+        synchronous -- One of SYNCHRONOUS_LEVELS.  NORMAL is safe with WAL and avoids an fsync per commit.
+        cacheSize   -- Page cache size; positive is pages, negative is KiB.
+        mmapSize    -- Bytes of the database file to memory map; 0 disables it.
+        tempStore   -- One of TEMP_STORES.
+        busyTimeout -- Milliseconds to wait for a lock before giving up.
+        """
+        self.journalMode = journalMode.upper()
+        self.synchronous = synchronous.upper()
+        self.cacheSize = int(cacheSize)
+        self.mmapSize = int(mmapSize)
+        self.tempStore = tempStore.upper()
+        self.busyTimeout = int(busyTimeout)
+
+        if self.journalMode not in self.JOURNAL_MODES:
+            raise ValueError("Invalid journal mode: {0}".format(journalMode))
+        if self.synchronous not in self.SYNCHRONOUS_LEVELS:
+            raise ValueError("Invalid synchronous level: {0}".format(synchronous))
+        if self.tempStore not in self.TEMP_STORES:
+            raise ValueError("Invalid temp store: {0}".format(tempStore))
+
+    def apply(self, connection):
+        """
+        Apply the profile to a newly opened connection.
+        """
+        # Pragma values cannot be bound as parameters; they are validated in __init__.
+        connection.execute('pragma busy_timeout = {0}'.format(self.busyTimeout))
+        connection.execute('pragma journal_mode = {0}'.format(self.journalMode))
+        connection.execute('pragma synchronous = {0}'.format(self.synchronous))
+        connection.execute('pragma cache_size = {0}'.format(self.cacheSize))
+        connection.execute('pragma mmap_size = {0}'.format(self.mmapSize))
+        connection.execute('pragma temp_store = {0}'.format(self.tempStore))
+
+    @staticmethod
+    def active(connection):
+        """
+        Get the settings currently in effect on a connection, as a list of (name, value).
+        """
+        synchronous = connection.execute('pragma synchronous').fetchone()[0]
+        tempStore = connection.execute('pragma temp_store').fetchone()[0]
+        return [
+            ('Journal Mode', connection.execute('pragma journal_mode').fetchone()[0].upper()),
+            ('Synchronous', ConnectionProfile.SYNCHRONOUS_LEVELS[synchronous]),
+            ('Cache Size', connection.execute('pragma cache_size').fetchone()[0]),
+            ('Mmap Size', connection.execute('pragma mmap_size').fetchone()[0]),
+            ('Temp Store', ConnectionProfile.TEMP_STORES[tempStore]),
+            ('Busy Timeout', connection.execute('pragma busy_timeout').fetchone()[0])]
 
 class AbbotDatabase:
     """
     Abbot's Database class.  Used to keep track of the database name and connection.
+    The connection is opened once, tuned with the connection profile, and kept open for the
+    life of the object.
     """
-    def __init__(self, databaseName):
+    def __init__(self, databaseName, check=True, profile=None, cache=None, journal=None, rankCache=None, readOnly=False):
         """
-        Initialize a database.
+        Initialize a database.  If check is False, the database is assumed to exist and be up
+        to date (used for additional connections to an already checked database).  A readOnly
+        connection refuses any statement that would change the database.  cache is the
+        UsageCache and rankCache the RankCache to use; connections to the same database should
+        share them.  If a UsageJournal is given, any usage left in it is replayed when the
+        database is checked.
         """
         self.databaseName = databaseName
+        self.profile = profile if profile != None else ConnectionProfile()
+        self.cache = cache if cache != None else UsageCache()
+        self.rankCache = rankCache if rankCache != None else RankCache()
+        self.writtenServers = set()
+        self.journal = journal
+        self.readOnly = readOnly
         self.connection = None
         self.databaseVersion = 0
-        self.checkDB()
+        self.batchDepth = 0
+        self.transactionCallbacks = []
+        if check:
+            self.checkDB()
+        else:
+            self.connect()
 
     def checkDB(self):
         """
@@ -29,8 +122,17 @@ class AbbotDatabase:
         the database file must reside in the same folder as the scripts.
         If the database does not exist, then an attempt is made to create it with the
         supplied DDL file.
+        If the schema fingerprint saved by the last check shows the database is up to date,
+        the database is only connected to.
         """
+        started = time.monotonic()
         self.connection = None
+        if self.checkFingerprint():
+            logger.info("Database version {0} is up to date, checked in {1:.1f} ms.".format(self.databaseVersion, (time.monotonic() - started) * 1000))
+            if self.journal != None:
+                self.journal.replay(self)
+            return
+
         dbFile = Path(self.databaseName) # File should be in same directory as scripts.
 
         # if file does not exist, make an attempt at creating a blank database.
@@ -52,64 +154,118 @@ class AbbotDatabase:
                     logger.debug("Database {0} created.".format(self.databaseName))
 
                 except Exception as ex:
-                    self.connection = None
+                    self.close()
                     logger.error("Problem executing DDL: {0}".format(ex))
                 finally:
                     cur.close()
-                    self.connection.close()
 
             if not dbFile.is_file(): # one more check to be sure database was created correctly.
                 self.connection = None
         
-        self.connect()
+        if self.connection == None:
+            self.connect()
         self.databaseVersion = self.getVersion()
         logger.info("Database version {0}.".format(self.databaseVersion))
 
-        # See if there are updates.
-        updates = []
-        with os.scandir(DATABASE_UPDATE_FOLDER) as it:
-            for entry in it:
-                if entry.is_dir():
-                    if int(entry.name) > self.databaseVersion:
-                        updates.append(int(entry.name))
-        updates.sort()
-        
+        # See if there are updates.  If one fails, MigrationError is raised and the database is left
+        # at the last update that was applied.
+        runner = MigrationRunner(self.connection)
+        updates = runner.pending(self.databaseVersion)
         if len(updates) > 0:
             logger.info("{0} updates available.".format(len(updates)))
-            for update in updates:
-                self.performUpdate(update)
+            runner.run(updates)
+            self.databaseVersion = self.getVersion()
+            logger.info("Database updated to version {0}.".format(self.databaseVersion))
+        self.saveFingerprint(updates[-1] if len(updates) > 0 else self.databaseVersion)
+        logger.info("Database checked in {0:.1f} ms.".format((time.monotonic() - started) * 1000))
 
-        self.close()
+        if self.journal != None:
+            self.journal.replay(self)
 
-    def archive(self):
+    def fingerprintPath(self):
         """
-        Archive the current data into the archive tables.
+        Get the path of the file the schema fingerprint is saved in, next to the database.
+        """
+        return self.databaseName + '.schema'
+
+    def checkFingerprint(self):
+        """
+        Check the database against the schema fingerprint saved by the last full check: the database
+        version, and the modification time of the updates folder, which changes when an update is
+        added to or removed from it.  Connects to the database (the connection is kept even when it is
+        not up to date), and returns True if it is up to date, without looking at the update files.
         """
-        result = True
         try:
-            logger.debug("Trying to archive the database: {0}".format(self.databaseName))
-            sql = open(ARCHIVE_SQL, 'r').read()
-            self.connect()
-            cur = self.connection.cursor()
-            cur.executescript(sql)
+            with open(self.fingerprintPath(), 'r') as fingerprintFile:
+                fingerprint = json.load(fingerprintFile)
+            if os.stat(DATABASE_UPDATE_FOLDER).st_mtime_ns != fingerprint['updatesModified']:
+                return False
+            if not os.path.isfile(self.databaseName):
+                return False
+        except (OSError, ValueError, KeyError):
+            return False
 
-            logger.debug("Database {0} archived.".format(self.databaseName))
-            result = True
+        if not self.connect():
+            return False
+        self.databaseVersion = self.getVersion()
+        return self.databaseVersion == fingerprint['version'] and self.databaseVersion >= fingerprint['latestUpdate']
 
-        except Exception as ex:
-            self.connection = None
-            logger.error("Problem executing SQL: {0}".format(ex))
-            result = False
-        finally:
-            cur.close()
-            return result
+    def saveFingerprint(self, latestUpdate):
+        """
+        Save the schema fingerprint after a full check.  latestUpdate is the newest update in the
+        updates folder that applies to the database.
+        """
+        try:
+            fingerprint = {
+                'version': self.databaseVersion,
+                'latestUpdate': latestUpdate,
+                'updatesModified': os.stat(DATABASE_UPDATE_FOLDER).st_mtime_ns}
+            temporaryPath = self.fingerprintPath() + '.tmp'
+            with open(temporaryPath, 'w') as fingerprintFile:
+                json.dump(fingerprint, fingerprintFile)
+            os.replace(temporaryPath, self.fingerprintPath())
+        except OSError as ex:
+            logger.warning("Could not save the schema fingerprint: {0}".format(ex))
+
+    def archive(self, batchSize=500, activityDays=0):
+        """
+        Archive the current data into last month's archive file, batchSize rows at a time (see
+        UsageArchiver).  An archive that was interrupted is finished first, and months archived into
+        the archive tables by older versions are moved to their own files.  If activityDays is more
+        than 0, hourly activity older than that many days is deleted.
+        """
+        logger.debug("Trying to archive the database: {0}".format(self.databaseName))
+        progress = UsageArchiver.start(self)
+        while progress != None and not progress.done:
+            progress = UsageArchiver.step(self, batchSize)
+
+        if progress == None:
+            return False
+
+        while UsageArchiver.moveLegacyArchive(self) != None:
+            pass
+
+        if activityDays > 0:
+            deleted = batchSize
+            while deleted == batchSize:
+                deleted = UsageActivity.prune(self, activityDays, batchSize)
+
+        logger.debug("Database {0} archived.".format(self.databaseName))
+        return True
 
     def connect(self):
         """
         Make a connection to the database.
         """
         try:
-            self.connection = sqlite3.connect(self.databaseName)
+            # Connections may be created on one thread and used on another (see AsyncAbbotDatabase),
+            # but each connection is only ever used by one thread at a time.
+            self.connection = sqlite3.connect(self.databaseName, timeout=self.profile.busyTimeout / 1000, check_same_thread=False)
+            self.connection.row_factory = sqlite3.Row
+            self.profile.apply(self.connection)
+            HyperLogLog.register(self.connection)
+            if self.readOnly:
+                self.connection.execute('pragma query_only = 1')
             logger.debug("Database connected.")
             return True
         except BaseException as ex:
@@ -131,6 +287,101 @@ class AbbotDatabase:
             self.connection = None
             return False
 
+    def commit(self):
+        """
+        Commit the current transaction, unless a batch is in progress.  Inside a batch the
+        commit is deferred until the batch completes.
+        """
+        if self.batchDepth == 0:
+            self.connection.commit()
+            self._endTransaction(True)
+
+    def usageWritten(self, server):
+        """
+        Note that usage for server has been written, so any rankings cached for it are out of date.
+        The server is marked again when the transaction ends, in case rankings were calculated
+        from the data committed before the write.
+        """
+        self.rankCache.markDirty(server)
+        self.writtenServers.add(server)
+
+    def onTransactionEnd(self, func):
+        """
+        Call func(committed) once the current transaction has been committed (committed is True)
+        or rolled back (committed is False).
+        """
+        self.transactionCallbacks.append(func)
+
+    def _endTransaction(self, committed):
+        """
+        Run the callbacks waiting for the current transaction to end.
+        """
+        self.cache.endTransaction()
+        for server in self.writtenServers:
+            self.rankCache.markDirty(server)
+        self.writtenServers.clear()
+
+        callbacks = self.transactionCallbacks
+        self.transactionCallbacks = []
+        for func in callbacks:
+            try:
+                func(committed)
+            except Exception as ex:
+                logger.error("Problem running transaction callback: {0}".format(ex))
+
+    @contextmanager
+    def batch(self):
+        """
+        Group several writes into a single transaction.  The transaction is committed when
+        the outermost batch completes, or rolled back if it raises.  A batch inside another
+        batch uses a savepoint, so if it raises only its own writes are rolled back.
+        """
+        if self.connection == None:
+            self.connect()
+
+        savepoint = None
+        if self.batchDepth == 0:
+            if not self.connection.in_transaction:
+                self.connection.execute('begin')
+        else:
+            savepoint = 'batch{0}'.format(self.batchDepth)
+            self.connection.execute('savepoint {0}'.format(savepoint))
+
+        self.batchDepth += 1
+        try:
+            yield self
+        except BaseException:
+            self.batchDepth -= 1
+            self.cache.clear() # Cached rows may include the writes being rolled back.
+            if savepoint != None:
+                self.connection.execute('rollback to {0}'.format(savepoint))
+                self.connection.execute('release {0}'.format(savepoint))
+            else:
+                self.connection.rollback()
+                self._endTransaction(False)
+            raise
+        else:
+            self.batchDepth -= 1
+            if savepoint != None:
+                self.connection.execute('release {0}'.format(savepoint))
+            else:
+                try:
+                    self.connection.commit()
+                except BaseException:
+                    self.connection.rollback()
+                    self._endTransaction(False)
+                    raise
+                self._endTransaction(True)
+
+    def getSettings(self):
+        """
+        Get the connection settings currently in effect, as a list of (name, value).
+        """
+        if self.connection == None:
+            self.connect()
+
+        return ConnectionProfile.active(self.connection)
+
     def getVersion(self):
         """
         Get the database version.
@@ -140,7 +391,6 @@ class AbbotDatabase:
             if self.connection == None:
                 self.connect()
 
-            self.connection.row_factory = sqlite3.Row
             cur = self.connection.cursor()
             cur.execute('pragma user_version') # the SQL used to get the user_version variable.
             row = cur.fetchone() # There "should" only be one record!
@@ -154,30 +404,592 @@ class AbbotDatabase:
         finally:
             return version
 
-    def performUpdate(self, updateNumber):
-        updateListFileName = "{0}/{1}/update{1}.txt".format(DATABASE_UPDATE_FOLDER, updateNumber)
+class MigrationError(Exception):
+    """
+    An update to the database failed.  The updates before it were applied, and nothing from it was.
+    """
+    def __init__(self, update, fileName, statement, error):
+        Exception.__init__(self, "Update {0} failed in {1}: {2}".format(update, fileName, error))
+        self.update = update
+        self.fileName = fileName
+        self.statement = statement
+        self.error = error
+
+class MigrationRunner:
+    """
+    Applies the database updates in the updates folder.  Each update is a folder named for the version it
+    updates the database to, with an updateN.txt listing the files to run in order.  Every update runs
+    on one connection in a savepoint, so an update that fails is rolled back completely and no later
+    updates are run.  Each file's checksum and how long it took are recorded in schema_migrations.
+    """
+    LEDGER_DDL = """
+        CREATE TABLE IF NOT EXISTS `schema_migrations` (
+            `version`	INTEGER NOT NULL,
+            `file_name`	TEXT NOT NULL,
+            `checksum`	TEXT NOT NULL,
+            `duration_ms`	REAL,
+            `applied_date`	TEXT,
+            PRIMARY KEY(`version`,`file_name`)
+        )"""
+    # The update files manage their own transactions and foreign key checks, which can't be done
+    # inside the runner's savepoints.
+    SKIPPED_STATEMENT = re.compile(r'^(begin|commit|end|rollback)(\s+transaction)?\s*;?$|^pragma\s+foreign_keys\b', re.IGNORECASE)
+    COMMENT = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+
+    def __init__(self, connection, folder=DATABASE_UPDATE_FOLDER):
+        """
+        Initialize the runner for a connection and an updates folder.
+        """
+        self.connection = connection
+        self.folder = folder
+        self.timings = []
+
+    def pending(self, version):
+        """
+        Get the updates newer than version, in order.
+        """
+        updates = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_dir() and entry.name.isdigit() and int(entry.name) > version:
+                    updates.append(int(entry.name))
+        return sorted(updates)
+
+    def files(self, update):
+        """
+        Get the paths of the files in an update, in the order they are run.
+        """
+        updateFolder = os.path.join(self.folder, str(update))
+        with open(os.path.join(updateFolder, "update{0}.txt".format(update)), 'r') as updateList:
+            return [os.path.join(updateFolder, line.strip()) for line in updateList if line.strip()]
+
+    @staticmethod
+    def statements(sql):
+        """
+        Split a script into its statements, leaving out the ones the runner handles itself.
+        """
+        statements = []
+        statement = ""
+        for line in sql.splitlines(True):
+            statement += line
+            if sqlite3.complete_statement(statement):
+                statements.append(statement.strip())
+                statement = ""
+        if MigrationRunner.COMMENT.sub('', statement).strip(): # The last statement may not end with a semicolon.
+            statements.append(statement.strip())
+
+        return [statement for statement in statements
+            if MigrationRunner.COMMENT.sub('', statement).strip() and not MigrationRunner.SKIPPED_STATEMENT.match(MigrationRunner.COMMENT.sub('', statement).strip())]
+
+    def run(self, updates):
+        """
+        Apply the updates in order, each in its own savepoint.  Returns a list of (update, file name,
+        milliseconds) for the files that were run, which is also kept in timings.  Raises MigrationError
+        if an update fails, after committing the updates before it.
+        """
+        self.timings = []
+        if self.connection.in_transaction:
+            self.connection.commit()
+        self.connection.execute('begin')
         try:
-            logger.debug("Trying to apply update {0}".format(updateNumber))
-            updateListFile = open(updateListFileName, 'r')
-            updateFiles = updateListFile.readlines()
-            updateListFile.close()
+            self.connection.execute(self.LEDGER_DDL)
+            for update in updates:
+                logger.debug("Trying to apply update {0}".format(update))
+                savepoint = 'update_{0}'.format(update)
+                self.connection.execute('savepoint {0}'.format(savepoint))
+                updateStarted = time.monotonic()
+                fileName = "update{0}.txt".format(update)
+                statement = None
+                try:
+                    for path in self.files(update):
+                        fileName = os.path.basename(path)
+                        logger.debug("Applying update: {0}".format(path))
+                        with open(path, 'rb') as updateFile:
+                            contents = updateFile.read()
+                        started = time.monotonic()
+                        for statement in self.statements(contents.decode('utf-8')):
+                            self.connection.execute(statement)
+                        statement = None
+                        duration = (time.monotonic() - started) * 1000
+                        self.connection.execute("""insert or replace into schema_migrations (version, file_name, checksum, duration_ms, applied_date)
+                            VALUES (?, ?, ?, ?, datetime('now'))""", (update, fileName, hashlib.sha256(contents).hexdigest(), duration))
+                        self.timings.append((update, fileName, duration))
 
-            self.connect()
-            cur = self.connection.cursor()
-            for fileName in updateFiles:
-                updateFileName = "{0}/{1}/{2}".format(DATABASE_UPDATE_FOLDER, updateNumber, fileName[:-1] if fileName[-1] == '\n' else fileName)
-                logger.debug("Applying update: {0}".format(updateFileName))
+                except Exception as ex:
+                    self.connection.execute('rollback to {0}'.format(savepoint))
+                    self.connection.execute('release {0}'.format(savepoint))
+                    logger.error("Problem executing update {0} ({1}): {2}".format(update, fileName, ex))
+                    if statement != None:
+                        logger.error("Failed statement: {0}".format(statement))
+                    raise MigrationError(update, fileName, statement, ex)
+
+                self.connection.execute('release {0}'.format(savepoint))
+                logger.info("Update {0} applied in {1:.1f} ms.".format(update, (time.monotonic() - updateStarted) * 1000))
+        finally:
+            self.connection.commit()
+
+        return self.timings
+
+    @staticmethod
+    def dryRun(databaseName, folder=DATABASE_UPDATE_FOLDER):
+        """
+        Apply the pending updates to a copy of the database, to see how long they would take and whether
+        they would work, without touching the database itself.  Returns the list of (update, file name,
+        milliseconds) for the files that were run, and the MigrationError if an update failed (or None).
+        """
+        copyFolder = tempfile.mkdtemp()
+        copyName = os.path.join(copyFolder, os.path.basename(databaseName))
+        source = sqlite3.connect(databaseName)
+        copy = sqlite3.connect(copyName)
+        try:
+            started = time.monotonic()
+            if hasattr(source, 'backup'):
+                source.backup(copy)
+            else: # The backup API is only in Python 3.7 and later.
+                copy.close()
+                source.execute("vacuum into ?", (copyName,))
+                copy = sqlite3.connect(copyName)
+            logger.info("Copied {0} in {1:.1f} ms.".format(databaseName, (time.monotonic() - started) * 1000))
+
+            runner = MigrationRunner(copy, folder)
+            version = copy.execute('pragma user_version').fetchone()[0]
+            updates = runner.pending(version)
+            logger.info("Database version {0}, {1} updates pending.".format(version, len(updates)))
+            try:
+                runner.run(updates)
+            except MigrationError as ex:
+                return runner.timings, ex
+            return runner.timings, None
+        finally:
+            source.close()
+            copy.close()
+            shutil.rmtree(copyFolder)
+
+class GroupCommitStats:
+    """
+    Counters for the writes that were committed together by the writer thread.
+    """
+    def __init__(self):
+        self.batches = 0
+        self.writes = 0
+        self.largestBatch = 0
+        self.lastBatch = 0
+        self.commitTime = 0.0
+        self.slowestCommit = 0.0
+
+    def record(self, batchSize, commitTime):
+        """
+        Record one committed batch.  commitTime is in seconds.
+        """
+        self.batches += 1
+        self.writes += batchSize
+        self.lastBatch = batchSize
+        self.largestBatch = max(self.largestBatch, batchSize)
+        self.commitTime += commitTime
+        self.slowestCommit = max(self.slowestCommit, commitTime)
+
+    def summary(self):
+        """
+        Get the counters as a list of (name, value).
+        """
+        batches = self.batches if self.batches > 0 else 1
+        return [
+            ('Commits', self.batches),
+            ('Writes', self.writes),
+            ('Average Batch', round(self.writes / batches, 1)),
+            ('Largest Batch', self.largestBatch),
+            ('Average Commit (ms)', round(self.commitTime * 1000 / batches, 2)),
+            ('Slowest Commit (ms)', round(self.slowestCommit * 1000, 2))]
+
+class UsageCache:
+    """
+    A bounded, least recently used cache of usage records, keyed by the table name followed by
+    the record's primary key, for example ('usage_messages', user, server, channel).  Each entry
+    is a dict of the record's columns.  Writes update cached records in place, so the cache can
+    be shared by every connection to the database.  It also keeps the rows read by
+    UsageSnapshot.fetch, keyed by (SNAPSHOT, user, server, channel), which are removed when any of
+    the user's usage on the server is written.
+    """
+    SNAPSHOT = 'usage_snapshot'
+    def __init__(self, maxSize=1000):
+        """
+        Initialize the cache.  maxSize is the number of records to keep; 0 disables the cache.
+        """
+        self.maxSize = maxSize
+        self.records = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0 # Changed by every write; see put().
+        self.uncommitted = False # True while there are writes that have not been committed.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Get a copy of the cached record for key, or None if it is not cached.
+        """
+        if self.maxSize <= 0:
+            return None
+
+        with self.lock:
+            record = self.records.get(key)
+            if record == None:
+                self.misses += 1
+                return None
+
+            self.records.move_to_end(key)
+            self.hits += 1
+            return dict(record)
+
+    def put(self, key, record, generation):
+        """
+        Cache a record read from the database.  generation is the value of self.generation taken
+        before the record was read; if anything was written or committed since then, or there
+        are uncommitted writes the read could not see, the record may already be out of date so
+        it is not cached.
+        """
+        if self.maxSize <= 0:
+            return
+
+        with self.lock:
+            if generation != self.generation or self.uncommitted:
+                return
+
+            self.records[key] = dict(record)
+            self.records.move_to_end(key)
+            while len(self.records) > self.maxSize:
+                self.records.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, key, add=None, maximum=None, assign=None):
+        """
+        Apply a write to the cached record for key, if it is cached.  add holds amounts to add
+        to columns, maximum holds values that replace a column if they are larger, and assign
+        holds values that replace a column.
+        """
+        with self.lock:
+            self.generation += 1
+            self.uncommitted = True
+            record = self.records.get(key)
+            if record == None:
+                return
+
+            for column, value in (add or {}).items():
+                record[column] += value
+            for column, value in (maximum or {}).items():
+                record[column] = max(record[column], value)
+            for column, value in (assign or {}).items():
+                record[column] = value
+
+    def written(self, user, server, channel):
+        """
+        Note that usage for the user/server/channel was written, which makes the user's cached
+        snapshots for the channel and for the whole server out of date.
+        """
+        with self.lock:
+            self.generation += 1
+            self.uncommitted = True
+            self.records.pop((self.SNAPSHOT, user, server, channel), None)
+            self.records.pop((self.SNAPSHOT, user, server, None), None)
+
+    def discard(self, key):
+        """
+        Remove the record for key, and the snapshots that include it, from the cache.
+        """
+        with self.lock:
+            self.generation += 1
+            self.uncommitted = True
+            self.records.pop(key, None)
+            if key[0] != self.SNAPSHOT:
+                self.records.pop((self.SNAPSHOT,) + key[1:4], None)
+                self.records.pop((self.SNAPSHOT,) + key[1:3] + (None,), None)
+
+    def endTransaction(self):
+        """
+        Note that the writes made so far have been committed or rolled back.
+        """
+        with self.lock:
+            self.generation += 1
+            self.uncommitted = False
+
+    def clear(self):
+        """
+        Remove every record from the cache.
+        """
+        with self.lock:
+            self.generation += 1
+            self.records.clear()
+
+    def summary(self):
+        """
+        Get the counters as a list of (name, value).
+        """
+        lookups = self.hits + self.misses
+        return [
+            ('Cached Rows', '{0}/{1}'.format(len(self.records), self.maxSize)),
+            ('Hits', self.hits),
+            ('Misses', self.misses),
+            ('Hit Ratio', '{0:.1%}'.format(self.hits / lookups if lookups > 0 else 0)),
+            ('Evictions', self.evictions)]
+
+class RankCache:
+    """
+    Keeps calculated rankings for a short time, keyed by (table, column, server, channel,
+    maxRankings, since, until), so repeated rank requests don't recalculate them.  Writing usage for a server
+    marks it dirty, which makes the rankings cached for it out of date straight away.
+    """
+    PRUNE_SIZE = 1000 # Expired rankings are removed once this many are cached.
+
+    def __init__(self, ttl=60):
+        """
+        Initialize the cache.  ttl is the number of seconds to keep rankings for; 0 disables it.
+        """
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.rankings = {}
+        self.versions = {} # The number of times each server has been marked dirty.
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, server):
+        """
+        Get the current version of server's usage, to pass to put().
+        """
+        with self.lock:
+            return self.versions.get(server, 0)
+
+    def markDirty(self, server):
+        """
+        Note that usage for server has changed.
+        """
+        with self.lock:
+            self.versions[server] = self.versions.get(server, 0) + 1
+
+    def get(self, key):
+        """
+        Get a copy of the cached rankings for key, or None if there are none or they are out of
+        date.  key[2] is the server.
+        """
+        if self.ttl <= 0:
+            return None
+
+        with self.lock:
+            entry = self.rankings.get(key)
+            if entry != None and entry[1] == self.versions.get(key[2], 0) and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return list(entry[2])
+
+            self.misses += 1
+            return None
+
+    def put(self, key, version, rankings):
+        """
+        Cache rankings for key.  version is the server's version from before the rankings were
+        calculated; if the server was marked dirty since, the rankings are not cached.
+        """
+        if self.ttl <= 0:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            if version == self.versions.get(key[2], 0):
+                self.rankings[key] = (now, version, list(rankings))
+
+            if len(self.rankings) > self.PRUNE_SIZE:
+                self.rankings = {k: entry for k, entry in self.rankings.items() if now - entry[0] < self.ttl}
+
+    def recalculated(self, description, recomputeTime):
+        """
+        Log how long rankings took to recalculate (recomputeTime, in seconds) and the hit ratio.
+        """
+        lookups = self.hits + self.misses
+        logger.debug("Rank cache hit ratio {0:.1%}; recalculated {1} rankings in {2:.1f} ms.".format(
+            self.hits / lookups if lookups > 0 else 0, description, recomputeTime * 1000))
+
+    def clear(self):
+        """
+        Remove all of the cached rankings.
+        """
+        with self.lock:
+            self.rankings.clear()
+
+class AsyncAbbotDatabase:
+    """
+    Runs database work off of the event loop.  All writes go through a single writer thread,
+    fed by a queue, so they are applied in order; reads are spread over a small pool of
+    reader threads, each with its own read-only connection, so several reads can run at once.
+
+    write() and read() take a function whose first argument is the AbbotDatabase to use,
+    followed by any other arguments, and return an awaitable for the function's result.
+    For example:
+        usage = await database.read(MessageUsage, user, server, channel)
+
+    groupWrite() works like write(), but writes queued together share a single transaction
+    (group commit).  When the bot is idle a write is committed straight away; when writes
+    arrive faster than they can be committed, the writer keeps the transaction open for up to
+    groupCommitWindow seconds or groupCommitSize writes so the batches grow with the load.
+
+    The writer and readers share one UsageCache of usageCacheSize records, and one RankCache
+    that keeps rankings for rankCacheTTL seconds.
+    """
+    STOP = object() # Queued by close() to stop the writer thread.
+
+    def __init__(self, databaseName, loop=None, readers=2, profile=None, groupCommitWindow=0.05, groupCommitSize=500, usageCacheSize=1000, journal=None, rankCacheTTL=60):
+        """
+        Check the database (replaying journal, if given) and start the writer thread and reader pool.
+        """
+        self.databaseName = databaseName
+        self.profile = profile
+        self.loop = loop if loop != None else asyncio.get_event_loop()
+        self.usageCache = UsageCache(usageCacheSize)
+        self.rankCache = RankCache(rankCacheTTL)
+        self.database = AbbotDatabase(databaseName, profile=profile, cache=self.usageCache, journal=journal, rankCache=self.rankCache)
+        self.groupCommitWindow = groupCommitWindow
+        self.groupCommitSize = groupCommitSize
+        self.groupCommitStats = GroupCommitStats()
+        self.readerDatabases = []
+        self.readerLocal = threading.local()
+        self.readerPool = concurrent.futures.ThreadPoolExecutor(max_workers=readers)
+        self.writeQueue = queue.Queue()
+        self.writer = threading.Thread(target=self._writerLoop, name='abbot-db-writer', daemon=True)
+        self.writer.start()
+
+    def write(self, func, *args, **kwargs):
+        """
+        Queue func(database, *args, **kwargs) to run on the writer thread.
+        """
+        future = self.loop.create_future()
+        self.writeQueue.put((future, func, args, kwargs, False))
+        return future
+
+    def groupWrite(self, func, *args, **kwargs):
+        """
+        Queue func(database, *args, **kwargs) to run on the writer thread, sharing a transaction
+        with any other group writes around it.
+        """
+        future = self.loop.create_future()
+        self.writeQueue.put((future, func, args, kwargs, True))
+        return future
+
+    def read(self, func, *args, **kwargs):
+        """
+        Run func(database, *args, **kwargs) on one of the reader threads.
+        """
+        return self.loop.run_in_executor(self.readerPool, functools.partial(self._read, func, *args, **kwargs))
+
+    def close(self):
+        """
+        Finish any queued writes, stop the threads, and close the connections.
+        """
+        if self.writer.is_alive():
+            self.writeQueue.put(self.STOP)
+            self.writer.join()
+
+        self.readerPool.shutdown(wait=True)
+        for database in self.readerDatabases:
+            if database.connection != None:
+                database.close()
+        if self.database.connection != None:
+            self.database.close()
+        if self.database.journal != None:
+            self.database.journal.close()
+
+    def _read(self, func, *args, **kwargs):
+        """
+        Run func on the calling reader thread with that thread's database.
+        """
+        database = getattr(self.readerLocal, 'database', None)
+        if database == None:
+            database = AbbotDatabase(self.databaseName, check=False, profile=self.profile, cache=self.usageCache, rankCache=self.rankCache, readOnly=True)
+            self.readerLocal.database = database
+            self.readerDatabases.append(database)
+
+        return func(database, *args, **kwargs)
+
+    def _writerLoop(self):
+        """
+        Apply the queued writes, in order, until close() is called.
+        """
+        job = self.writeQueue.get()
+        while job is not self.STOP:
+            future, func, args, kwargs, grouped = job
+            if grouped:
+                job = self._groupCommit(job)
+                if job == None:
+                    job = self.writeQueue.get()
+                continue
+
+            try:
+                result = func(self.database, *args, **kwargs)
+            except BaseException as ex:
+                logger.error("Problem running database write: {0}".format(ex))
+                self.loop.call_soon_threadsafe(self._resolve, future, None, ex)
+            else:
+                self.loop.call_soon_threadsafe(self._resolve, future, result, None)
+
+            job = self.writeQueue.get()
+
+    def _groupCommit(self, job):
+        """
+        Run job, and any group writes queued behind it, in one transaction.  Returns the next
+        job taken from the queue that could not be part of the group, if any.
+        """
+        started = time.monotonic()
+        deadline = started + self.groupCommitWindow
+        # Only wait for more writes if the last batch shows writes are arriving together.
+        linger = self.groupCommitStats.lastBatch > 1
+        results = []
+        nextJob = None
+
+        try:
+            with self.database.batch():
+                while True:
+                    future, func, args, kwargs, grouped = job
+                    try:
+                        with self.database.batch(): # A failed write only rolls back itself.
+                            results.append((future, func(self.database, *args, **kwargs), None))
+                    except Exception as ex:
+                        logger.error("Problem running database write: {0}".format(ex))
+                        results.append((future, None, ex))
+
+                    remaining = deadline - time.monotonic()
+                    if len(results) >= self.groupCommitSize or remaining <= 0:
+                        break
+
+                    try:
+                        job = self.writeQueue.get(timeout=remaining) if linger else self.writeQueue.get_nowait()
+                    except queue.Empty:
+                        break
 
-                updateFile = open(updateFileName, 'r').read()
-                cur.executescript(updateFile)
+                    if job is self.STOP or not job[4]:
+                        nextJob = job
+                        break
 
-            logger.debug("Update {0} complete.".format(updateNumber))
+                commitStarted = time.monotonic()
+
+            self.groupCommitStats.record(len(results), time.monotonic() - commitStarted)
 
         except Exception as ex:
-            logger.error("Problem executing update: {0}".format(ex))
-        finally:
-            cur.close()
-            self.connection.close()
+            logger.error("Problem committing database writes: {0}".format(ex))
+            results = [(future, None, ex) for future, result, exception in results]
+
+        for future, result, exception in results:
+            self.loop.call_soon_threadsafe(self._resolve, future, result, exception)
+
+        return nextJob
+
+    @staticmethod
+    def _resolve(future, result, exception):
+        """
+        Complete a write's future on the event loop.
+        """
+        if future.cancelled():
+            return
+
+        if exception != None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
 
 class Idea:
     """
@@ -216,7 +1028,7 @@ class Idea:
             cur.execute(insertSQL, values)
 
             # Save (commit) the changes
-            self.database.connection.commit()
+            self.database.commit()
             cur.close()
             return True
 
@@ -238,45 +1050,137 @@ class BaseUsage:
         self.channel = channel
         self.newRecord = True
 
-class MessageUsage(BaseUsage):
-    """
-    This class represents a usage_messages record and can insert or update records.
-    """
-    def __init__(self, database, user, server, channel, fetch=True):
+    @staticmethod
+    def _cacheKey(tableName, *key):
         """
-        Create a model for the message usage.
+        Get the usage cache key for a single record, or None if part of the key is missing
+        (queries that add up several records are not cached).
         """
-        BaseUsage.__init__(self, database, user, server, channel)
-        self.wordCount = 0
-        self.characterCount = 0
-        self.maxMessageLength = 0
-        self.messageCount = 0
-        self.urlCount = 0
-        self.lastMessageTimestamp = None
+        if any(value == None for value in key):
+            return None
+        return (tableName,) + key
 
-        if fetch:
-            self.get(user, server, channel)
-    
-    def get(self, user, server, channel):
+    def _fetch(self, sql, values, cacheKey=None):
         """
-        Get the message usage information for the specific user/server/channel.
-        At least one of user, server, or channel must be supplied.
+        Run a usage query and return its first row.  If cacheKey is given the row is read from,
+        or saved to, the usage cache.
         """
-        sql = """select user, 
-            sum(message_count) as message_count, 
-            sum(word_count) as word_count, 
-            sum(character_count) as character_count, 
-            sum(max_message_length) as max_message_length, 
-            sum(url_count) as url_count, 
-            max(last_message_timestamp) as last_message_timestamp 
-            from usage_messages """
-        if server == None and user == None and channel == None:
-            logger.error("Must supply at least user, server, or channel.")
-            return False
-        else:
-            # Build the where clause
-            sql += "where "
-            values = ()
+        if cacheKey != None:
+            row = self.database.cache.get(cacheKey)
+            if row != None:
+                return row
+            generation = self.database.cache.generation
+
+        cur = self.database.connection.cursor()
+        cur.execute(sql, values)
+        row = cur.fetchone() # There "should" only be one record!
+        cur.close()
+
+        if row != None and cacheKey != None:
+            self.database.cache.put(cacheKey, row, generation)
+        return row
+
+    @staticmethod
+    def _increment(database, sql, values, tableName, cacheKey=None, add=None, maximum=None, assign=None):
+        """
+        Run an increment (upsert) statement and commit it.  If the record is in the usage cache,
+        it is updated with add, maximum, and assign (see UsageCache.update).
+        """
+        if database == None:
+            logger.error("No valid DB connection available.")
+            return False
+
+        # Check that we have all the necessary data first.
+        if database.connection == None:
+            database.connect()
+
+        try:
+            cur = database.connection.cursor()
+            cur.execute(sql, values)
+            if cacheKey != None:
+                database.cache.update(cacheKey, add, maximum, assign)
+            database.cache.written(*values[:3])
+            database.usageWritten(values[1]) # The values of every usage table start with user, server, channel.
+
+            # Save (commit) the changes
+            database.commit()
+            cur.close()
+            return True
+
+        except BaseException as ex:
+            logger.error("There was a problem incrementing the {0} record: {1}".format(tableName, ex))
+            return False
+
+    @staticmethod
+    def _incrementMany(database, sql, rows, tableName, cacheUpdates=()):
+        """
+        Run an increment (upsert) statement once for each of the rows and commit them together.
+        cacheUpdates is a list of (cacheKey, add) to apply to the usage cache.
+        """
+        if database == None:
+            logger.error("No valid DB connection available.")
+            return False
+
+        # Check that we have all the necessary data first.
+        if database.connection == None:
+            database.connect()
+
+        try:
+            with database.batch():
+                cur = database.connection.cursor()
+                cur.executemany(sql, rows)
+                for cacheKey, add in cacheUpdates:
+                    database.cache.update(cacheKey, add)
+                for user, server, channel in set(row[:3] for row in rows):
+                    database.cache.written(user, server, channel)
+                for server in set(row[1] for row in rows):
+                    database.usageWritten(server)
+                cur.close()
+            return True
+
+        except BaseException as ex:
+            logger.error("There was a problem incrementing the {0} records: {1}".format(tableName, ex))
+            return False
+
+class MessageUsage(BaseUsage):
+    """
+    This class represents a usage_messages record and can insert or update records.
+    """
+    def __init__(self, database, user, server, channel, fetch=True):
+        """
+        Create a model for the message usage.
+        """
+        BaseUsage.__init__(self, database, user, server, channel)
+        self.wordCount = 0
+        self.characterCount = 0
+        self.maxMessageLength = 0
+        self.messageCount = 0
+        self.urlCount = 0
+        self.lastMessageTimestamp = None
+
+        if fetch:
+            self.get(user, server, channel)
+    
+    def get(self, user, server, channel):
+        """
+        Get the message usage information for the specific user/server/channel.
+        At least one of user, server, or channel must be supplied.
+        """
+        sql = """select user, 
+            sum(message_count) as message_count, 
+            sum(word_count) as word_count, 
+            sum(character_count) as character_count, 
+            sum(max_message_length) as max_message_length, 
+            sum(url_count) as url_count, 
+            max(last_message_timestamp) as last_message_timestamp 
+            from usage_messages """
+        if server == None and user == None and channel == None:
+            logger.error("Must supply at least user, server, or channel.")
+            return False
+        else:
+            # Build the where clause
+            sql += "where "
+            values = ()
 
             if user != None:
                 sql += "user = ? "
@@ -304,10 +1208,7 @@ class MessageUsage(BaseUsage):
                 if self.database.connection == None:
                     self.database.connect()
 
-                self.database.connection.row_factory = sqlite3.Row
-                cur = self.database.connection.cursor()
-                cur.execute(sql, values)
-                row = cur.fetchone() # There "should" only be one record!
+                row = self._fetch(sql, values, self._cacheKey('usage_messages', user, server, channel))
                 if row != None:
                     self.messageCount = row['message_count']
                     self.wordCount = row['word_count']
@@ -319,7 +1220,6 @@ class MessageUsage(BaseUsage):
                 else:
                     self.newRecord = True
 
-                cur.close()
                 return True
 
             except Exception as ex:
@@ -362,9 +1262,11 @@ class MessageUsage(BaseUsage):
         try:
             cur = self.database.connection.cursor()
             cur.execute(insertSQL, values)
+            self.database.cache.discard(('usage_messages', self.user, self.server, self.channel))
+            self.database.usageWritten(self.server)
 
             # Save (commit) the changes
-            self.database.connection.commit()
+            self.database.commit()
             cur.close()
             return True
 
@@ -404,9 +1306,11 @@ class MessageUsage(BaseUsage):
             # self.database.connect()
             cur = self.database.connection.cursor()
             cur.execute(updateSQL, values)
+            self.database.cache.discard(('usage_messages', self.user, self.server, self.channel))
+            self.database.usageWritten(self.server)
 
             # Save (commit) the changes
-            self.database.connection.commit()
+            self.database.commit()
             cur.close()
             return True
 
@@ -414,6 +1318,40 @@ class MessageUsage(BaseUsage):
             logger.error("There was a problem updating the usage_messages record: {0}".format(ex))
             return False
 
+    @staticmethod
+    def increment(database, user, server, channel, messages=1, words=0, chars=0, urls=0, maxLength=0):
+        """
+        Add to the message usage for the user/server/channel in a single statement, creating
+        the record if it does not exist yet.  maxLength only replaces the stored maximum
+        message length if it is larger.
+        """
+        upsertSQL = """
+            insert into usage_messages (
+                user,
+                server,
+                channel,
+                message_count,
+                word_count,
+                character_count,
+                max_message_length,
+                url_count,
+                last_message_timestamp
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            on conflict(user, server, channel) do update
+            set message_count = message_count + excluded.message_count,
+                word_count = word_count + excluded.word_count,
+                character_count = character_count + excluded.character_count,
+                max_message_length = max(max_message_length, excluded.max_message_length),
+                url_count = url_count + excluded.url_count,
+                last_message_timestamp = excluded.last_message_timestamp"""
+        ts = datetime.datetime.now()
+        values = (user, server, channel, messages, words, chars, maxLength, urls, ts.strftime("%Y-%m-%d %H:%M:%S:%f"))
+
+        return BaseUsage._increment(database, upsertSQL, values, 'usage_messages', ('usage_messages', user, server, channel),
+            add={'message_count': messages, 'word_count': words, 'character_count': chars, 'url_count': urls},
+            maximum={'max_message_length': maxLength},
+            assign={'last_message_timestamp': values[-1]})
+
 class ReactionUsage(BaseUsage):
     """
     This class represents a usage_reactions record and can insert or update records.
@@ -476,10 +1414,7 @@ class ReactionUsage(BaseUsage):
                 if self.database.connection == None:
                     self.database.connect()
 
-                self.database.connection.row_factory = sqlite3.Row
-                cur = self.database.connection.cursor()
-                cur.execute(sql, values)
-                row = cur.fetchone() # There "should" only be one record!
+                row = self._fetch(sql, values, self._cacheKey('usage_reactions', user, server, channel))
                 if row != None:
                     self.messagesReacted = row['messages_reacted_count']
                     self.userReacted = row['user_reacted_count']
@@ -489,7 +1424,6 @@ class ReactionUsage(BaseUsage):
                 else:
                     self.newRecord = True
 
-                cur.close()
                 return True
 
             except Exception as ex:
@@ -529,9 +1463,11 @@ class ReactionUsage(BaseUsage):
         try:
             cur = self.database.connection.cursor()
             cur.execute(insertSQL, values)
+            self.database.cache.discard(('usage_reactions', self.user, self.server, self.channel))
+            self.database.usageWritten(self.server)
 
             # Save (commit) the changes
-            self.database.connection.commit()
+            self.database.commit()
             cur.close()
             return True
 
@@ -568,9 +1504,11 @@ class ReactionUsage(BaseUsage):
             # self.database.connect()
             cur = self.database.connection.cursor()
             cur.execute(updateSQL, values)
+            self.database.cache.discard(('usage_reactions', self.user, self.server, self.channel))
+            self.database.usageWritten(self.server)
 
             # Save (commit) the changes
-            self.database.connection.commit()
+            self.database.commit()
             cur.close()
             return True
 
@@ -578,10 +1516,53 @@ class ReactionUsage(BaseUsage):
             logger.error("There was a problem updating the usage_reactions record: {0}".format(ex))
             return False
 
+    @staticmethod
+    def increment(database, user, server, channel, messagesReacted=0, userReacted=0, messageReactionsReceived=0, reactionsReceived=0):
+        """
+        Add to the reaction usage for the user/server/channel in a single statement, creating
+        the record if it does not exist yet.  Removed reactions are passed as negative values.
+        """
+        upsertSQL = """
+            insert into usage_reactions (
+                user,
+                server,
+                channel,
+                messages_reacted_count,
+                user_reacted_count,
+                message_reactions_received_count,
+                reactions_received_count
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            on conflict(user, server, channel) do update
+            set messages_reacted_count = messages_reacted_count + excluded.messages_reacted_count,
+                user_reacted_count = user_reacted_count + excluded.user_reacted_count,
+                message_reactions_received_count = message_reactions_received_count + excluded.message_reactions_received_count,
+                reactions_received_count = reactions_received_count + excluded.reactions_received_count"""
+        values = (user, server, channel, messagesReacted, userReacted, messageReactionsReceived, reactionsReceived)
+
+        return BaseUsage._increment(database, upsertSQL, values, 'usage_reactions', ('usage_reactions', user, server, channel),
+            add={'messages_reacted_count': messagesReacted, 'user_reacted_count': userReacted,
+                'message_reactions_received_count': messageReactionsReceived, 'reactions_received_count': reactionsReceived})
+
 class MentionUsage(BaseUsage):
     """
     This class represents a usage_mentions record and can insert or update records.
     """
+    INCREMENT_SQL = """
+            insert into usage_mentions (
+                user,
+                server,
+                channel,
+                user_mentions,
+                user_mentioned,
+                channel_mentions,
+                role_mentions
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            on conflict(user, server, channel) do update
+            set user_mentions = user_mentions + excluded.user_mentions,
+                user_mentioned = user_mentioned + excluded.user_mentioned,
+                channel_mentions = channel_mentions + excluded.channel_mentions,
+                role_mentions = role_mentions + excluded.role_mentions"""
+
     def __init__(self, database, user, server, channel, fetch=True):
         """
         Create a model for the mention usage.
@@ -637,10 +1618,7 @@ class MentionUsage(BaseUsage):
                 if self.database.connection == None:
                     self.database.connect()
 
-                self.database.connection.row_factory = sqlite3.Row
-                cur = self.database.connection.cursor()
-                cur.execute(sql, values)
-                row = cur.fetchone() # There "should" only be one record!
+                row = self._fetch(sql, values, self._cacheKey('usage_mentions', user, server, channel))
                 if row != None:
                     self.userMentions = row['user_mentions']
                     self.userMentioned = row['user_mentioned']
@@ -650,7 +1628,6 @@ class MentionUsage(BaseUsage):
                 else:
                     self.newRecord = True
 
-                cur.close()
                 return True
 
             except Exception as ex:
@@ -690,9 +1667,11 @@ class MentionUsage(BaseUsage):
         try:
             cur = self.database.connection.cursor()
             cur.execute(insertSQL, values)
+            self.database.cache.discard(('usage_mentions', self.user, self.server, self.channel))
+            self.database.usageWritten(self.server)
 
             # Save (commit) the changes
-            self.database.connection.commit()
+            self.database.commit()
             cur.close()
             return True
 
@@ -729,9 +1708,11 @@ class MentionUsage(BaseUsage):
             # self.database.connect()
             cur = self.database.connection.cursor()
             cur.execute(updateSQL, values)
+            self.database.cache.discard(('usage_mentions', self.user, self.server, self.channel))
+            self.database.usageWritten(self.server)
 
             # Save (commit) the changes
-            self.database.connection.commit()
+            self.database.commit()
             cur.close()
             return True
 
@@ -739,6 +1720,35 @@ class MentionUsage(BaseUsage):
             logger.error("There was a problem updating the usage_mentions record: {0}".format(ex))
             return False
 
+    @staticmethod
+    def _cacheChanges(userMentions, userMentioned, channelMentions, roleMentions):
+        """
+        Get the column changes for a mention usage increment.
+        """
+        return {'user_mentions': userMentions, 'user_mentioned': userMentioned, 'channel_mentions': channelMentions, 'role_mentions': roleMentions}
+
+    @staticmethod
+    def increment(database, user, server, channel, userMentions=0, userMentioned=0, channelMentions=0, roleMentions=0):
+        """
+        Add to the mention usage for the user/server/channel in a single statement, creating
+        the record if it does not exist yet.
+        """
+        values = (user, server, channel, userMentions, userMentioned, channelMentions, roleMentions)
+
+        return BaseUsage._increment(database, MentionUsage.INCREMENT_SQL, values, 'usage_mentions', ('usage_mentions', user, server, channel),
+            add=MentionUsage._cacheChanges(userMentions, userMentioned, channelMentions, roleMentions))
+
+    @staticmethod
+    def incrementMany(database, rows):
+        """
+        Add to the mention usage for several records with a single statement, in one transaction.
+        Each row is (user, server, channel, userMentions, userMentioned, channelMentions, roleMentions).
+        """
+        rows = list(rows)
+        cacheUpdates = [(('usage_mentions',) + row[:3], MentionUsage._cacheChanges(*row[3:])) for row in rows]
+
+        return BaseUsage._incrementMany(database, MentionUsage.INCREMENT_SQL, rows, 'usage_mentions', cacheUpdates)
+
 class CommandUsage(BaseUsage):
     """
     This class represents a usage_commands record and can insert or update records.
@@ -799,10 +1809,10 @@ class CommandUsage(BaseUsage):
                 if self.database.connection == None:
                     self.database.connect()
 
-                self.database.connection.row_factory = sqlite3.Row
-                cur = self.database.connection.cursor()
-                cur.execute(sql, values)
-                row = cur.fetchone() # There "should" only be one record!
+                cacheKey = None
+                if self.commandName != None:
+                    cacheKey = self._cacheKey('usage_commands', self.user, self.server, self.channel, self.commandName, 1 if self.valid else 0)
+                row = self._fetch(sql, values, cacheKey)
                 if row != None:
                     self.count = row['count']
                     self.newRecord = False
@@ -810,7 +1820,6 @@ class CommandUsage(BaseUsage):
                     self.count = 1
                     self.newRecord = True
 
-                cur.close()
                 return True
 
             except Exception as ex:
@@ -849,9 +1858,11 @@ class CommandUsage(BaseUsage):
         try:
             cur = self.database.connection.cursor()
             cur.execute(insertSQL, values)
+            self.database.cache.discard(('usage_commands', self.user, self.server, self.channel, self.commandName, 1 if self.valid else 0))
+            self.database.usageWritten(self.server)
 
             # Save (commit) the changes
-            self.database.connection.commit()
+            self.database.commit()
             cur.close()
             return True
 
@@ -859,55 +1870,1633 @@ class CommandUsage(BaseUsage):
             logger.error("There was a problem inserting the usage_messages record: {0}".format(ex))
             return False
 
-    def update(self):
+    def update(self):
+        """
+        Update a command usage record.  If the object does not have a user, server,
+        and channel set the update cannot be done.
+        """
+        updateSQL = """update usage_commands
+            set count = ? 
+            where user = ? and 
+                server = ? and 
+                channel = ? and 
+                command_name = ? and
+                valid = ?"""
+        values = (self.count, self.user, self.server, self.channel, self.commandName, self.valid)
+
+        # Check that we have all the necessary data first.
+        if self.database.connection == None:
+            self.database.connect()
+
+        if self.server == None and self.user == None and self.channel == None:
+            logger.error("Must supply the user, server, and channel.")
+            return False
+
+        try:
+            # self.database.connect()
+            cur = self.database.connection.cursor()
+            cur.execute(updateSQL, values)
+            self.database.cache.discard(('usage_commands', self.user, self.server, self.channel, self.commandName, 1 if self.valid else 0))
+            self.database.usageWritten(self.server)
+
+            # Save (commit) the changes
+            self.database.commit()
+            cur.close()
+            return True
+
+        except BaseException as ex:
+            logger.error("There was a problem updating the usage_mentions record: {0}".format(ex))
+            return False
+
+    @staticmethod
+    def increment(database, user, server, channel, commandName, valid, count=1):
+        """
+        Add to the command usage for the user/server/channel/command in a single statement,
+        creating the record if it does not exist yet.
+        """
+        upsertSQL = """
+            insert into usage_commands (
+                user,
+                server,
+                channel,
+                command_name,
+                valid,
+                count
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            on conflict(user, command_name, server, channel) do update
+            set valid = excluded.valid,
+                count = count + excluded.count"""
+        values = (user, server, channel, commandName, 1 if valid else 0, count)
+
+        # The record's valid flag follows the latest use, so it is no longer cached under the other flag.
+        database.cache.discard(('usage_commands', user, server, channel, commandName, 0 if valid else 1))
+        return BaseUsage._increment(database, upsertSQL, values, 'usage_commands', ('usage_commands',) + values[:5], add={'count': count})
+
+class UsageActivity:
+    """
+    Messages and words per user, channel, and hour, for looking at activity over time.  Hours are
+    counted from the epoch (UTC), so a time range is a range of hour buckets.
+    """
+    INCREMENT_SQL = """
+            insert into usage_activity (
+                user,
+                server,
+                channel,
+                hour_bucket,
+                messages,
+                words
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            on conflict(server, channel, hour_bucket, user) do update
+            set messages = messages + excluded.messages,
+                words = words + excluded.words"""
+
+    @staticmethod
+    def hourBucket(timestamp=None):
+        """
+        Get the hour bucket for the timestamp (seconds since the epoch), or for now.
+        """
+        return int((time.time() if timestamp == None else timestamp) // 3600)
+
+    @staticmethod
+    def incrementMany(database, rows):
+        """
+        Add to the activity for several hours with a single statement, in one transaction.
+        Each row is (user, server, channel, hourBucket, messages, words).
+        """
+        return BaseUsage._incrementMany(database, UsageActivity.INCREMENT_SQL, list(rows), 'usage_activity')
+
+    @staticmethod
+    def prune(database, days, batchSize=500):
+        """
+        Delete up to batchSize hours of activity older than days, in one short transaction.  Returns
+        the number of rows deleted, or None if they could not be deleted.
+        """
+        if database.connection == None:
+            database.connect()
+
+        try:
+            with database.batch():
+                cur = database.connection.cursor()
+                cur.execute(*UsageActivity.pruneSQL(UsageActivity.hourBucket() - days * 24, batchSize))
+                deleted = cur.rowcount
+                cur.close()
+            return deleted
+
+        except Exception as ex:
+            logger.error("Problem pruning the usage activity: {0}".format(ex))
+            return None
+
+    @staticmethod
+    def pruneSQL(before, batchSize):
+        """
+        Build the query for prune(), deleting up to batchSize hours before the hour bucket before,
+        returning the sql and its values.
+        """
+        sql = "delete from usage_activity where rowid in (select rowid from usage_activity where hour_bucket < ? limit ?)"
+        return sql, (before, batchSize)
+
+    @staticmethod
+    def fetchSQL(server, channel=None, since=None, until=None):
+        """
+        Build the query for fetch(), returning the sql and its values.
+        """
+        sql = "select hour_bucket, sum(messages) as messages, sum(words) as words "
+        sql += "from usage_activity where server = ? "
+        values = (server,)
+        if channel != None:
+            sql += "and channel = ? "
+            values += (channel,)
+        if since != None:
+            sql += "and hour_bucket >= ? "
+            values += (since,)
+        if until != None:
+            sql += "and hour_bucket <= ? "
+            values += (until,)
+        sql += "group by hour_bucket order by hour_bucket"
+        return sql, values
+
+    @staticmethod
+    def fetch(database, server, channel=None, since=None, until=None):
+        """
+        Get the activity for the server, or only the channel if one is given, between the since and
+        until hour buckets (inclusive).  Returns a list of (hourBucket, messages, words) for each
+        hour with any activity, in order, or None if the activity could not be read.
+        """
+        sql, values = UsageActivity.fetchSQL(server, channel, since, until)
+
+        if database == None:
+            logger.error("No valid DB connection available.")
+            return None
+
+        try:
+            # Check that we have all the necessary data first.
+            if database.connection == None:
+                database.connect()
+
+            cur = database.connection.cursor()
+            cur.execute(sql, values)
+            activity = [(row['hour_bucket'], row['messages'], row['words']) for row in cur.fetchall()]
+            cur.close()
+            return activity
+
+        except Exception as ex:
+            logger.error("Problem getting usage activity: {0}".format(ex))
+            return None
+
+class UsageSketch:
+    """
+    HyperLogLog sketches of the distinct users related to a user: the users they have mentioned
+    (MENTIONED) and the users that have reacted to their messages (REACTORS).
+    """
+    MENTIONED = 'mentioned'
+    REACTORS = 'reactors'
+
+    INCREMENT_SQL = """
+            insert into usage_sketches (
+                user,
+                server,
+                channel,
+                kind,
+                sketch
+                ) VALUES (?, ?, ?, ?, ?)
+            on conflict(user, server, channel, kind) do update
+            set sketch = hll_merge(sketch, excluded.sketch)"""
+
+    @staticmethod
+    def incrementMany(database, rows):
+        """
+        Add users to several sketches with a single statement, in one transaction.  Each row is
+        (user, server, channel, kind, users), where users is the collection of user ids to add.
+        """
+        sketchRows = []
+        for user, server, channel, kind, users in rows:
+            sketch = HyperLogLog()
+            sketch.update(users)
+            sketchRows.append((user, server, channel, kind, sketch.toBytes()))
+
+        return BaseUsage._incrementMany(database, UsageSketch.INCREMENT_SQL, sketchRows, 'usage_sketches')
+
+    @staticmethod
+    def fetch(database, user, server, channel=None):
+        """
+        Estimate the distinct users of each kind for user on the server, or only on the channel if
+        one is given.  Returns a dictionary of kind to count, or None if it could not be read.
+        """
+        sql = "select kind, hll_count(hll_union(sketch)) as count from usage_sketches where user = ? and server = ? "
+        values = (user, server)
+        if channel != None:
+            sql += "and channel = ? "
+            values += (channel,)
+        sql += "group by kind"
+
+        if database == None:
+            logger.error("No valid DB connection available.")
+            return None
+
+        try:
+            # Check that we have all the necessary data first.
+            if database.connection == None:
+                database.connect()
+
+            cur = database.connection.cursor()
+            cur.execute(sql, values)
+            counts = {UsageSketch.MENTIONED: 0, UsageSketch.REACTORS: 0}
+            counts.update((row['kind'], row['count']) for row in cur.fetchall())
+            cur.close()
+            return counts
+
+        except Exception as ex:
+            logger.error("Problem getting usage sketches: {0}".format(ex))
+            return None
+
+class UsageSnapshot:
+    """
+    All of a user's usage for a server (or one of its channels): the message, reaction, and mention
+    usage, the valid and invalid command usage, and the estimated number of distinct users mentioned
+    and reacting (see UsageSketch), read with a single query and kept in the usage cache until the
+    user's usage is written again.
+    """
+    def __init__(self, messages, reactions, mentions, validCommands, invalidCommands, uniqueMentioned=0, uniqueReactors=0):
+        """
+        Initialize the snapshot from the usage models.
+        """
+        self.messages = messages
+        self.reactions = reactions
+        self.mentions = mentions
+        self.validCommands = validCommands
+        self.invalidCommands = invalidCommands
+        self.uniqueMentioned = uniqueMentioned
+        self.uniqueReactors = uniqueReactors
+
+    @staticmethod
+    def fetch(database, user, server, channel=None):
+        """
+        Get the usage for user on the server, or only on the channel if one is given.  Returns a
+        UsageSnapshot, or None if the usage could not be read.
+        """
+        where = "where user = ? and server = ? "
+        values = (user, server)
+        if channel != None:
+            where += "and channel = ? "
+            values += (channel,)
+
+        # Each sub-query adds up one table and returns exactly one row, so they can be joined.
+        sql = """select * from
+            (select count(*) as message_records,
+                sum(message_count) as message_count,
+                sum(word_count) as word_count,
+                sum(character_count) as character_count,
+                sum(max_message_length) as max_message_length,
+                sum(url_count) as url_count,
+                max(last_message_timestamp) as last_message_timestamp
+                from usage_messages {where}),
+            (select count(*) as reaction_records,
+                sum(messages_reacted_count) as messages_reacted_count,
+                sum(user_reacted_count) as user_reacted_count,
+                sum(message_reactions_received_count) as message_reactions_received_count,
+                sum(reactions_received_count) as reactions_received_count
+                from usage_reactions {where}),
+            (select count(*) as mention_records,
+                sum(user_mentions) as user_mentions,
+                sum(user_mentioned) as user_mentioned,
+                sum(channel_mentions) as channel_mentions,
+                sum(role_mentions) as role_mentions
+                from usage_mentions {where}),
+            (select count(*) as valid_command_records,
+                sum(count) as valid_command_count
+                from usage_commands {where} and valid = 1),
+            (select count(*) as invalid_command_records,
+                sum(count) as invalid_command_count
+                from usage_commands {where} and valid = 0),
+            (select hll_count(hll_union(sketch)) as unique_mentioned
+                from usage_sketches {where} and kind = '{mentioned}'),
+            (select hll_count(hll_union(sketch)) as unique_reactors
+                from usage_sketches {where} and kind = '{reactors}')""".format(
+                where=where, mentioned=UsageSketch.MENTIONED, reactors=UsageSketch.REACTORS)
+
+        if database == None:
+            logger.error("No valid DB connection available.")
+            return None
+
+        try:
+            # Check that we have all the necessary data first.
+            if database.connection == None:
+                database.connect()
+
+            cacheKey = (UsageCache.SNAPSHOT, user, server, channel)
+            row = database.cache.get(cacheKey)
+            if row == None:
+                generation = database.cache.generation
+                cur = database.connection.cursor()
+                cur.execute(sql, values * 7)
+                row = cur.fetchone()
+                cur.close()
+                database.cache.put(cacheKey, row, generation)
+
+        except Exception as ex:
+            logger.error("Problem getting usage snapshot: {0}".format(ex))
+            return None
+
+        return UsageSnapshot._fromRow(database, user, server, channel, row)
+
+    @staticmethod
+    def fetchRange(database, user, server, channel=None, since=None, until=None):
+        """
+        Get the usage for user on the server, or only on the channel if one is given, over the months
+        from since to until (optional (year, month)), including the archived months (see
+        UsageRank.getHistoricalTotals).  The archives do not keep the last message time or the
+        distinct user estimates, so they are left out.  Returns a UsageSnapshot, or None if the usage
+        could not be read.
+        """
+        if database == None:
+            logger.error("No valid DB connection available.")
+            return None
+
+        def totals(rankClass, columns, prefix, match):
+            """
+            Add up the user's columns of the rank's table, as the row fields fetch reads.
+            """
+            usageRank = rankClass(database, server, channel, since=since, until=until)
+            userTotals = usageRank.getHistoricalTotals(columns, dict(match, user=user)).get(user)
+            row = {prefix + '_records': 0 if userTotals == None else 1}
+            for column in columns:
+                row[column] = None if userTotals == None else userTotals[column]
+            return row
+
+        try:
+            if database.connection == None:
+                database.connect()
+
+            row = {'last_message_timestamp': None, 'unique_mentioned': 0, 'unique_reactors': 0}
+            row.update(totals(MessageUsageRank,
+                ['message_count', 'word_count', 'character_count', 'max_message_length', 'url_count'], 'message', {}))
+            row.update(totals(ReactionUsageRank,
+                ['messages_reacted_count', 'user_reacted_count', 'message_reactions_received_count', 'reactions_received_count'], 'reaction', {}))
+            row.update(totals(MentionUsageRank,
+                ['user_mentions', 'user_mentioned', 'channel_mentions', 'role_mentions'], 'mention', {}))
+            validRow = totals(CommandUsageRank, ['count'], 'command', {'valid': 1})
+            invalidRow = totals(CommandUsageRank, ['count'], 'command', {'valid': 0})
+            row.update({'valid_command_records': validRow['command_records'], 'valid_command_count': validRow['count'],
+                'invalid_command_records': invalidRow['command_records'], 'invalid_command_count': invalidRow['count']})
+
+        except Exception as ex:
+            logger.error("Problem getting usage snapshot for a range of months: {0}".format(ex))
+            return None
+
+        return UsageSnapshot._fromRow(database, user, server, channel, row)
+
+    @staticmethod
+    def _fromRow(database, user, server, channel, row):
+        """
+        Build the snapshot from a row of the snapshot query (or a dict with the same fields).
+        """
+        messages = MessageUsage(database, user, server, channel, fetch=False)
+        if row['message_records'] > 0:
+            messages.messageCount = row['message_count']
+            messages.wordCount = row['word_count']
+            messages.characterCount = row['character_count']
+            messages.maxMessageLength = row['max_message_length']
+            messages.urlCount = row['url_count']
+            messages.lastMessageTimestamp = row['last_message_timestamp']
+            messages.newRecord = False
+
+        reactions = ReactionUsage(database, user, server, channel, fetch=False)
+        if row['reaction_records'] > 0:
+            reactions.messagesReacted = row['messages_reacted_count']
+            reactions.userReacted = row['user_reacted_count']
+            reactions.messageReactionsReceived = row['message_reactions_received_count']
+            reactions.reactionsReceived = row['reactions_received_count']
+            reactions.newRecord = False
+
+        mentions = MentionUsage(database, user, server, channel, fetch=False)
+        if row['mention_records'] > 0:
+            mentions.userMentions = row['user_mentions']
+            mentions.userMentioned = row['user_mentioned']
+            mentions.channelMentions = row['channel_mentions']
+            mentions.roleMentions = row['role_mentions']
+            mentions.newRecord = False
+
+        validCommands = CommandUsage(database, user, server, channel, True, fetch=False)
+        if row['valid_command_records'] > 0:
+            validCommands.count = row['valid_command_count']
+            validCommands.newRecord = False
+
+        invalidCommands = CommandUsage(database, user, server, channel, False, fetch=False)
+        if row['invalid_command_records'] > 0:
+            invalidCommands.count = row['invalid_command_count']
+            invalidCommands.newRecord = False
+
+        return UsageSnapshot(messages, reactions, mentions, validCommands, invalidCommands,
+            row['unique_mentioned'], row['unique_reactors'])
+
+class ArchiveProgress:
+    """
+    How far an archive of the usage tables has got.
+    """
+    def __init__(self, year, month, rowsMoved, totalRows, startedDate, done):
+        """
+        Initialize the progress.
+        """
+        self.year = year
+        self.month = month
+        self.rowsMoved = rowsMoved
+        self.totalRows = totalRows
+        self.startedDate = startedDate
+        self.done = done
+
+    def percent(self):
+        """
+        Get the percentage of the rows that have been moved.
+        """
+        return 100 if self.totalRows == 0 else int(100 * self.rowsMoved / self.totalRows)
+
+class UsageArchiver:
+    """
+    Moves the usage tables into a separate archive file for each month (archive/YYYY-MM.sqlite3,
+    next to the database), so the live database only holds the current month.  Rows are moved
+    batchSize at a time, in rowid order, with each batch in its own short transactions so other
+    writes can run in between.  Progress is kept in usage_archive_progress, so an archive that is
+    interrupted continues where it left off the next time it is started.  Rows added after an
+    archive starts are left for the next one, but usage added to a row that has not been moved yet
+    is archived with it.  The months that have been archived are listed in usage_archive_catalog,
+    and an archive file is only attached while it is being used.
+    """
+    TABLES = ['usage_reactions', 'usage_messages', 'usage_mentions', 'usage_commands', 'usage_sketches']
+    # Tables with per-server rollups.  Their delete triggers keep the rollups up to date as rows are
+    # moved, but leave behind rollups for users with nothing left to add up.
+    ROLLUP_TABLES = ['usage_reactions', 'usage_messages', 'usage_mentions', 'usage_commands']
+    ARCHIVE_FOLDER = 'archive'
+    NOW = 'now' # The date last month is worked out from; the tests pin it to a date.
+    # How each table's rows are added to rows already in the month's archive file: the key of the
+    # archive table, and the columns to update with their new values.
+    MERGE = {
+        'usage_reactions': ('user, server, channel, year, month', {
+            'messages_reacted_count': 'messages_reacted_count + excluded.messages_reacted_count',
+            'user_reacted_count': 'user_reacted_count + excluded.user_reacted_count',
+            'message_reactions_received_count': 'message_reactions_received_count + excluded.message_reactions_received_count',
+            'reactions_received_count': 'reactions_received_count + excluded.reactions_received_count'}),
+        'usage_messages': ('user, server, channel, year, month', {
+            'word_count': 'word_count + excluded.word_count',
+            'character_count': 'character_count + excluded.character_count',
+            'max_message_length': 'max(max_message_length, excluded.max_message_length)',
+            'last_message_timestamp': 'max(last_message_timestamp, excluded.last_message_timestamp)',
+            'message_count': 'message_count + excluded.message_count',
+            'url_count': 'url_count + excluded.url_count'}),
+        'usage_mentions': ('user, server, channel, year, month', {
+            'user_mentions': 'user_mentions + excluded.user_mentions',
+            'user_mentioned': 'user_mentioned + excluded.user_mentioned',
+            'channel_mentions': 'channel_mentions + excluded.channel_mentions',
+            'role_mentions': 'role_mentions + excluded.role_mentions'}),
+        'usage_commands': ('user, command_name, server, channel, year, month', {
+            'count': 'count + excluded.count'}),
+        'usage_sketches': ('user, server, channel, kind, year, month', {
+            'sketch': 'hll_merge(sketch, excluded.sketch)'})}
+    LEGACY_RUN = 'legacy' # The run recorded in archive_copied for rows moved by moveLegacyArchive().
+
+    @staticmethod
+    def fileName(year, month):
+        """
+        Get the name of the archive file for the year and month.
+        """
+        return '{0:04}-{1:02}.sqlite3'.format(year, month)
+
+    @staticmethod
+    def archivePath(database, fileName):
+        """
+        Get the path of an archive file, which is in the archive folder next to the database.
+        """
+        return os.path.join(os.path.dirname(os.path.abspath(database.databaseName)), UsageArchiver.ARCHIVE_FOLDER, fileName)
+
+    @staticmethod
+    @contextmanager
+    def attach(database, fileName, create=False):
+        """
+        Attach an archive file to the database's connection while the block runs, yielding the schema
+        name to use for its tables.  If create is true, the file and its tables are created if needed.
+        Files can't be attached or detached during a transaction.
+        """
+        if database.connection == None:
+            database.connect()
+
+        path = UsageArchiver.archivePath(database, fileName)
+        if create:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            connection = sqlite3.connect(path)
+            try:
+                connection.executescript(open(ARCHIVE_DDL, 'r').read())
+            finally:
+                connection.close()
+
+        schema = 'archive_' + os.path.splitext(fileName)[0].replace('-', '_')
+        database.connection.execute("attach database ? as {0}".format(schema), (path,))
+        try:
+            yield schema
+        finally:
+            database.connection.execute("detach database {0}".format(schema))
+
+    @staticmethod
+    def _columns(cur, tableName):
+        """
+        Get the columns of a live usage table, which are also in its archive table.
+        """
+        return ", ".join(row['name'] for row in cur.execute("pragma main.table_info({0})".format(tableName)).fetchall())
+
+    @staticmethod
+    def _mergeSQL(tableName):
+        """
+        Get the upsert clause that adds rows of tableName to the rows already in its archive table.
+        """
+        key, updates = UsageArchiver.MERGE[tableName]
+        return "on conflict({0}) do update set {1}".format(key, ", ".join("{0} = {1}".format(column, update) for column, update in updates.items()))
+
+    @staticmethod
+    def _copied(cur, schema, tableName, run):
+        """
+        Get the last rowid of tableName copied to the archive file in schema by the archive run (its
+        started date, or LEGACY_RUN), or 0 if none have been.
+        """
+        row = cur.execute("select last_rowid from {0}.archive_copied where table_name = ? and run = ?".format(schema), (tableName, run)).fetchone()
+        return row['last_rowid'] if row != None else 0
+
+    @staticmethod
+    def _setCopied(cur, schema, tableName, run, lastRowid):
+        """
+        Record the last rowid of tableName copied to the archive file in schema by the archive run.  This
+        is written in the same transaction as the copy, so a copy repeated after a crash skips the rows
+        already copied rather than adding them again.
+        """
+        cur.execute("""insert into {0}.archive_copied (table_name, run, last_rowid) VALUES (?, ?, ?)
+            on conflict(table_name, run) do update set last_rowid = excluded.last_rowid""".format(schema), (tableName, run, lastRowid))
+
+    @staticmethod
+    def _progress(cur):
+        """
+        Read the progress from usage_archive_progress, or None if there is no archive in progress.
+        """
+        cur.execute("""select year, month, sum(rows_moved) as rows_moved, sum(total_rows) as total_rows,
+            min(started_date) as started_date, sum(last_rowid < max_rowid) as tables_remaining
+            from usage_archive_progress group by year, month""")
+        row = cur.fetchone()
+        if row == None:
+            return None
+        return ArchiveProgress(row['year'], row['month'], row['rows_moved'], row['total_rows'], row['started_date'],
+            row['tables_remaining'] == 0)
+
+    @staticmethod
+    def lastMonth(cur):
+        """
+        Get last month as (year, month).  Going back a month from the start of this month, since
+        SQLite turns a day past the end of last month (such as the 31st) into a day of this month.
+        """
+        cur.execute("select cast(strftime('%Y', date(?, 'start of month', '-1 month')) as integer), cast(strftime('%m', date(?, 'start of month', '-1 month')) as integer)",
+            (UsageArchiver.NOW, UsageArchiver.NOW))
+        return tuple(cur.fetchone())
+
+    @staticmethod
+    def _finish(cur, progress):
+        """
+        Add a finished archive to the catalog and forget its progress, so the next archive can start.
+        """
+        if progress.rowsMoved > 0:
+            UsageArchiver._catalog(cur, progress.year, progress.month, progress.rowsMoved)
+        cur.execute("delete from usage_archive_progress")
+
+    @staticmethod
+    def _catalog(cur, year, month, rows):
+        """
+        Add rows archived for the year and month to the catalog.
+        """
+        cur.execute("""insert into usage_archive_catalog (year, month, file_name, rows_archived, archived_date)
+                VALUES (?, ?, ?, ?, datetime('now'))
+            on conflict(year, month) do update
+            set rows_archived = rows_archived + excluded.rows_archived,
+                archived_date = excluded.archived_date""",
+            (year, month, UsageArchiver.fileName(year, month), rows))
+
+    @staticmethod
+    def start(database):
+        """
+        Start archiving the usage tables as last month's usage, or continue the archive that is in
+        progress.  Returns the ArchiveProgress, or None if the archive could not be started.
+        """
+        if database.connection == None:
+            database.connect()
+
+        try:
+            cur = database.connection.cursor()
+            progress = UsageArchiver._progress(cur)
+            if progress != None:
+                logger.info("Continuing the archive of {0}-{1:02} started {2}, {3} of {4} rows moved.".format(
+                    progress.year, progress.month, progress.startedDate, progress.rowsMoved, progress.totalRows))
+            else:
+                year, month = UsageArchiver.lastMonth(cur)
+
+                # The rowids copied by earlier archives of the month are forgotten before the new archive
+                # starts, since the live tables may reuse them.
+                if os.path.exists(UsageArchiver.archivePath(database, UsageArchiver.fileName(year, month))):
+                    with UsageArchiver.attach(database, UsageArchiver.fileName(year, month), create=True) as schema:
+                        with database.batch():
+                            cur.execute("delete from {0}.archive_copied where run != ?".format(schema), (UsageArchiver.LEGACY_RUN,))
+
+                with database.batch():
+                    for tableName in UsageArchiver.TABLES:
+                        cur.execute("""insert into usage_archive_progress (table_name, year, month, last_rowid, max_rowid, rows_moved, total_rows, started_date)
+                            select ?, ?, ?, 0, ifnull(max(rowid), 0), 0, count(*), datetime('now')
+                            from {0}""".format(tableName), (tableName, year, month))
+                    progress = UsageArchiver._progress(cur)
+
+            # With nothing to move, step() is never called to finish the archive.
+            if progress.done:
+                with database.batch():
+                    UsageArchiver._finish(cur, progress)
+            cur.close()
+            return progress
+
+        except Exception as ex:
+            logger.error("Problem starting the archive: {0}".format(ex))
+            return None
+
+    @staticmethod
+    def step(database, batchSize=500):
+        """
+        Move the next batchSize rows into the month's archive file.  Returns the ArchiveProgress,
+        which is done once every table has been moved, or None if there is no archive in progress
+        or the rows could not be moved.
+        """
+        if database.connection == None:
+            database.connect()
+
+        try:
+            cur = database.connection.cursor()
+            cur.execute("select table_name, year, month, last_rowid, max_rowid, started_date from usage_archive_progress where last_rowid < max_rowid")
+            remaining = {row['table_name']: row for row in cur.fetchall()}
+            tableName = next((name for name in UsageArchiver.TABLES if name in remaining), None)
+
+            if tableName != None:
+                table = remaining[tableName]
+                cur.execute("select max(rowid) from (select rowid from {0} where rowid > ? and rowid <= ? order by rowid limit ?)".format(tableName),
+                    (table['last_rowid'], table['max_rowid'], batchSize))
+                lastRowid = cur.fetchone()[0]
+                if lastRowid == None: # The rest of the rows were already gone.
+                    lastRowid = table['max_rowid']
+                else:
+                    # A transaction across attached files is only atomic for each file, so the rows are copied
+                    # and committed first, then deleted below.  The rows are added to any already archived for
+                    # the month, and if the bot stops in between, the rows this run already copied are skipped.
+                    columns = UsageArchiver._columns(cur, tableName)
+                    with UsageArchiver.attach(database, UsageArchiver.fileName(table['year'], table['month']), create=True) as schema:
+                        with database.batch():
+                            copied = max(table['last_rowid'], UsageArchiver._copied(cur, schema, tableName, table['started_date']))
+                            if copied < lastRowid:
+                                cur.execute("insert into {2}.{0}_archive ({1}, year, month) select {1}, ?, ? from main.{0} where rowid > ? and rowid <= ? {3}".format(
+                                    tableName, columns, schema, UsageArchiver._mergeSQL(tableName)), (table['year'], table['month'], copied, lastRowid))
+                                UsageArchiver._setCopied(cur, schema, tableName, table['started_date'], lastRowid)
+
+            with database.batch():
+                if tableName != None:
+                    cur.execute("delete from {0} where rowid > ? and rowid <= ?".format(tableName), (table['last_rowid'], lastRowid))
+                    cur.execute("update usage_archive_progress set last_rowid = ?, rows_moved = rows_moved + ? where table_name = ?",
+                        (lastRowid, cur.rowcount, tableName))
+                    if lastRowid >= table['max_rowid'] and tableName in UsageArchiver.ROLLUP_TABLES:
+                        cur.execute("""delete from {0}_server where not exists
+                            (select 1 from {0} where {0}.server = {0}_server.server and {0}.user = {0}_server.user)""".format(tableName))
+
+                progress = UsageArchiver._progress(cur)
+                if progress != None and progress.done:
+                    UsageArchiver._finish(cur, progress)
+            cur.close()
+
+            # The moved rows are gone from the usage tables.
+            database.cache.clear()
+            database.rankCache.clear()
+            return progress
+
+        except Exception as ex:
+            logger.error("Problem archiving the usage tables: {0}".format(ex))
+            return None
+
+    @staticmethod
+    def moveLegacyArchive(database):
+        """
+        Move one month of the usage archived before there were archive files, from the usage_*_archive
+        tables in the database to the month's archive file.  Returns the (year, month) moved, or None
+        if there is nothing left to move or it could not be moved.
+        """
+        if database.connection == None:
+            database.connect()
+
+        try:
+            cur = database.connection.cursor()
+            cur.execute(" union ".join("select year, month from main.{0}_archive".format(tableName) for tableName in UsageArchiver.TABLES) + " limit 1")
+            row = cur.fetchone()
+            if row == None:
+                return None
+            year, month = row['year'], row['month']
+
+            # Copied and committed first, then deleted, as in step().  The month's rows are only copied once,
+            # even if the bot stops before they are deleted.
+            with UsageArchiver.attach(database, UsageArchiver.fileName(year, month), create=True) as schema:
+                with database.batch():
+                    for tableName in UsageArchiver.TABLES:
+                        columns = UsageArchiver._columns(cur, tableName)
+                        copied = UsageArchiver._copied(cur, schema, tableName, UsageArchiver.LEGACY_RUN)
+                        lastRowid = cur.execute("select max(rowid) from main.{0}_archive where year = ? and month = ?".format(tableName), (year, month)).fetchone()[0]
+                        if lastRowid != None and copied < lastRowid:
+                            cur.execute("insert into {2}.{0}_archive ({1}, year, month) select {1}, year, month from main.{0}_archive where year = ? and month = ? and rowid > ? and rowid <= ? {3}".format(
+                                tableName, columns, schema, UsageArchiver._mergeSQL(tableName)), (year, month, copied, lastRowid))
+                            UsageArchiver._setCopied(cur, schema, tableName, UsageArchiver.LEGACY_RUN, lastRowid)
+
+            with database.batch():
+                rows = 0
+                for tableName in UsageArchiver.TABLES:
+                    cur.execute("delete from main.{0}_archive where year = ? and month = ?".format(tableName), (year, month))
+                    rows += cur.rowcount
+                UsageArchiver._catalog(cur, year, month, rows)
+            cur.close()
+
+            logger.info("Moved {0} archived usage rows for {1}-{2:02} to {3}.".format(rows, year, month, UsageArchiver.fileName(year, month)))
+            return (year, month)
+
+        except Exception as ex:
+            logger.error("Problem moving the archived usage: {0}".format(ex))
+            return None
+
+    @staticmethod
+    def archived(database, year=None, month=None):
+        """
+        Check if usage has been archived for the year and month (last month by default), by looking
+        for it in the catalog, or in the archive tables for months archived before there were archive
+        files.  An archive that is still in progress does not count.
+        """
+        if database.connection == None:
+            database.connect()
+
+        cur = database.connection.cursor()
+        try:
+            if year == None or month == None:
+                year, month = UsageArchiver.lastMonth(cur)
+
+            progress = UsageArchiver._progress(cur)
+            if progress != None and progress.year == year and progress.month == month:
+                return False
+
+            tables = ['usage_archive_catalog'] + [tableName + '_archive' for tableName in UsageArchiver.TABLES]
+            sql = "select " + " or ".join("exists (select 1 from {0} where year = ? and month = ?)".format(table) for table in tables)
+            cur.execute(sql, (year, month) * len(tables))
+            return bool(cur.fetchone()[0])
+        finally:
+            cur.close()
+
+    @staticmethod
+    def catalog(database):
+        """
+        Get the archived months, as a list of (year, month, file name, rows archived, columnar file
+        name or None), oldest first.
+        """
+        if database.connection == None:
+            database.connect()
+
+        cur = database.connection.cursor()
+        try:
+            cur.execute("select year, month, file_name, rows_archived, columnar_file from usage_archive_catalog order by year, month")
+            return [(row['year'], row['month'], row['file_name'], row['rows_archived'], row['columnar_file']) for row in cur.fetchall()]
+        finally:
+            cur.close()
+
+    @staticmethod
+    def exportColumnar(database, year, month):
+        """
+        Write an archived month to a column-oriented file (see columnar.py) next to its archive file.
+        Only reads from the database, so it can run on a reader; call setColumnar() afterwards to add
+        the file to the catalog.  Returns the name of the file, or None if it could not be written.
+        """
+        if database.connection == None:
+            database.connect()
+
+        fileName = UsageArchiver.fileName(year, month)
+        if not os.path.exists(UsageArchiver.archivePath(database, fileName)):
+            logger.error("There is no archive file for {0}-{1:02}.".format(year, month))
+            return None
+
+        try:
+            tables = {}
+            cur = database.connection.cursor()
+            with UsageArchiver.attach(database, fileName) as schema:
+                for tableName in UsageArchiver.TABLES:
+                    columns = [(row['name'], columnar.ID if row['type'].upper() == 'TEXT' else columnar.BLOB if row['type'].upper() == 'BLOB' else columnar.INTEGER)
+                        for row in cur.execute("pragma {0}.table_info({1}_archive)".format(schema, tableName)).fetchall()
+                        if row['name'] not in ('year', 'month')]
+                    cur.execute("select {2} from {0}.{1}_archive where year = ? and month = ? order by server, channel, user".format(
+                        schema, tableName, ", ".join(name for name, columnType in columns)), (year, month))
+                    tables[tableName] = (columns, cur.fetchall())
+            cur.close()
+
+            columnarFile = os.path.splitext(fileName)[0] + '.columns'
+            path = UsageArchiver.archivePath(database, columnarFile)
+            columnar.writeArchive(path, year, month, tables)
+
+            # Make sure the file can be read back before it is used.
+            exported = columnar.ColumnarArchive(path)
+            for tableName, (columns, rows) in tables.items():
+                if exported.rows(tableName) != len(rows):
+                    raise ValueError("{0} has {1} rows in {2}, expected {3}.".format(tableName, exported.rows(tableName), columnarFile, len(rows)))
+
+            logger.info("Exported {0} archived usage rows for {1}-{2:02} to {3}.".format(
+                sum(len(rows) for columns, rows in tables.values()), year, month, columnarFile))
+            return columnarFile
+
+        except Exception as ex:
+            logger.error("Problem exporting the archive for {0}-{1:02}: {2}".format(year, month, ex))
+            return None
+
+    @staticmethod
+    def setColumnar(database, year, month, columnarFile, removeArchive=False):
+        """
+        Add the column-oriented file exported for a month to the catalog.  If removeArchive is true
+        the month's SQLite archive file is deleted, and the month is only read from the columnar file.
+        """
+        if database.connection == None:
+            database.connect()
+
+        try:
+            with database.batch():
+                database.connection.execute("update usage_archive_catalog set columnar_file = ? where year = ? and month = ?",
+                    (columnarFile, year, month))
+
+            if removeArchive:
+                os.remove(UsageArchiver.archivePath(database, UsageArchiver.fileName(year, month)))
+                logger.info("Removed the archive file for {0}-{1:02}, it is in {2}.".format(year, month, columnarFile))
+            return True
+
+        except Exception as ex:
+            logger.error("Problem adding {0} to the archive catalog: {1}".format(columnarFile, ex))
+            return False
+
+    @staticmethod
+    def progress(database):
+        """
+        Get the ArchiveProgress of the archive in progress, or None if there isn't one.
+        """
+        if database.connection == None:
+            database.connect()
+
+        cur = database.connection.cursor()
+        try:
+            return UsageArchiver._progress(cur)
+        finally:
+            cur.close()
+
+class UsageJournal:
+    """
+    An append-only file of the usage collected by a UsageAggregator, so usage that has not been
+    written to the database yet survives a crash.  Each line is a JSON list of a sequence number,
+    the aggregator method called, and its arguments.
+
+    When the aggregator flushes, the journal is moved aside to a checkpoint file and the sequence
+    number of its last entry is saved in the usage_journal table in the same transaction as the
+    usage.  Once the transaction is committed the checkpoint file is removed.  Any entries left
+    in either file with a later sequence number are replayed when the database is checked.
+
+    Entries are flushed to the operating system as they are appended, which covers the bot
+    stopping unexpectedly.  They only survive a power cut if sync is true, which syncs each entry
+    to the disk at the cost of a disk write per usage event.
+    """
+    METHODS = ('addMessage', 'addMention', 'addMentions', 'addReaction', 'addReactor', 'addCommand')
+
+    def __init__(self, path, sync=False):
+        """
+        Initialize the journal.  path is the journal file; the checkpoint file is path.checkpoint.
+        If sync is true, each entry is synced to the disk as it is appended.
+        """
+        self.path = path
+        self.sync = sync
+        self.checkpointPath = path + '.checkpoint'
+        self.sequence = 0
+        self.file = None
+
+    def append(self, method, *args):
+        """
+        Append a call to the aggregator method with the given arguments.
+        """
+        if self.file == None:
+            self.file = open(self.path, 'a')
+
+        self.sequence += 1
+        self.file.write(json.dumps([self.sequence, method] + list(args), separators=(',', ':')) + '\n')
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    def checkpoint(self):
+        """
+        Move the entries appended so far to the checkpoint file and return the sequence number
+        of the last one.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            if os.path.exists(self.checkpointPath): # A previous flush was not committed; keep its entries.
+                with open(self.path, 'r') as journal, open(self.checkpointPath, 'a') as checkpoint:
+                    shutil.copyfileobj(journal, checkpoint)
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.checkpointPath)
+
+        return self.sequence
+
+    def checkpointed(self):
+        """
+        Remove the checkpoint file once its entries have been committed to the database.
+        """
+        if os.path.exists(self.checkpointPath):
+            os.remove(self.checkpointPath)
+
+    def close(self):
+        """
+        Close the journal file.
+        """
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+    @staticmethod
+    def saveCheckpoint(database, sequence):
+        """
+        Record in the database that the entries up to sequence have been written.
+        """
+        ts = datetime.datetime.now()
+        database.connection.execute("""
+            insert into usage_journal (id, sequence, checkpoint_date) VALUES (1, ?, ?)
+            on conflict(id) do update
+            set sequence = excluded.sequence,
+                checkpoint_date = excluded.checkpoint_date""", (sequence, ts.strftime("%Y-%m-%d %H:%M:%S:%f")))
+
+    def replay(self, database):
+        """
+        Write any entries in the journal files that are not in the database yet.  The journal's
+        sequence numbers carry on from the last one saved in the database, even if there is
+        nothing to replay, so new entries are not mistaken for ones already written.
+        """
+        try:
+            row = database.connection.execute('select sequence from usage_journal where id = 1').fetchone()
+            lastSequence = row['sequence'] if row != None else 0
+        except Exception as ex:
+            logger.error("Problem reading the usage journal checkpoint: {0}".format(ex))
+            return False
+        self.sequence = max(self.sequence, lastSequence)
+
+        entries = []
+        for path in (self.checkpointPath, self.path):
+            if os.path.exists(path):
+                with open(path, 'r') as journal:
+                    for line in journal:
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            # The last line may have been cut short by a crash.
+                            logger.warning("Skipping damaged usage journal entry in {0}.".format(path))
+
+        if len(entries) == 0:
+            return True
+
+        try:
+            aggregator = UsageAggregator()
+            replayed = 0
+            for entry in entries:
+                self.sequence = max(self.sequence, entry[0])
+                if entry[0] > lastSequence and entry[1] in self.METHODS:
+                    getattr(aggregator, entry[1])(*entry[2:])
+                    replayed += 1
+
+            with database.batch():
+                if not aggregator.flush(database):
+                    raise sqlite3.Error("The usage could not be written.")
+                self.saveCheckpoint(database, self.sequence)
+
+        except Exception as ex:
+            logger.error("Problem replaying the usage journal: {0}".format(ex))
+            return False
+
+        self.close()
+        for path in (self.checkpointPath, self.path):
+            if os.path.exists(path):
+                os.remove(path)
+
+        logger.info("Replayed {0} usage journal entries.".format(replayed))
+        return True
+
+class UsageAggregator:
+    """
+    Collects usage count changes in memory so they can be written to the database in a single
+    transaction, rather than one read and write per event.  Usage may be added on one thread
+    while it is flushed on another.  If a UsageJournal is given, each call is also appended to
+    it so the usage can be recovered if the bot stops before it is flushed.
+    """
+    def __init__(self, flushSize=100, journal=None):
+        """
+        Initialize the aggregator.  flushSize is the number of events to collect before
+        isFull() reports that a flush is due.
+        """
+        self.flushSize = flushSize
+        self.journal = journal
+        self.lock = threading.Lock()
+        self.pendingEvents = 0
+        self.messages = {}
+        self.mentions = {}
+        self.reactions = {}
+        self.commands = {}
+        self.activity = {}
+        self.sketches = {}
+
+    @staticmethod
+    def _add(buffer, key, **deltas):
+        """
+        Add the deltas to the entry for key in the given buffer.
+        """
+        entry = buffer.setdefault(key, {})
+        for name, value in deltas.items():
+            entry[name] = entry.get(name, 0) + value
+        return entry
+
+    def _journal(self, method, *args):
+        """
+        Append a call to the journal, if there is one.
+        """
+        if self.journal != None:
+            try:
+                self.journal.append(method, *args)
+            except Exception as ex:
+                logger.error("Problem writing to the usage journal: {0}".format(ex))
+
+    def addMessage(self, user, server, channel, words, chars, urls, hourBucket=None):
+        """
+        Record a message sent by user.  hourBucket is the hour it was sent in (see
+        UsageActivity.hourBucket), and defaults to the current hour.
+        """
+        if hourBucket == None:
+            hourBucket = UsageActivity.hourBucket()
+
+        with self.lock:
+            self._journal('addMessage', user, server, channel, words, chars, urls, hourBucket)
+            entry = self._add(self.messages, (user, server, channel), messages=1, words=words, chars=chars, urls=urls)
+            entry['maxLength'] = max(entry.get('maxLength', 0), chars)
+            self._add(self.activity, (user, server, channel, hourBucket), messages=1, words=words)
+            self.pendingEvents += 1
+
+    def addMention(self, user, server, channel, userMentions=0, userMentioned=0, channelMentions=0, roleMentions=0):
+        """
+        Record mentions made by, or of, user.
+        """
+        with self.lock:
+            self._journal('addMention', user, server, channel, userMentions, userMentioned, channelMentions, roleMentions)
+            self._add(self.mentions, (user, server, channel),
+                userMentions=userMentions, userMentioned=userMentioned, channelMentions=channelMentions, roleMentions=roleMentions)
+            self.pendingEvents += 1
+
+    def addMentions(self, user, server, channel, mentioned, channelMentions=0, roleMentions=0):
+        """
+        Record the mentions in one message: user mentioned each of the unique users in mentioned,
+        and channelMentions channels and roleMentions roles.
+        """
+        with self.lock:
+            self._journal('addMentions', user, server, channel, list(mentioned), channelMentions, roleMentions)
+            self._add(self.mentions, (user, server, channel),
+                userMentions=len(mentioned), userMentioned=0, channelMentions=channelMentions, roleMentions=roleMentions)
+            for mentionedUser in mentioned:
+                self._add(self.mentions, (mentionedUser, server, channel),
+                    userMentions=0, userMentioned=1, channelMentions=0, roleMentions=0)
+            if len(mentioned) > 0:
+                self.sketches.setdefault((user, server, channel, UsageSketch.MENTIONED), set()).update(mentioned)
+            self.pendingEvents += 1
+
+    def addReaction(self, user, server, channel, messagesReacted=0, userReacted=0, messageReactionsReceived=0, reactionsReceived=0):
+        """
+        Record reactions made by, or received by, user.  Removed reactions are negative.
+        """
+        with self.lock:
+            self._journal('addReaction', user, server, channel, messagesReacted, userReacted, messageReactionsReceived, reactionsReceived)
+            self._add(self.reactions, (user, server, channel),
+                messagesReacted=messagesReacted, userReacted=userReacted,
+                messageReactionsReceived=messageReactionsReceived, reactionsReceived=reactionsReceived)
+            self.pendingEvents += 1
+
+    def addReactor(self, user, server, channel, reactor):
+        """
+        Record that reactor reacted to a message by user.
+        """
+        with self.lock:
+            self._journal('addReactor', user, server, channel, reactor)
+            self.sketches.setdefault((user, server, channel, UsageSketch.REACTORS), set()).add(reactor)
+            self.pendingEvents += 1
+
+    def addCommand(self, user, server, channel, commandName, valid):
+        """
+        Record a command issued by user.
+        """
+        with self.lock:
+            self._journal('addCommand', user, server, channel, commandName, valid)
+            self._add(self.commands, (user, server, channel, commandName, valid), count=1)
+            self.pendingEvents += 1
+
+    def isFull(self):
+        """
+        Check if enough events have been collected that a flush is due.
+        """
+        return self.pendingEvents >= self.flushSize
+
+    @staticmethod
+    def _written(written, tableName):
+        """
+        Raise an error if the usage for tableName could not be written, so the flush is rolled back.
+        """
+        if not written:
+            raise sqlite3.Error("The {0} usage could not be written.".format(tableName))
+
+    def flush(self, database):
+        """
+        Write all of the collected usage to the database in one transaction.  If any of it can't be
+        written the transaction is rolled back and the usage is kept to be written by the next flush.
+        """
+        with self.lock:
+            if self.pendingEvents == 0:
+                return True
+
+            buffers = (self.messages, self.mentions, self.reactions, self.commands, self.activity, self.sketches)
+            pendingEvents = self.pendingEvents
+            self.messages, self.mentions, self.reactions, self.commands, self.activity, self.sketches = {}, {}, {}, {}, {}, {}
+            self.pendingEvents = 0
+            sequence = self.journal.checkpoint() if self.journal != None else None
+
+        messages, mentions, reactions, commands, activity, sketches = buffers
+        waiting = False
+        try:
+            with database.batch():
+                for (user, server, channel), delta in messages.items():
+                    self._written(MessageUsage.increment(database, user, server, channel, **delta), 'usage_messages')
+
+                if len(mentions) > 0:
+                    self._written(MentionUsage.incrementMany(database,
+                        [key + (delta['userMentions'], delta['userMentioned'], delta['channelMentions'], delta['roleMentions'])
+                            for key, delta in mentions.items()]), 'usage_mentions')
+
+                for (user, server, channel), delta in reactions.items():
+                    if any(value != 0 for value in delta.values()): # Added and removed reactions may cancel out.
+                        self._written(ReactionUsage.increment(database, user, server, channel, **delta), 'usage_reactions')
+
+                for (user, server, channel, commandName, valid), delta in commands.items():
+                    self._written(CommandUsage.increment(database, user, server, channel, commandName, valid, **delta), 'usage_commands')
+
+                if len(activity) > 0:
+                    self._written(UsageActivity.incrementMany(database,
+                        [key + (delta['messages'], delta['words']) for key, delta in activity.items()]), 'usage_activity')
+
+                if len(sketches) > 0:
+                    self._written(UsageSketch.incrementMany(database, [key + (users,) for key, users in sketches.items()]), 'usage_sketches')
+
+                if sequence != None:
+                    UsageJournal.saveCheckpoint(database, sequence)
+
+                # This may be part of a larger transaction; wait for it to end before forgetting the usage.
+                database.onTransactionEnd(functools.partial(self._flushEnded, buffers, pendingEvents))
+                waiting = True
+
+            logger.debug("Flushed {0} usage events.".format(pendingEvents))
+            return True
+
+        except Exception as ex:
+            logger.error("Problem flushing usage: {0}".format(ex))
+            if not waiting:
+                self._restore(buffers, pendingEvents)
+            return False
+
+    def _flushEnded(self, buffers, pendingEvents, committed):
+        """
+        Called when the transaction a flush was part of ends.
+        """
+        if committed:
+            if self.journal != None:
+                self.journal.checkpointed()
+        else:
+            logger.warning("Usage flush was rolled back, {0} usage events will be written with the next flush.".format(pendingEvents))
+            self._restore(buffers, pendingEvents)
+
+    def _restore(self, buffers, pendingEvents):
+        """
+        Put usage that could not be written back with the usage collected since.
+        """
+        with self.lock:
+            for current, previous in zip((self.messages, self.mentions, self.reactions, self.commands, self.activity), buffers):
+                for key, delta in previous.items():
+                    entry = current.setdefault(key, {})
+                    for name, value in delta.items():
+                        entry[name] = max(entry.get(name, 0), value) if name == 'maxLength' else entry.get(name, 0) + value
+            for key, users in buffers[-1].items():
+                self.sketches.setdefault(key, set()).update(users)
+            self.pendingEvents += pendingEvents
+
+class ReactionCoalescer:
+    """
+    Nets reaction adds and removes for each user/server/channel over a short window before they
+    are passed on to a UsageAggregator, so a reaction that is toggled costs nothing and a burst
+    of reactions (for example on a poll) becomes a single change per user.  Reactions are only
+    journaled once they are passed on, so the reactions still being collected are lost if the bot
+    stops unexpectedly.
+    """
+    def __init__(self, window=2.0):
+        """
+        Initialize the coalescer.  window is the number of seconds to collect reactions for
+        before isDue() reports that they should be passed on.
+        """
+        self.window = window
+        self.lock = threading.Lock()
+        self.started = None
+        self.reactions = {}
+
+    def add(self, user, author, server, channel, delta):
+        """
+        Record that user added (delta 1) or removed (delta -1) a reaction on a message by author.
+        """
+        with self.lock:
+            if self.started == None:
+                self.started = time.monotonic()
+
+            UsageAggregator._add(self.reactions, (user, server, channel), messagesReacted=delta, userReacted=delta)
+            UsageAggregator._add(self.reactions, (author, server, channel), messageReactionsReceived=delta, reactionsReceived=delta)
+
+    def isDue(self):
+        """
+        Check if the window has passed since the first reaction was collected.
+        """
+        started = self.started
+        return started != None and time.monotonic() - started >= self.window
+
+    def drain(self, aggregator):
+        """
+        Pass the net reaction changes on to aggregator, skipping any that cancelled out.  Returns
+        the number of user/server/channel changes passed on.
+        """
+        with self.lock:
+            reactions = self.reactions
+            self.reactions = {}
+            self.started = None
+
+        changes = 0
+        for (user, server, channel), delta in reactions.items():
+            if any(value != 0 for value in delta.values()):
+                aggregator.addReaction(user, server, channel, **delta)
+                changes += 1
+        return changes
+
+class UsageRank(BaseUsage):
+    """
+    This is the base class used to collect and report usage rankings.
+    """
+    tableName = None # The usage table ranked, set by each subclass.
+    rankColumns = () # The columns of the table that users can be ranked by.
+    SERVER_TABLE_SUFFIX = '_server' # The per-server rollup of a usage table is tableName + this.
+    MAX_ATTACHED = 8 # The most archive files attached at once; SQLite allows 10 by default.
+
+    def __init__(self, database, server, channel, maxRankings=5, since=None, until=None):
+        """
+        Initialize the rank usage class.  since and until are optional (year, month) to rank the
+        usage of a range of months, including the archived months, instead of the live usage.
+        """
+        self.database = database
+        self.server = server
+        self.channel = channel
+        self.maxRankings = maxRankings
+        self.since = since
+        self.until = until
+        self.rankings = []
+        self.allRankings = {}
+
+    @staticmethod
+    def parseMonth(text, last=False):
+        """
+        Parse a month given as YYYY-MM, or a year given as YYYY, which is January of the year, or
+        December if last is true.  Returns (year, month), or None if text is not a month.
+        """
+        match = re.fullmatch(r'(\d{4})(?:-(\d{1,2}))?', text)
+        if match == None:
+            return None
+        year = int(match.group(1))
+        month = int(match.group(2)) if match.group(2) != None else (12 if last else 1)
+        return (year, month) if 1 <= month <= 12 else None
+
+    def historical(self):
+        """
+        Check if the rankings are for a range of months.
+        """
+        return self.since != None or self.until != None
+
+    def _liveSince(self, cur, progress, archivedMonths):
+        """
+        Get the first month the live table's usage can be from: the month being archived if an
+        archive is in progress, otherwise the month after the last month archived.  The live table
+        has no dates, so all of its usage counts as from that month on.
+        """
+        if progress != None:
+            return (progress.year, progress.month)
+
+        cur.execute("select year, month from main.{0}_archive order by year desc, month desc limit 1".format(self.tableName))
+        row = cur.fetchone()
+        if row != None:
+            archivedMonths = archivedMonths + [(row['year'], row['month'])]
+        if len(archivedMonths) == 0:
+            return (0, 0)
+        year, month = max(archivedMonths)
+        return (year + 1, 1) if month == 12 else (year, month + 1)
+
+    def getHistoricalTotalsSQL(self, columns, schemas, legacy=True, live=True, match=None):
+        """
+        Build the query that adds up the columns for each user over the months from since to until,
+        as a union of each of the attached archive files in schemas, the usage archived in the
+        database before there were archive files if legacy is true, and the live table if live is
+        true.  The server and channel, and the columns and values in match, are checked in each part
+        of the union.  Returns the SQL and its values.
+        """
+        since = self.since if self.since != None else (0, 0)
+        until = self.until if self.until != None else (9999, 12)
+        match = match or {}
+        columnList = ", ".join(columns)
+        where = "where server = ? "
+        filterValues = (self.server,)
+        if self.channel != None:
+            where += "and channel = ? "
+            filterValues += (self.channel,)
+        for column, value in match.items():
+            where += "and {0} = ? ".format(column)
+            filterValues += (value,)
+
+        parts = []
+        values = ()
+        for schema in (['main'] if legacy else []) + schemas:
+            parts.append("select user, {0} from {1}.{2}_archive {3}and (year, month) between (?, ?) and (?, ?)".format(
+                columnList, schema, self.tableName, where))
+            values += filterValues + since + until
+        if live:
+            # The server rollup has no channel or valid column, so other matches need the base table.
+            sourceTableName = self.sourceTableName() if set(match) <= {'user'} else self.tableName
+            parts.append("select user, {0} from main.{1} {2}".format(columnList, sourceTableName, where))
+            values += filterValues
+
+        sql = "select user, " + ", ".join("sum({0}) as {0}".format(column) for column in columns)
+        sql += " from (" + " union all ".join(parts) + ") group by user"
+        return sql, values
+
+    def getHistoricalTotals(self, columns, match=None):
+        """
+        Add up the columns for each user over the months from since to until, only counting the rows
+        with the values in match (a dict of column to value, such as {'user': user}) if it is given.
+        Archived months are read from their columnar file if they have one, or else from their archive
+        file, attached MAX_ATTACHED at a time.  Returns a dict of user to a dict of column to total.
+        """
+        since = self.since if self.since != None else (0, 0)
+        until = self.until if self.until != None else (9999, 12)
+        totals = {}
+        def add(user, userTotals):
+            if user not in totals:
+                totals[user] = dict.fromkeys(columns, 0)
+            for column in columns:
+                totals[user][column] += userTotals[column] or 0
+
+        cur = self.database.connection.cursor()
+        try:
+            catalog = UsageArchiver.catalog(self.database)
+            months = [(year, month, fileName, columnarFile) for year, month, fileName, rowsArchived, columnarFile in catalog
+                if since <= (year, month) <= until]
+            progress = UsageArchiver._progress(cur)
+            if progress != None and since <= (progress.year, progress.month) <= until \
+                and not any((year, month) == (progress.year, progress.month) for year, month, fileName, columnarFile in months):
+                # Part of the month being archived is already in its archive file.
+                months.append((progress.year, progress.month, UsageArchiver.fileName(progress.year, progress.month), None))
+            live = until >= self._liveSince(cur, progress, [(year, month) for year, month, fileName, rowsArchived, columnarFile in catalog])
+
+            archiveFiles = []
+            for year, month, fileName, columnarFile in months:
+                if columnarFile != None and os.path.exists(UsageArchiver.archivePath(self.database, columnarFile)):
+                    archive = columnar.ColumnarArchive(UsageArchiver.archivePath(self.database, columnarFile))
+                    for user, userTotals in archive.userTotals(self.tableName, self.server, self.channel, list(columns), match).items():
+                        add(user, userTotals)
+                elif os.path.exists(UsageArchiver.archivePath(self.database, fileName)):
+                    archiveFiles.append(fileName)
+                else:
+                    logger.warning("The archive for {0}-{1:02} is missing, it is left out of the rankings.".format(year, month))
+
+            # The usage archived in the database and the live usage are added up with the first files.
+            chunks = [archiveFiles[start:start + self.MAX_ATTACHED] for start in range(0, len(archiveFiles), self.MAX_ATTACHED)] or [[]]
+            for index, chunk in enumerate(chunks):
+                with ExitStack() as stack:
+                    schemas = [stack.enter_context(UsageArchiver.attach(self.database, fileName)) for fileName in chunk]
+                    sql, values = self.getHistoricalTotalsSQL(columns, schemas, legacy=index == 0, live=live and index == 0, match=match)
+                    cur.execute(sql, values)
+                    for row in cur.fetchall():
+                        add(row['user'], row)
+        finally:
+            cur.close()
+        return totals
+
+    def _rankTotals(self, totals, column):
+        """
+        Rank the users in totals (from getHistoricalTotals) by column, as the rank queries do.
+        """
+        ranked = sorted(totals.items(), key=lambda item: (-item[1][column], item[0]))[:self.maxRankings]
+        return [GenericRank(user, column, userTotals[column]) for user, userTotals in ranked]
+
+    def sourceTableName(self):
+        """
+        Get the table the rankings are read from.  Rankings for a whole server are read from the
+        server rollup of the usage table, which already has each user's totals for the server.
+        """
+        return self.tableName + self.SERVER_TABLE_SUFFIX if self.channel == None else self.tableName
+
+    def getRankingsSQL(self, columnName):
+        """
+        Build the query that ranks the users in the server/channel by columnName.  Returns the
+        SQL and its values.
+        """
+        sql = """select user, 
+            sum({column_name}) as {column_name} 
+            from {table_name} """.format(column_name=columnName, table_name=self.sourceTableName())
+
+        # Build the where clause
+        sql += "where server = ? "
+        values = (self.server,)
+
+        if self.channel != None:
+            sql += "and channel = ? "
+            values += (self.channel,)
+
+        # Add in the group by
+        sql += "group by user "
+
+        # Add in the order by
+        sql += "order by {column_name} desc, user asc ".format(column_name=columnName)
+        # Add the limit
+        sql += "limit ?"
+        values += (self.maxRankings,)
+
+        return sql, values
+
+    def getRankings(self, columnName):
+        """
+        Get the ranking information for the specific server/channel for the identified column.
+        The server must be supplied.  Possible values for columnName are in rankColumns.
+        """
+        self.rankings.clear()
+        if self.server == None:
+            logger.error("Must supply the server.")
+            return False
+
+        if self.database != None:
+            try:
+                # Check that we have all the necessary data first.
+                if self.database.connection == None:
+                    self.database.connect()
+
+                key = (self.tableName, columnName, self.server, self.channel, self.maxRankings, self.since, self.until)
+                cached = self.database.rankCache.get(key)
+                if cached != None:
+                    self.rankings.extend(cached)
+                    return True
+
+                version = self.database.rankCache.version(self.server)
+                started = time.monotonic()
+                if self.historical():
+                    self.rankings.extend(self._rankTotals(self.getHistoricalTotals([columnName]), columnName))
+                else:
+                    sql, values = self.getRankingsSQL(columnName)
+                    cur = self.database.connection.cursor()
+                    cur.execute(sql, values)
+                    for row in cur:
+                        rank = GenericRank(row['user'], columnName, row[columnName])
+                        self.rankings.append(rank)
+
+                    cur.close()
+                self.database.rankCache.put(key, version, self.rankings)
+                self.database.rankCache.recalculated("{0} {1}".format(self.tableName, columnName), time.monotonic() - started)
+                return True
+
+            except Exception as ex:
+                logger.error("Problem getting {0} rankings: {1}".format(self.tableName, ex))
+                return False
+        else:
+            logger.error("No valid DB connection available.")
+            return False
+
+    def getAllRankingsSQL(self, columns):
         """
-        Update a command usage record.  If the object does not have a user, server,
-        and channel set the update cannot be done.
+        Build the query that ranks the users in the server/channel by each of the columns in a
+        single pass over the table: the totals for each user are calculated once and then each
+        column is ranked with a window function.  Returns the SQL and its values.
         """
-        updateSQL = """update usage_commands
-            set count = ? 
-            where user = ? and 
-                server = ? and 
-                channel = ? and 
-                command_name = ? and
-                valid = ?"""
-        values = (self.count, self.user, self.server, self.channel, self.commandName, self.valid)
+        sql = "with totals as (select user, "
+        sql += ", ".join("sum({0}) as {0}".format(column) for column in columns)
+        sql += " from {0} where server = ? ".format(self.sourceTableName())
+        values = (self.server,)
 
-        # Check that we have all the necessary data first.
-        if self.database.connection == None:
-            self.database.connect()
+        if self.channel != None:
+            sql += "and channel = ? "
+            values += (self.channel,)
 
-        if self.server == None and self.user == None and self.channel == None:
-            logger.error("Must supply the user, server, and channel.")
+        sql += "group by user), "
+        sql += "ranked as (select *, "
+        sql += ", ".join("row_number() over (order by {0} desc, user asc) as {0}_rank".format(column) for column in columns)
+        sql += " from totals) "
+
+        # Only the users in the top maxRankings of at least one column are needed.
+        sql += "select * from ranked where "
+        sql += " or ".join("{0}_rank <= ?".format(column) for column in columns)
+        values += (self.maxRankings,) * len(columns)
+
+        return sql, values
+
+    def getAllRankings(self, columns=None):
+        """
+        Get the rankings for every one of columns (by default, all of rankColumns) with one query.
+        The rankings are stored in allRankings, a dict of column name to a list of GenericRank
+        ordered by rank.
+        """
+        columns = columns if columns != None else self.rankColumns
+        self.allRankings = {column: [] for column in columns}
+        if self.server == None:
+            logger.error("Must supply the server.")
             return False
 
-        try:
-            # self.database.connect()
-            cur = self.database.connection.cursor()
-            cur.execute(updateSQL, values)
+        if self.database != None:
+            try:
+                # Check that we have all the necessary data first.
+                if self.database.connection == None:
+                    self.database.connect()
 
-            # Save (commit) the changes
-            self.database.connection.commit()
-            cur.close()
-            return True
+                keys = {column: (self.tableName, column, self.server, self.channel, self.maxRankings, self.since, self.until) for column in columns}
+                for column in columns:
+                    cached = self.database.rankCache.get(keys[column])
+                    if cached == None:
+                        break
+                    self.allRankings[column] = cached
+                else:
+                    return True
+
+                version = self.database.rankCache.version(self.server)
+                started = time.monotonic()
+                if self.historical():
+                    totals = self.getHistoricalTotals(columns)
+                    for column in columns:
+                        self.allRankings[column] = self._rankTotals(totals, column)
+                else:
+                    sql, values = self.getAllRankingsSQL(columns)
+                    cur = self.database.connection.cursor()
+                    cur.execute(sql, values)
+                    rows = cur.fetchall()
+                    cur.close()
 
-        except BaseException as ex:
-            logger.error("There was a problem updating the usage_mentions record: {0}".format(ex))
+                    for column in columns:
+                        rankColumn = "{0}_rank".format(column)
+                        ranked = sorted((row for row in rows if row[rankColumn] <= self.maxRankings), key=lambda row: row[rankColumn])
+                        self.allRankings[column] = [GenericRank(row['user'], column, row[column]) for row in ranked]
+
+                for column in columns:
+                    self.database.rankCache.put(keys[column], version, self.allRankings[column])
+                self.database.rankCache.recalculated(self.tableName, time.monotonic() - started)
+                return True
+
+            except Exception as ex:
+                logger.error("Problem getting {0} rankings: {1}".format(self.tableName, ex))
+                return False
+        else:
+            logger.error("No valid DB connection available.")
             return False
 
-class UsageRank(BaseUsage):
-    """
-    This is the base class used to collect and report usage rankings.
-    """
-    def __init__(self, database, server, channel, maxRankings=5):
+    @classmethod
+    def fetchAll(cls, database, server, channel, maxRankings=5, columns=None, since=None, until=None):
         """
-        Initialize the rank usage class.
+        Create the rankings for the server/channel, fill them with getAllRankings and return
+        allRankings.
         """
-        self.database = database
-        self.server = server
-        self.channel = channel
-        self.maxRankings = maxRankings
-        self.rankings = []
+        usageRank = cls(database, server, channel, maxRankings, since, until)
+        usageRank.getAllRankings(columns)
+        return usageRank.allRankings
+
+    @staticmethod
+    def fetchEveryTable(database, server, channel, maxRankings=5, columns=None, since=None, until=None):
+        """
+        Get the rankings for every usage table, one query per table.  columns is an optional dict
+        of table name to the columns to rank for that table; tables that are not in it are
+        skipped.  Returns a dict of table name to the table's allRankings.
+        """
+        rankClasses = (MessageUsageRank, MentionUsageRank, ReactionUsageRank, CommandUsageRank)
+        return {rankClass.tableName: rankClass.fetchAll(database, server, channel, maxRankings, columns[rankClass.tableName] if columns != None else None, since, until)
+            for rankClass in rankClasses if columns == None or rankClass.tableName in columns}
+
+    @classmethod
+    def fetch(cls, database, getter, server, channel, maxRankings=5, since=None, until=None):
+        """
+        Create the rankings for the server/channel, fill them with getter (for example
+        MessageUsageRank.getRankingsByWordCount) and return the list of rankings.
+        """
+        usageRank = cls(database, server, channel, maxRankings, since, until)
+        getter(usageRank)
+        return usageRank.rankings
 
 class GenericRank:
     """
@@ -946,73 +3535,17 @@ class MessageUsageRank(UsageRank):
     """
     This class is used to collect and report message usage rankings.
     """
-    def __init__(self, database, server, channel, maxRankings=5):
+    tableName = 'usage_messages'
+    rankColumns = ('message_count', 'word_count', 'character_count', 'max_message_length', 'url_count')
+
+    def __init__(self, database, server, channel, maxRankings=5, since=None, until=None):
         """
         Initialize the message rank usage class.
         """
-        UsageRank.__init__(self, database, server, channel, maxRankings)
+        UsageRank.__init__(self, database, server, channel, maxRankings, since, until)
         self.rankings = []
         # self.top = {"Most Words": {"User": None, "Size": 0}, "Most Characters": {"User": None, "Size": 0}, "Longest Message": {"User": None, "Size": 0}}
 
-    def getRankings(self, columnName):
-        """
-        Get the ranking information for the specific user/server/channel for the identified column.
-        At least one of user, server, or channel must be supplied.
-        Possible values for columnName: word_count, character_count, max_message_length
-        """
-        self.rankings.clear()
-        sql = """select user, 
-            sum({column_name}) as {column_name} 
-            from usage_messages """.format(column_name=columnName)
-        if self.server == None and self.channel == None:
-            logger.error("Must supply at least server, or channel.")
-            return False
-        else:
-            # Build the where clause
-            sql += "where "
-            values = ()
-
-            if self.server != None:
-                sql += "server = ? "
-                values += (self.server,)
-
-            if self.channel != None:
-                sql += " and " if len(values) > 0 else ""
-                sql += "channel = ? "
-                values += (self.channel,)
-
-        # Add in the group by
-        sql += "group by user "
-
-        # Add in the order by
-        sql += "order by {column_name} desc, user asc ".format(column_name=columnName)
-        # Add the limit
-        sql += "limit ?"
-        values += (self.maxRankings,)
-
-        if self.database != None:
-            try:
-                # Check that we have all the necessary data first.
-                if self.database.connection == None:
-                    self.database.connect()
-
-                self.database.connection.row_factory = sqlite3.Row
-                cur = self.database.connection.cursor()
-                cur.execute(sql, values)
-                for row in cur:
-                    rank = GenericRank(row['user'], columnName, row[columnName])
-                    self.rankings.append(rank)
-                
-                cur.close()
-                return True
-
-            except Exception as ex:
-                logger.error("Problem getting message usage: {0}".format(ex))
-                return False
-        else:
-            logger.error("No valid DB connection available.")
-            return False
-
     def getRankingsByWordCount(self):
         """
         Get the rankings by word count.
@@ -1047,73 +3580,17 @@ class ReactionUsageRank(UsageRank):
     """
     This class is used to collect and report reaction usage rankings.
     """
-    def __init__(self, database, server, channel, maxRankings=5):
+    tableName = 'usage_reactions'
+    rankColumns = ('messages_reacted_count', 'user_reacted_count', 'message_reactions_received_count', 'reactions_received_count')
+
+    def __init__(self, database, server, channel, maxRankings=5, since=None, until=None):
         """
         Initialize the reaction rank usage class.
         """
-        UsageRank.__init__(self, database, server, channel, maxRankings)
+        UsageRank.__init__(self, database, server, channel, maxRankings, since, until)
         self.rankings = []
         # self.top = {"Most Words": {"User": None, "Size": 0}, "Most Characters": {"User": None, "Size": 0}, "Longest Message": {"User": None, "Size": 0}}
 
-    def getRankings(self, columnName):
-        """
-        Get the ranking information for the specific user/server/channel for the identified column.
-        At least one of user, server, or channel must be supplied.
-        Possible values for columnName: messages_reacted_count, user_reacted_count, message_reactions_received_count, reactions_received_count
-        """
-        self.rankings.clear()
-        sql = """select user, 
-            sum({column_name}) as {column_name} 
-            from usage_reactions """.format(column_name=columnName)
-        if self.server == None and self.channel == None:
-            logger.error("Must supply at least server, or channel.")
-            return False
-        else:
-            # Build the where clause
-            sql += "where "
-            values = ()
-
-            if self.server != None:
-                sql += "server = ? "
-                values += (self.server,)
-
-            if self.channel != None:
-                sql += " and " if len(values) > 0 else ""
-                sql += "channel = ? "
-                values += (self.channel,)
-
-        # Add in the group by
-        sql += "group by user "
-
-        # Add in the order by
-        sql += "order by {column_name} desc, user asc ".format(column_name=columnName)
-        # Add the limit
-        sql += "limit ?"
-        values += (self.maxRankings,)
-
-        if self.database != None:
-            try:
-                # Check that we have all the necessary data first.
-                if self.database.connection == None:
-                    self.database.connect()
-
-                self.database.connection.row_factory = sqlite3.Row
-                cur = self.database.connection.cursor()
-                cur.execute(sql, values)
-                for row in cur:
-                    rank = GenericRank(row['user'], columnName, row[columnName])
-                    self.rankings.append(rank)
-                
-                cur.close()
-                return True
-
-            except Exception as ex:
-                logger.error("Problem getting message usage: {0}".format(ex))
-                return False
-        else:
-            logger.error("No valid DB connection available.")
-            return False
-
     def getRankingsByMessagesReacted(self):
         """
         Get the top users that have reacted to the most messages.
@@ -1142,72 +3619,16 @@ class MentionUsageRank(UsageRank):
     """
     This class is used to collect and report mention usage rankings.
     """
-    def __init__(self, database, server, channel, maxRankings=5):
+    tableName = 'usage_mentions'
+    rankColumns = ('user_mentions', 'user_mentioned', 'channel_mentions', 'role_mentions')
+
+    def __init__(self, database, server, channel, maxRankings=5, since=None, until=None):
         """
         Initialize the mention rank usage class.
         """
-        UsageRank.__init__(self, database, server, channel, maxRankings)
+        UsageRank.__init__(self, database, server, channel, maxRankings, since, until)
         self.rankings = []
 
-    def getRankings(self, columnName):
-        """
-        Get the ranking information for the specific user/server/channel for the identified column.
-        At least one of user, server, or channel must be supplied.
-        Possible values for columnName: messages_reacted_count, user_reacted_count, message_reactions_received_count, reactions_received_count
-        """
-        self.rankings.clear()
-        sql = """select user, 
-            sum({column_name}) as {column_name} 
-            from usage_mentions """.format(column_name=columnName)
-        if self.server == None and self.channel == None:
-            logger.error("Must supply at least server, or channel.")
-            return False
-        else:
-            # Build the where clause
-            sql += "where "
-            values = ()
-
-            if self.server != None:
-                sql += "server = ? "
-                values += (self.server,)
-
-            if self.channel != None:
-                sql += " and " if len(values) > 0 else ""
-                sql += "channel = ? "
-                values += (self.channel,)
-
-        # Add in the group by
-        sql += "group by user "
-
-        # Add in the order by
-        sql += "order by {column_name} desc, user asc ".format(column_name=columnName)
-        # Add the limit
-        sql += "limit ?"
-        values += (self.maxRankings,)
-
-        if self.database != None:
-            try:
-                # Check that we have all the necessary data first.
-                if self.database.connection == None:
-                    self.database.connect()
-
-                self.database.connection.row_factory = sqlite3.Row
-                cur = self.database.connection.cursor()
-                cur.execute(sql, values)
-                for row in cur:
-                    rank = GenericRank(row['user'], columnName, row[columnName])
-                    self.rankings.append(rank)
-                
-                cur.close()
-                return True
-
-            except Exception as ex:
-                logger.error("Problem getting message usage: {0}".format(ex))
-                return False
-        else:
-            logger.error("No valid DB connection available.")
-            return False
-
     def getRankingsByUserMentions(self):
         """
         Get users that have mentioned the most people.
@@ -1236,77 +3657,16 @@ class CommandUsageRank(UsageRank):
     """
     This class is used to collect and report command usage rankings.
     """
-    def __init__(self, database, server, channel, maxRankings=5):
+    tableName = 'usage_commands'
+    rankColumns = ('count', 'valid')
+
+    def __init__(self, database, server, channel, maxRankings=5, since=None, until=None):
         """
         Initialize the command rank usage class.
         """
-        UsageRank.__init__(self, database, server, channel, maxRankings)
+        UsageRank.__init__(self, database, server, channel, maxRankings, since, until)
         self.rankings = []
 
-    def getRankings(self, columnName):
-        """
-        Get the ranking information for the specific user/server/channel for the identified column.
-        At least one of user, server, or channel must be supplied.
-        Possible values for columnName: command_name, valid
-        """
-        self.rankings.clear()
-        sql = """select user, 
-            sum({column_name}) as {column_name} 
-            from usage_commands """.format(column_name=columnName)
-        if self.server == None and self.channel == None:
-            logger.error("Must supply at least server, or channel.")
-            return False
-        else:
-            # Build the where clause
-            sql += "where "
-            values = ()
-
-            if self.server != None:
-                sql += "server = ? "
-                values += (self.server,)
-
-            if self.channel != None:
-                sql += " and " if len(values) > 0 else ""
-                sql += "channel = ? "
-                values += (self.channel,)
-
-            # if self.commandName != None:
-            #     sql += " and " if len(values) > 0 else ""
-            #     sql += "command_name = ? "
-            #     values += (self.commandName,)
-
-        # Add in the group by
-        sql += "group by user "
-
-        # Add in the order by
-        sql += "order by {column_name} desc, user asc ".format(column_name=columnName)
-        # Add the limit
-        sql += "limit ?"
-        values += (self.maxRankings,)
-
-        if self.database != None:
-            try:
-                # Check that we have all the necessary data first.
-                if self.database.connection == None:
-                    self.database.connect()
-
-                self.database.connection.row_factory = sqlite3.Row
-                cur = self.database.connection.cursor()
-                cur.execute(sql, values)
-                for row in cur:
-                    rank = GenericRank(row['user'], columnName, row[columnName])
-                    self.rankings.append(rank)
-                
-                cur.close()
-                return True
-
-            except Exception as ex:
-                logger.error("Problem getting command usage: {0}".format(ex))
-                return False
-        else:
-            logger.error("No valid DB connection available.")
-            return False
-
     def getRankingsByCount(self):
         """
         Get the rankings by command name.
@@ -1332,4 +3692,15 @@ if __name__ == "__main__":
     # add the handlers to logger
     logger.addHandler(ch)
 
+    if len(sys.argv) == 3 and sys.argv[1] == '--dry-run':
+        # python db.py --dry-run abbot.sqlite3: see how long the pending updates would take on a copy of a database.
+        timings, error = MigrationRunner.dryRun(sys.argv[2])
+        for update, fileName, duration in timings:
+            print("{0:>4} {1:<45} {2:>10.1f} ms".format(update, fileName, duration))
+        print("Total: {0:.1f} ms".format(sum(timing[2] for timing in timings)))
+        if error != None:
+            print(error)
+            sys.exit(1)
+        sys.exit(0)
+
     database = AbbotDatabase('abbot.sqlite3')
\ No newline at end of file
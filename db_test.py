@@ -1,11 +1,21 @@
 import sqlite3
 import datetime
+import os
 import random
+import re
+import shutil
 import string
 import logging
+import sys
+import tempfile
+import time
 
 import discord
 
+import columnar
+import db
+import sketches
+
 DATABASE_NAME = 'abbot.sqlite3'
 
 def cleanDB(tableName = None):
@@ -341,6 +351,468 @@ def messageUsage(server, channels, users):
     logger.debug("----------------------------------------------------------------")
     summarizeMessageUsage(server, channels[random.randint(0, len(channels)-1)], users[random.randint(0, len(users)-1)])
 
+def testRankQueryPlans():
+    """ This function checks the query plan of every rank query, for a server and for a channel, and
+        fails if any of them does a full scan of a usage table. """
+    fullScan = re.compile(r'\bSCAN (TABLE )?usage_')
+    folder = tempfile.mkdtemp()
+    database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+    try:
+        for rankClass in [db.MessageUsageRank, db.ReactionUsageRank, db.MentionUsageRank, db.CommandUsageRank]:
+            for channel in [None, 'channel']:
+                usageRank = rankClass(database, 'server', channel)
+                queries = [usageRank.getRankingsSQL(column) for column in rankClass.rankColumns]
+                queries.append(usageRank.getAllRankingsSQL(rankClass.rankColumns))
+
+                for sql, values in queries:
+                    for row in database.connection.execute('explain query plan ' + sql, values):
+                        assert not fullScan.search(row['detail']), \
+                            "Full scan in {0} rank query (channel={1}): {2}\n{3}".format(rankClass.tableName, channel, row['detail'], sql)
+    finally:
+        database.close()
+        shutil.rmtree(folder)
+
+def testActivityQueryPlans():
+    """ This function checks that the activity queries, for a server and for a channel, are range scans
+        of a covering index, and that pruning old activity is a range scan of the hour index. """
+    folder = tempfile.mkdtemp()
+    database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+    try:
+        for channel in [None, 'channel']:
+            sql, values = db.UsageActivity.fetchSQL('server', channel, since=1000, until=1168)
+            details = [row['detail'] for row in database.connection.execute('explain query plan ' + sql, values)]
+            assert any('COVERING INDEX' in detail and 'hour_bucket>?' in detail for detail in details), \
+                "Activity query (channel={0}) is not a covering range scan: {1}".format(channel, details)
+
+        sql, values = db.UsageActivity.pruneSQL(1000, 500)
+        details = [row['detail'] for row in database.connection.execute('explain query plan ' + sql, values)]
+        assert any('usage_activity_hour' in detail and 'hour_bucket<?' in detail for detail in details), \
+            "Activity prune is not a range scan of the hour index: {0}".format(details)
+    finally:
+        database.close()
+        shutil.rmtree(folder)
+
+def testHistoricalRankQueryPlans():
+    """ This function checks the query plan of the rank query for a range of months, for a server and for a
+        channel, and fails if it does a full scan of the archived usage or the live usage. """
+    fullScan = re.compile(r'\bSCAN (TABLE )?(\w+\.)?usage_')
+    folder = tempfile.mkdtemp()
+    database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+    try:
+        with db.UsageArchiver.attach(database, db.UsageArchiver.fileName(2026, 1), create=True) as schema:
+            for rankClass in [db.MessageUsageRank, db.ReactionUsageRank, db.MentionUsageRank, db.CommandUsageRank]:
+                for channel in [None, 'channel']:
+                    usageRank = rankClass(database, 'server', channel, since=(2026, 1), until=(2026, 6))
+                    sql, values = usageRank.getHistoricalTotalsSQL(rankClass.rankColumns, [schema])
+                    for row in database.connection.execute('explain query plan ' + sql, values):
+                        assert not fullScan.search(row['detail']), \
+                            "Full scan in {0} historical rank query (channel={1}): {2}\n{3}".format(rankClass.tableName, channel, row['detail'], sql)
+    finally:
+        database.close()
+        shutil.rmtree(folder)
+
+def testMigrationFailure():
+    """ This function checks that a failed update is rolled back completely, stops the updates after it,
+        and leaves the updates before it applied and recorded. """
+    folder = tempfile.mkdtemp()
+    try:
+        database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+        version = database.getVersion()
+        updates = os.path.join(folder, 'updates')
+        shutil.copytree(db.DATABASE_UPDATE_FOLDER, updates)
+        for update, script in [(version + 1, "create table good (x);\npragma user_version = {0};".format(version + 1)),
+                               (version + 2, "create table partial (x);\ninsert into missing values (1);\npragma user_version = {0};".format(version + 2)),
+                               (version + 3, "create table later (x);\npragma user_version = {0};".format(version + 3))]:
+            os.makedirs(os.path.join(updates, str(update)))
+            with open(os.path.join(updates, str(update), 'update{0}.txt'.format(update)), 'w') as updateList:
+                updateList.write('test.sql')
+            with open(os.path.join(updates, str(update), 'test.sql'), 'w') as updateFile:
+                updateFile.write(script)
+
+        runner = db.MigrationRunner(database.connection, updates)
+        try:
+            runner.run(runner.pending(version))
+            assert False, "The failing update did not raise MigrationError."
+        except db.MigrationError as ex:
+            assert ex.update == version + 2, "Update {0} failed, expected {1}.".format(ex.update, version + 2)
+
+        assert database.getVersion() == version + 1, "Database is at version {0}, expected {1}.".format(database.getVersion(), version + 1)
+        tables = [row['name'] for row in database.connection.execute("select name from sqlite_master where name in ('good', 'partial', 'later')")]
+        assert tables == ['good'], "Unexpected tables after the failed update: {0}".format(tables)
+        recorded = database.connection.execute("select count(*) from schema_migrations where version > ?", (version,)).fetchone()[0]
+        assert recorded == 1, "{0} files recorded for the new updates, expected 1.".format(recorded)
+        database.close()
+    finally:
+        shutil.rmtree(folder)
+
+def testFailedFlush():
+    """ This function checks that when part of a usage flush can't be written, none of it is, and the usage
+        and its journal entries are kept for the next flush. """
+    folder = tempfile.mkdtemp()
+    try:
+        database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+        journal = db.UsageJournal(os.path.join(folder, 'abbot_test.sqlite3.usagelog'))
+        aggregator = db.UsageAggregator(journal=journal)
+        for words in range(3):
+            aggregator.addMessage('user', 'server', 'channel', words, words * 5, 0)
+            aggregator.addCommand('user', 'server', 'channel', 'help', True)
+
+        database.connection.execute("create temp trigger fail_messages before insert on usage_messages begin select raise(abort, 'failed'); end")
+        assert not aggregator.flush(database), "The flush did not fail."
+        assert aggregator.pendingEvents == 6, "{0} usage events kept, expected 6.".format(aggregator.pendingEvents)
+        assert os.path.exists(journal.checkpointPath), "The journal entries of the failed flush were removed."
+        written = database.connection.execute("select count(*) from usage_commands").fetchone()[0]
+        assert written == 0, "{0} command usage rows were written by the failed flush.".format(written)
+
+        database.connection.execute("drop trigger fail_messages")
+        assert aggregator.flush(database), "The flush failed."
+        messages = database.connection.execute("select message_count from usage_messages").fetchone()[0]
+        assert messages == 3, "{0} messages written, expected 3.".format(messages)
+        assert not os.path.exists(journal.checkpointPath), "The journal entries were not removed after the flush."
+        journal.close()
+        database.close()
+    finally:
+        shutil.rmtree(folder)
+
+def testJournalAfterRestart():
+    """ This function checks that usage journaled after a clean restart is replayed if the bot then stops
+        before flushing it. """
+    folder = tempfile.mkdtemp()
+    try:
+        databaseName = os.path.join(folder, 'abbot_test.sqlite3')
+        journal = db.UsageJournal(databaseName + '.usagelog')
+        database = db.AbbotDatabase(databaseName, journal=journal)
+        aggregator = db.UsageAggregator(journal=journal)
+        for words in range(3):
+            aggregator.addMessage('user', 'server', 'channel', words, words * 5, 0)
+        assert aggregator.flush(database), "The flush failed."
+        journal.close()
+        database.close()
+
+        # Restart cleanly, then stop without flushing.
+        journal = db.UsageJournal(databaseName + '.usagelog')
+        database = db.AbbotDatabase(databaseName, journal=journal)
+        aggregator = db.UsageAggregator(journal=journal)
+        for words in range(2):
+            aggregator.addMessage('user', 'server', 'channel', words, words * 5, 0)
+        journal.close()
+        database.close()
+
+        journal = db.UsageJournal(databaseName + '.usagelog')
+        database = db.AbbotDatabase(databaseName, journal=journal)
+        messages = database.connection.execute("select message_count from usage_messages").fetchone()[0]
+        assert messages == 5, "{0} messages after the journal was replayed, expected 5.".format(messages)
+        journal.close()
+        database.close()
+    finally:
+        shutil.rmtree(folder)
+
+def testSnapshotCache():
+    """ This function checks that a usage snapshot is read from the usage cache until more of the user's usage
+        is written. """
+    folder = tempfile.mkdtemp()
+    try:
+        database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+        aggregator = db.UsageAggregator()
+        aggregator.addMessage('user', 'server', 'channel', 3, 15, 0)
+        assert aggregator.flush(database), "The flush failed."
+
+        for channel in ['channel', None]:
+            snapshot = db.UsageSnapshot.fetch(database, 'user', 'server', channel)
+            hits = database.cache.hits
+            cached = db.UsageSnapshot.fetch(database, 'user', 'server', channel)
+            assert database.cache.hits == hits + 1, "The snapshot (channel={0}) was not read from the cache.".format(channel)
+            assert cached.messages.wordCount == snapshot.messages.wordCount == 3, \
+                "The cached snapshot (channel={0}) has {1} words, expected 3.".format(channel, cached.messages.wordCount)
+
+        aggregator.addMessage('user', 'server', 'channel', 4, 20, 0)
+        aggregator.addCommand('user', 'server', 'channel', 'help', True)
+        assert aggregator.flush(database), "The flush failed."
+        for channel in ['channel', None]:
+            snapshot = db.UsageSnapshot.fetch(database, 'user', 'server', channel)
+            assert snapshot.messages.wordCount == 7 and snapshot.validCommands.count == 1, \
+                "The snapshot (channel={0}) was not updated after the usage was written.".format(channel)
+        database.close()
+    finally:
+        shutil.rmtree(folder)
+
+def testActivityPrune():
+    """ This function checks that pruning the activity deletes only the hours older than the retention, a batch
+        at a time. """
+    folder = tempfile.mkdtemp()
+    try:
+        database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+        now = db.UsageActivity.hourBucket()
+        assert db.UsageActivity.incrementMany(database, [('user', 'server', 'channel', now - hours, 1, 1) for hours in range(0, 24 * 10, 6)]), \
+            "The activity could not be written."
+
+        assert db.UsageActivity.prune(database, 5, batchSize=3) == 3, "The first batch did not delete 3 hours."
+        while db.UsageActivity.prune(database, 5, batchSize=3) > 0:
+            pass
+        oldest = database.connection.execute("select min(hour_bucket), count(*) from usage_activity").fetchone()
+        assert oldest[0] >= now - 5 * 24 and oldest[1] == 21, "Activity left after pruning: {0} hours from {1}.".format(oldest[1], oldest[0])
+        database.close()
+    finally:
+        shutil.rmtree(folder)
+
+def testSketches():
+    """ This function checks that the HyperLogLog sketches count within their error bound, survive being saved and
+        loaded, and merge to the count of the union, in Python and in SQL. """
+    for size in [100, 20000]:
+        sketch = sketches.HyperLogLog()
+        sketch.update(range(size))
+        sketch.update(range(size)) # Values added again are not counted twice.
+        error = abs(sketch.count() - size) / size
+        assert error < 0.07, "Sketch of {0} values counted {1} ({2:.1%} off).".format(size, sketch.count(), error)
+        loaded = sketches.HyperLogLog.fromBytes(sketch.toBytes())
+        assert loaded.count() == sketch.count(), "Saved sketch counts {0}, expected {1}.".format(loaded.count(), sketch.count())
+
+    first = sketches.HyperLogLog()
+    first.update(range(0, 6000))
+    second = sketches.HyperLogLog()
+    second.update(range(4000, 10000))
+    merged = sketches.HyperLogLog.fromBytes(sketches.HyperLogLog.mergeBytes(first.toBytes(), second.toBytes()))
+    error = abs(merged.count() - 10000) / 10000
+    assert error < 0.07, "Merged sketch counted {0} ({1:.1%} off), expected about 10000.".format(merged.count(), error)
+    assert sketches.HyperLogLog.countBytes(None) == 0, "A missing sketch does not count 0."
+
+    connection = sqlite3.connect(':memory:')
+    sketches.HyperLogLog.register(connection)
+    connection.execute("create table sketch_test (sketch blob)")
+    connection.executemany("insert into sketch_test values (?)", [(first.toBytes(),), (second.toBytes(),), (None,)])
+    counted = connection.execute("select hll_count(hll_union(sketch)) from sketch_test").fetchone()[0]
+    assert counted == merged.count(), "hll_union counted {0}, expected {1}.".format(counted, merged.count())
+    connection.close()
+
+def archiveRandomUsage(folder, events):
+    """ This function writes random usage to a new database in folder, archives it, and exports the archived month
+        to a columnar file.  Returns the database, the archive file's path, and the columnar file's path. """
+    database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+    aggregator = db.UsageAggregator(flushSize=events)
+    for event in range(events):
+        user = str(random.randint(10**17, 10**17 + 3000))
+        server = 's{0}'.format(random.randint(0, 3))
+        channel = '{0}c{1}'.format(server, random.randint(0, 9))
+        aggregator.addMessage(user, server, channel, random.randint(0, 20), random.randint(0, 100), random.randint(0, 1))
+        aggregator.addCommand(user, server, channel, 'command{0}'.format(random.randint(0, 5)), True)
+        if event % 3 == 0:
+            aggregator.addReactor(user, server, channel, 'reactor{0}'.format(event))
+    assert aggregator.flush(database), "The flush failed."
+    assert database.archive(batchSize=5000), "The archive failed."
+
+    (year, month, fileName, rowsArchived, columnarFile), = db.UsageArchiver.catalog(database)
+    columnarFile = db.UsageArchiver.exportColumnar(database, year, month)
+    assert columnarFile != None, "The export failed."
+    return database, db.UsageArchiver.archivePath(database, fileName), db.UsageArchiver.archivePath(database, columnarFile)
+
+def testColumnarArchive():
+    """ This function checks that a month exported to a columnar file reads back the same as the month's archive
+        file, and that its totals and rankings match the same queries in SQL. """
+    folder = tempfile.mkdtemp()
+    try:
+        database, archivePath, columnarPath = archiveRandomUsage(folder, 5000)
+        archive = columnar.ColumnarArchive(columnarPath)
+        connection = sqlite3.connect(archivePath)
+
+        for tableName in archive.tables():
+            expected = connection.execute("select count(*) from {0}_archive".format(tableName)).fetchone()[0]
+            assert archive.rows(tableName) == expected, "{0} has {1} rows, expected {2}.".format(tableName, archive.rows(tableName), expected)
+        sketchBlobs = sorted(connection.execute("select sketch from usage_sketches_archive").fetchall())
+        assert sorted((sketch,) for sketch in archive.column('usage_sketches', 'sketch')) == sketchBlobs, "The sketches do not match."
+
+        for server in ['s0', 's2', 'missing']:
+            for channel in [None, server + 'c3']:
+                where = "where server = ? " + ("and channel = ? " if channel != None else "")
+                values = (server,) + ((channel,) if channel != None else ())
+                for tableName, column in [('usage_messages', 'word_count'), ('usage_messages', 'max_message_length'), ('usage_commands', 'count')]:
+                    expected = connection.execute("select user, sum({0}) as total from {1}_archive {2}group by user order by total desc, user asc limit 5".format(
+                        column, tableName, where), values).fetchall()
+                    ranked = archive.topUsers(tableName, column, server, channel)
+                    assert [tuple(row) for row in ranked] == expected, \
+                        "{0} {1} rankings for {2}/{3} do not match: {4} {5}".format(tableName, column, server, channel, ranked, expected)
+
+                expected = dict(connection.execute("select user, sum(message_count) from usage_messages_archive {0}group by user".format(where), values).fetchall())
+                totals = {user: total['message_count'] for user, total in archive.userTotals('usage_messages', server, channel).items()}
+                assert totals == expected, "Message totals for {0}/{1} do not match.".format(server, channel)
+        connection.close()
+        database.close()
+    finally:
+        shutil.rmtree(folder)
+
+def benchmarkColumnarArchive(events=60000):
+    """ This function compares the size of a month's archive file and its columnar file, and how long each takes to
+        rank the users of every server.  Run with: python db_test.py benchmark """
+    folder = tempfile.mkdtemp()
+    try:
+        database, archivePath, columnarPath = archiveRandomUsage(folder, events)
+        logger.info("Archive file: {0:,} bytes, columnar file: {1:,} bytes.".format(os.path.getsize(archivePath), os.path.getsize(columnarPath)))
+
+        connection = sqlite3.connect(archivePath)
+        started = time.monotonic()
+        for server in ['s0', 's1', 's2', 's3']:
+            connection.execute("select user, sum(word_count) as total from usage_messages_archive where server = ? group by user order by total desc, user asc limit 5",
+                (server,)).fetchall()
+        sqliteTime = time.monotonic() - started
+        connection.close()
+
+        archive = columnar.ColumnarArchive(columnarPath)
+        started = time.monotonic()
+        for server in ['s0', 's1', 's2', 's3']:
+            archive.topUsers('usage_messages', 'word_count', server)
+        logger.info("Ranking every server: archive file {0:.3f} seconds, columnar file {1:.3f} seconds.".format(sqliteTime, time.monotonic() - started))
+        database.close()
+    finally:
+        shutil.rmtree(folder)
+
+def testArchiveTwice():
+    """ This function checks that archiving a month twice adds the second archive to the first, and that a batch
+        copied again after the bot stopped before deleting it is not added twice. """
+    folder = tempfile.mkdtemp()
+    try:
+        database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+        aggregator = db.UsageAggregator()
+        def archivedMessages():
+            (year, month, fileName, rowsArchived, columnarFile), = db.UsageArchiver.catalog(database)
+            with db.UsageArchiver.attach(database, fileName) as schema:
+                return database.connection.execute("select message_count from {0}.usage_messages_archive".format(schema)).fetchone()[0]
+
+        for words in range(5):
+            aggregator.addMessage('user', 'server', 'channel', words, words * 5, 0)
+        assert aggregator.flush(database) and database.archive(), "The first archive failed."
+
+        for words in range(2):
+            aggregator.addMessage('user', 'server', 'channel', words, words * 5, 0)
+        assert aggregator.flush(database), "The flush failed."
+        database.connection.execute("create temp trigger fail_archive before delete on usage_messages begin select raise(abort, 'failed'); end")
+        progress = db.UsageArchiver.start(database)
+        while progress != None:
+            progress = db.UsageArchiver.step(database)
+        database.connection.execute("drop trigger fail_archive")
+        assert database.archive(), "The second archive failed."
+
+        assert archivedMessages() == 7, "{0} messages archived, expected 7.".format(archivedMessages())
+        remaining = database.connection.execute("select count(*) from usage_messages").fetchone()[0]
+        assert remaining == 0, "{0} message usage rows left after the archive.".format(remaining)
+        database.close()
+    finally:
+        shutil.rmtree(folder)
+
+def testArchiveEmpty():
+    """ This function checks that archiving an empty database does not leave an archive in progress behind, so the
+        usage written afterwards is archived by the next archive. """
+    folder = tempfile.mkdtemp()
+    try:
+        database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+        assert database.archive(), "The archive of the empty database failed."
+        assert db.UsageArchiver.progress(database) == None, "The archive of the empty database was left in progress."
+
+        aggregator = db.UsageAggregator()
+        for words in range(3):
+            aggregator.addMessage('user', 'server', 'channel', words, words * 5, 0)
+        assert aggregator.flush(database) and database.archive(), "The second archive failed."
+        remaining = database.connection.execute("select count(*) from usage_messages").fetchone()[0]
+        assert remaining == 0, "{0} message usage rows left after the archive.".format(remaining)
+        catalog = db.UsageArchiver.catalog(database)
+        assert len(catalog) == 1, "{0} months in the catalog, expected 1.".format(len(catalog))
+        database.close()
+    finally:
+        shutil.rmtree(folder)
+
+def testArchiveMonthEnd():
+    """ This function checks that an archive on the last day of a month is archived as the month before, and that
+        the month is then counted as archived. """
+    folder = tempfile.mkdtemp()
+    try:
+        database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+        for now, lastMonth in [('2026-10-31', (2026, 9)), ('2026-03-30', (2026, 2)), ('2027-01-01', (2026, 12))]:
+            db.UsageArchiver.NOW = now
+            found = db.UsageArchiver.lastMonth(database.connection.cursor())
+            assert found == lastMonth, "Last month on {0} is {1}, expected {2}.".format(now, found, lastMonth)
+
+        db.UsageArchiver.NOW = '2026-10-31'
+        aggregator = db.UsageAggregator()
+        aggregator.addMessage('user', 'server', 'channel', 3, 15, 0)
+        assert not db.UsageArchiver.archived(database), "September was archived before the archive."
+        assert aggregator.flush(database) and database.archive(), "The archive failed."
+        (year, month, fileName, rowsArchived, columnarFile), = db.UsageArchiver.catalog(database)
+        assert (year, month) == (2026, 9), "The usage was archived as {0}-{1:02}, expected 2026-09.".format(year, month)
+        assert db.UsageArchiver.archived(database), "September was not archived after the archive."
+        database.close()
+    finally:
+        db.UsageArchiver.NOW = 'now'
+        shutil.rmtree(folder)
+
+def testSnapshotRange():
+    """ This function checks that a usage snapshot for a range of months adds up the archived months, from their
+        archive file or their columnar file, and the live usage. """
+    folder = tempfile.mkdtemp()
+    try:
+        database = db.AbbotDatabase(os.path.join(folder, 'abbot_test.sqlite3'))
+        aggregator = db.UsageAggregator()
+        aggregator.addMessage('user', 'server', 'channel', 5, 25, 1)
+        aggregator.addMessage('other', 'server', 'channel', 8, 40, 0)
+        aggregator.addCommand('user', 'server', 'channel', 'help', True)
+        aggregator.addCommand('user', 'server', 'channel', 'nope', False)
+        assert aggregator.flush(database) and database.archive(), "The archive failed."
+        (year, month, fileName, rowsArchived, columnarFile), = db.UsageArchiver.catalog(database)
+        liveMonth = (year + 1, 1) if month == 12 else (year, month + 1)
+
+        aggregator.addMessage('user', 'server', 'other channel', 4, 20, 0)
+        aggregator.addCommand('user', 'server', 'channel', 'help', True)
+        assert aggregator.flush(database), "The flush failed."
+
+        for columnar in [False, True]:
+            if columnar:
+                columnarFile = db.UsageArchiver.exportColumnar(database, year, month)
+                assert columnarFile != None and db.UsageArchiver.setColumnar(database, year, month, columnarFile, removeArchive=True), \
+                    "The columnar export failed."
+            # Each case is (channel, since, until, words, valid commands, invalid commands).
+            for channel, since, until, words, valid, invalid in [
+                    (None, None, None, 9, 2, 1),
+                    (None, None, (year, month), 5, 1, 1),
+                    (None, liveMonth, None, 4, 1, None),
+                    ('channel', None, None, 5, 2, 1),
+                    ('other channel', (year, month), (year, month), None, None, None)]:
+                snapshot = db.UsageSnapshot.fetchRange(database, 'user', 'server', channel, since, until)
+                assert snapshot != None, "The snapshot (channel={0}, since={1}, until={2}) could not be read.".format(channel, since, until)
+                counts = tuple(None if usage.newRecord else count for usage, count in [
+                    (snapshot.messages, snapshot.messages.wordCount),
+                    (snapshot.validCommands, snapshot.validCommands.count),
+                    (snapshot.invalidCommands, snapshot.invalidCommands.count)])
+                assert counts == (words, valid, invalid), \
+                    "The snapshot (channel={0}, since={1}, until={2}, columnar={3}) has {4} words, valid and invalid commands, expected {5}.".format(
+                        channel, since, until, columnar, counts, (words, valid, invalid))
+        database.close()
+    finally:
+        shutil.rmtree(folder)
+
+def testSchemaFingerprint():
+    """ This function checks that an up to date database is opened without looking for updates, and that
+        a missing database is still created even though its schema fingerprint says it is up to date. """
+    folder = tempfile.mkdtemp()
+    pending = db.MigrationRunner.pending
+    checked = []
+    try:
+        databaseName = os.path.join(folder, 'abbot_test.sqlite3')
+        database = db.AbbotDatabase(databaseName)
+        version = database.databaseVersion
+        database.close()
+
+        db.MigrationRunner.pending = lambda runner, current: checked.append(current) or pending(runner, current)
+        database = db.AbbotDatabase(databaseName)
+        assert checked == [], "Looked for updates to an up to date database."
+        assert database.databaseVersion == version, "Database is at version {0}, expected {1}.".format(database.databaseVersion, version)
+        database.close()
+
+        os.remove(databaseName)
+        database = db.AbbotDatabase(databaseName)
+        assert checked != [], "Did not look for updates to a new database."
+        assert database.getVersion() == version, "New database is at version {0}, expected {1}.".format(database.getVersion(), version)
+        database.close()
+    finally:
+        db.MigrationRunner.pending = pending
+        shutil.rmtree(folder)
+
 if __name__ == '__main__':
     # Setup logging
     logger = logging.getLogger('abbot')
@@ -362,6 +834,23 @@ if __name__ == '__main__':
     commands = ['help', 'joke', 'roll', 'pick', 'choose', 'rpsls', 'ping', 'whoami']
     serverName = 'servername'
 
+    testRankQueryPlans()
+    testActivityQueryPlans()
+    testHistoricalRankQueryPlans()
+    testMigrationFailure()
+    testFailedFlush()
+    testJournalAfterRestart()
+    testSnapshotCache()
+    testActivityPrune()
+    testSketches()
+    testColumnarArchive()
+    testArchiveTwice()
+    testArchiveEmpty()
+    testArchiveMonthEnd()
+    testSnapshotRange()
+    testSchemaFingerprint()
+    if 'benchmark' in sys.argv:
+        benchmarkColumnarArchive()
     insertRecords(serverName, channels, users, commands)
     commandUsage(serverName, users)
     messageUsage(serverName, channels, users)
@@ -0,0 +1,35 @@
+class MemberIndex(object):
+    """
+    An index of the members of each server, keyed by server id and then user id, so members can be
+    found without searching through a server's whole member list.
+    """
+    FORMER_MEMBER = "Former Member" # Shown for users that are no longer on the server.
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self.servers = {}
+
+    def addServer(self, server):
+        """Add (or replace) all of the members of a server."""
+        self.servers[server.id] = {member.id: member for member in server.members}
+
+    def removeServer(self, server):
+        """Remove a server and its members."""
+        self.servers.pop(server.id, None)
+
+    def add(self, member):
+        """Add or update a member."""
+        self.servers.setdefault(member.server.id, {})[member.id] = member
+
+    def remove(self, member):
+        """Remove a member that has left their server."""
+        self.servers.get(member.server.id, {}).pop(member.id, None)
+
+    def get(self, serverId, userId):
+        """Get the member of a server with the given user id.  Returns None if they are not on the server."""
+        return self.servers.get(serverId, {}).get(userId)
+
+    def displayName(self, serverId, userId):
+        """Get the display name of a member, or FORMER_MEMBER if they are not on the server."""
+        member = self.get(serverId, userId)
+        return member.display_name if member != None else self.FORMER_MEMBER
@@ -0,0 +1,98 @@
+import hashlib
+import math
+import zlib
+
+class HyperLogLog(object):
+    """
+    A HyperLogLog sketch, which estimates how many distinct values have been added to it without
+    keeping the values.  With PRECISION 11 there are 2048 one byte registers and the standard error
+    is about 2.3%.  Sketches are stored compressed, so a sketch of a few values takes a few dozen
+    bytes, and two sketches can be merged into one that counts the values added to either.
+    """
+    PRECISION = 11
+    REGISTERS = 1 << PRECISION
+    HASH_BITS = 64
+
+    def __init__(self, registers=None):
+        """Create an empty sketch, or one with the given registers."""
+        self.registers = bytearray(registers) if registers != None else bytearray(self.REGISTERS)
+
+    @classmethod
+    def fromBytes(cls, data):
+        """Load a sketch saved by toBytes().  An empty or missing value is an empty sketch."""
+        if not data:
+            return cls()
+        registers = zlib.decompress(data)
+        if len(registers) != cls.REGISTERS:
+            raise ValueError("Sketch has {0} registers, expected {1}.".format(len(registers), cls.REGISTERS))
+        return cls(registers)
+
+    def toBytes(self):
+        """Save the sketch as a compressed string of bytes."""
+        return zlib.compress(bytes(self.registers))
+
+    def add(self, value):
+        """Add a value (anything with a stable str(), such as a user id) to the sketch."""
+        hashed = int.from_bytes(hashlib.sha1(str(value).encode('utf-8')).digest()[:8], 'big')
+        index = hashed >> (self.HASH_BITS - self.PRECISION)
+        remaining = hashed & ((1 << (self.HASH_BITS - self.PRECISION)) - 1)
+        rank = self.HASH_BITS - self.PRECISION - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        """Add each of the values to the sketch."""
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """Merge another sketch into this one."""
+        self.registers = bytearray(max(pair) for pair in zip(self.registers, other.registers))
+
+    def count(self):
+        """Estimate the number of distinct values added to the sketch."""
+        alpha = 0.7213 / (1 + 1.079 / self.REGISTERS)
+        estimate = alpha * self.REGISTERS * self.REGISTERS / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.REGISTERS and zeros > 0:
+            # Linear counting is more accurate for small counts.
+            estimate = self.REGISTERS * math.log(self.REGISTERS / zeros)
+        return int(round(estimate))
+
+    @staticmethod
+    def mergeBytes(first, second):
+        """Merge two saved sketches, returning the saved result.  Used as the hll_merge SQL function."""
+        if not first:
+            return second
+        if not second:
+            return first
+        sketch = HyperLogLog.fromBytes(first)
+        sketch.merge(HyperLogLog.fromBytes(second))
+        return sketch.toBytes()
+
+    @staticmethod
+    def countBytes(data):
+        """Estimate the count of a saved sketch.  Used as the hll_count SQL function."""
+        return HyperLogLog.fromBytes(data).count() if data else 0
+
+    class Union(object):
+        """An aggregate that merges saved sketches.  Used as the hll_union SQL function."""
+        def __init__(self):
+            self.sketch = None
+
+        def step(self, data):
+            if data:
+                if self.sketch == None:
+                    self.sketch = HyperLogLog.fromBytes(data)
+                else:
+                    self.sketch.merge(HyperLogLog.fromBytes(data))
+
+        def finalize(self):
+            return self.sketch.toBytes() if self.sketch != None else None
+
+    @staticmethod
+    def register(connection):
+        """Add the hll_merge, hll_union, and hll_count functions to an SQLite connection."""
+        connection.create_function('hll_merge', 2, HyperLogLog.mergeBytes)
+        connection.create_function('hll_count', 1, HyperLogLog.countBytes)
+        connection.create_aggregate('hll_union', 1, HyperLogLog.Union)
@@ -0,0 +1,80 @@
+-- The tables in each monthly archive file (archive/YYYY-MM.sqlite3).  See UsageArchiver.
+
+CREATE TABLE IF NOT EXISTS `usage_reactions_archive` (
+	`user`	TEXT NOT NULL,
+	`server`	TEXT NOT NULL,
+	`channel`	TEXT NOT NULL,
+	`messages_reacted_count`	INTEGER DEFAULT 0,
+	`user_reacted_count`	INTEGER DEFAULT 0,
+	`message_reactions_received_count`	INTEGER DEFAULT 0,
+	`reactions_received_count`	INTEGER DEFAULT 0,
+	`year` INTEGER NOT NULL,
+	`month` INTEGER NOT NULL,
+	PRIMARY KEY(`user`,`server`,`channel`, `year`, `month`)
+);
+
+CREATE TABLE IF NOT EXISTS `usage_messages_archive` (
+	`user`	TEXT NOT NULL,
+	`server`	TEXT NOT NULL,
+	`channel`	TEXT NOT NULL,
+	`word_count`	INTEGER DEFAULT 1,
+	`character_count`	INTEGER,
+	`max_message_length`	INTEGER DEFAULT 1,
+	`last_message_timestamp`	TEXT,
+	`message_count`	INTEGER DEFAULT 1,
+	`url_count`	INTEGER DEFAULT 0,
+	`year` INTEGER NOT NULL,
+	`month` INTEGER NOT NULL,
+	PRIMARY KEY(`user`,`server`,`channel`, `year`, `month`)
+);
+
+CREATE TABLE IF NOT EXISTS `usage_mentions_archive` (
+	`user`	TEXT NOT NULL,
+	`server`	TEXT NOT NULL,
+	`channel`	TEXT NOT NULL,
+	`user_mentions`	INTEGER DEFAULT 0,
+	`user_mentioned`	INTEGER DEFAULT 0,
+	`channel_mentions`	INTEGER DEFAULT 0,
+	`role_mentions`	INTEGER DEFAULT 0,
+	`year` INTEGER NOT NULL,
+	`month` INTEGER NOT NULL,
+	PRIMARY KEY(`user`,`server`,`channel`, `year`, `month`)
+);
+
+CREATE TABLE IF NOT EXISTS `usage_commands_archive` (
+	`user`	TEXT NOT NULL,
+	`server`	TEXT NOT NULL,
+	`channel`	TEXT NOT NULL,
+	`command_name`	TEXT NOT NULL,
+	`valid`	INTEGER DEFAULT 1,
+	`count`	INTEGER DEFAULT 1,
+	`year` INTEGER NOT NULL,
+	`month` INTEGER NOT NULL,
+	PRIMARY KEY(`user`,`command_name`,`server`,`channel`, `year`, `month`)
+);
+
+CREATE TABLE IF NOT EXISTS `usage_sketches_archive` (
+	`user`	TEXT NOT NULL,
+	`server`	TEXT NOT NULL,
+	`channel`	TEXT NOT NULL,
+	`kind`	TEXT NOT NULL,
+	`sketch`	BLOB,
+	`year` INTEGER NOT NULL,
+	`month` INTEGER NOT NULL,
+	PRIMARY KEY(`user`,`server`,`channel`,`kind`,`year`,`month`)
+);
+
+-- Lets the rankings for a range of months find a server's usage without a full scan.
+CREATE INDEX IF NOT EXISTS `usage_reactions_archive_month` ON `usage_reactions_archive` (`server`, `year`, `month`);
+CREATE INDEX IF NOT EXISTS `usage_messages_archive_month` ON `usage_messages_archive` (`server`, `year`, `month`);
+CREATE INDEX IF NOT EXISTS `usage_mentions_archive_month` ON `usage_mentions_archive` (`server`, `year`, `month`);
+CREATE INDEX IF NOT EXISTS `usage_commands_archive_month` ON `usage_commands_archive` (`server`, `year`, `month`);
+
+-- The last rowid of each live table copied into the file by each archive run (its started date), so a copy
+-- that is repeated after a crash does not add the same rows twice.
+CREATE TABLE IF NOT EXISTS `archive_copied` (
+	`table_name`	TEXT NOT NULL,
+	`run`	TEXT NOT NULL,
+	`last_rowid`	INTEGER NOT NULL,
+	PRIMARY KEY(`table_name`,`run`)
+);
@@ -0,0 +1,18 @@
+begin transaction;
+
+-- Progress of the archive in progress (see UsageArchiver), one row per usage table.  Rows up to last_rowid have been
+-- moved to the archive table; rows up to max_rowid (the last row when the archive started) will be.  The rows are
+-- removed once every table has been archived.
+CREATE TABLE IF NOT EXISTS `usage_archive_progress` (
+	`table_name`	TEXT NOT NULL,
+	`year`	INTEGER NOT NULL,
+	`month`	INTEGER NOT NULL,
+	`last_rowid`	INTEGER DEFAULT 0,
+	`max_rowid`	INTEGER DEFAULT 0,
+	`rows_moved`	INTEGER DEFAULT 0,
+	`total_rows`	INTEGER DEFAULT 0,
+	`started_date`	TEXT,
+	PRIMARY KEY(`table_name`)
+);
+
+commit;
@@ -0,0 +1,5 @@
+begin transaction;
+
+PRAGMA user_version = 10;
+
+commit;
\ No newline at end of file
@@ -0,0 +1,14 @@
+begin transaction;
+
+-- The monthly archive files (see UsageArchiver), relative to the archive folder next to the database.  Months archived
+-- before the archive files were added are still in the usage_*_archive tables until they are moved.
+CREATE TABLE IF NOT EXISTS `usage_archive_catalog` (
+	`year`	INTEGER NOT NULL,
+	`month`	INTEGER NOT NULL,
+	`file_name`	TEXT NOT NULL,
+	`rows_archived`	INTEGER DEFAULT 0,
+	`archived_date`	TEXT,
+	PRIMARY KEY(`year`,`month`)
+);
+
+commit;
\ No newline at end of file
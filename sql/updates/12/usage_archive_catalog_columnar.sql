@@ -0,0 +1,6 @@
+begin transaction;
+
+-- The column-oriented copy of each archived month (see columnar.py), if it has been exported.
+ALTER TABLE usage_archive_catalog ADD COLUMN `columnar_file` TEXT;
+
+commit;
\ No newline at end of file
@@ -0,0 +1,9 @@
+begin transaction;
+
+-- Lets the rankings for a range of months find a server's archived usage without a full scan.
+CREATE INDEX IF NOT EXISTS `usage_reactions_archive_month` ON `usage_reactions_archive` (`server`, `year`, `month`);
+CREATE INDEX IF NOT EXISTS `usage_messages_archive_month` ON `usage_messages_archive` (`server`, `year`, `month`);
+CREATE INDEX IF NOT EXISTS `usage_mentions_archive_month` ON `usage_mentions_archive` (`server`, `year`, `month`);
+CREATE INDEX IF NOT EXISTS `usage_commands_archive_month` ON `usage_commands_archive` (`server`, `year`, `month`);
+
+commit;
\ No newline at end of file
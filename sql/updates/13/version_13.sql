@@ -0,0 +1,5 @@
+begin transaction;
+
+PRAGMA user_version = 13;
+
+commit;
\ No newline at end of file
@@ -0,0 +1,12 @@
+begin transaction;
+
+-- The last usage journal entry written to the usage tables.  There is only ever one row.
+DROP TABLE IF EXISTS `usage_journal`;
+CREATE TABLE `usage_journal` (
+	`id`	INTEGER NOT NULL CHECK(`id` = 1),
+	`sequence`	INTEGER NOT NULL,
+	`checkpoint_date`	TEXT,
+	PRIMARY KEY(`id`)
+);
+
+commit;
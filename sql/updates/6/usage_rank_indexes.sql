@@ -0,0 +1,10 @@
+begin transaction;
+
+-- The primary keys lead with user, so rank queries (which filter on server, and optionally channel)
+-- would scan the whole table.  These indexes cover every column the rank queries read.
+CREATE INDEX IF NOT EXISTS `usage_messages_rank` ON `usage_messages` (`server`, `channel`, `user`, `message_count`, `word_count`, `character_count`, `max_message_length`, `url_count`);
+CREATE INDEX IF NOT EXISTS `usage_reactions_rank` ON `usage_reactions` (`server`, `channel`, `user`, `messages_reacted_count`, `user_reacted_count`, `message_reactions_received_count`, `reactions_received_count`);
+CREATE INDEX IF NOT EXISTS `usage_mentions_rank` ON `usage_mentions` (`server`, `channel`, `user`, `user_mentions`, `user_mentioned`, `channel_mentions`, `role_mentions`);
+CREATE INDEX IF NOT EXISTS `usage_commands_rank` ON `usage_commands` (`server`, `channel`, `user`, `count`, `valid`);
+
+commit;
@@ -0,0 +1,44 @@
+begin transaction;
+
+-- The usage_commands totals for each user across all of a server's channels, kept up to date by triggers on usage_commands.
+DROP TABLE IF EXISTS `usage_commands_server`;
+CREATE TABLE `usage_commands_server` (
+	`server`	TEXT NOT NULL,
+	`user`	TEXT NOT NULL,
+	`count`	INTEGER DEFAULT 0,
+	`valid`	INTEGER DEFAULT 0,
+	PRIMARY KEY(`server`,`user`)
+);
+
+INSERT INTO usage_commands_server (server, user, count, valid)
+    SELECT server, user, ifnull(sum(count), 0), ifnull(sum(valid), 0) FROM usage_commands GROUP BY server, user;
+
+DROP TRIGGER IF EXISTS `usage_commands_server_insert`;
+CREATE TRIGGER `usage_commands_server_insert` AFTER INSERT ON `usage_commands`
+BEGIN
+    INSERT INTO usage_commands_server (server, user, count, valid)
+        VALUES (new.server, new.user, ifnull(new.count, 0), ifnull(new.valid, 0))
+    ON CONFLICT(server, user) DO UPDATE
+    SET count = count + excluded.count,
+        valid = valid + excluded.valid;
+END;
+
+DROP TRIGGER IF EXISTS `usage_commands_server_update`;
+CREATE TRIGGER `usage_commands_server_update` AFTER UPDATE ON `usage_commands`
+BEGIN
+    UPDATE usage_commands_server
+    SET count = count + ifnull(new.count, 0) - ifnull(old.count, 0),
+        valid = valid + ifnull(new.valid, 0) - ifnull(old.valid, 0)
+    WHERE server = new.server AND user = new.user;
+END;
+
+DROP TRIGGER IF EXISTS `usage_commands_server_delete`;
+CREATE TRIGGER `usage_commands_server_delete` AFTER DELETE ON `usage_commands`
+BEGIN
+    UPDATE usage_commands_server
+    SET count = count - ifnull(old.count, 0),
+        valid = valid - ifnull(old.valid, 0)
+    WHERE server = old.server AND user = old.user;
+END;
+
+commit;
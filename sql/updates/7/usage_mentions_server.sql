@@ -0,0 +1,52 @@
+begin transaction;
+
+-- The usage_mentions totals for each user across all of a server's channels, kept up to date by triggers on usage_mentions.
+DROP TABLE IF EXISTS `usage_mentions_server`;
+CREATE TABLE `usage_mentions_server` (
+	`server`	TEXT NOT NULL,
+	`user`	TEXT NOT NULL,
+	`user_mentions`	INTEGER DEFAULT 0,
+	`user_mentioned`	INTEGER DEFAULT 0,
+	`channel_mentions`	INTEGER DEFAULT 0,
+	`role_mentions`	INTEGER DEFAULT 0,
+	PRIMARY KEY(`server`,`user`)
+);
+
+INSERT INTO usage_mentions_server (server, user, user_mentions, user_mentioned, channel_mentions, role_mentions)
+    SELECT server, user, ifnull(sum(user_mentions), 0), ifnull(sum(user_mentioned), 0), ifnull(sum(channel_mentions), 0), ifnull(sum(role_mentions), 0) FROM usage_mentions GROUP BY server, user;
+
+DROP TRIGGER IF EXISTS `usage_mentions_server_insert`;
+CREATE TRIGGER `usage_mentions_server_insert` AFTER INSERT ON `usage_mentions`
+BEGIN
+    INSERT INTO usage_mentions_server (server, user, user_mentions, user_mentioned, channel_mentions, role_mentions)
+        VALUES (new.server, new.user, ifnull(new.user_mentions, 0), ifnull(new.user_mentioned, 0), ifnull(new.channel_mentions, 0), ifnull(new.role_mentions, 0))
+    ON CONFLICT(server, user) DO UPDATE
+    SET user_mentions = user_mentions + excluded.user_mentions,
+        user_mentioned = user_mentioned + excluded.user_mentioned,
+        channel_mentions = channel_mentions + excluded.channel_mentions,
+        role_mentions = role_mentions + excluded.role_mentions;
+END;
+
+DROP TRIGGER IF EXISTS `usage_mentions_server_update`;
+CREATE TRIGGER `usage_mentions_server_update` AFTER UPDATE ON `usage_mentions`
+BEGIN
+    UPDATE usage_mentions_server
+    SET user_mentions = user_mentions + ifnull(new.user_mentions, 0) - ifnull(old.user_mentions, 0),
+        user_mentioned = user_mentioned + ifnull(new.user_mentioned, 0) - ifnull(old.user_mentioned, 0),
+        channel_mentions = channel_mentions + ifnull(new.channel_mentions, 0) - ifnull(old.channel_mentions, 0),
+        role_mentions = role_mentions + ifnull(new.role_mentions, 0) - ifnull(old.role_mentions, 0)
+    WHERE server = new.server AND user = new.user;
+END;
+
+DROP TRIGGER IF EXISTS `usage_mentions_server_delete`;
+CREATE TRIGGER `usage_mentions_server_delete` AFTER DELETE ON `usage_mentions`
+BEGIN
+    UPDATE usage_mentions_server
+    SET user_mentions = user_mentions - ifnull(old.user_mentions, 0),
+        user_mentioned = user_mentioned - ifnull(old.user_mentioned, 0),
+        channel_mentions = channel_mentions - ifnull(old.channel_mentions, 0),
+        role_mentions = role_mentions - ifnull(old.role_mentions, 0)
+    WHERE server = old.server AND user = old.user;
+END;
+
+commit;
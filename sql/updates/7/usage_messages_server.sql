@@ -0,0 +1,56 @@
+begin transaction;
+
+-- The usage_messages totals for each user across all of a server's channels, kept up to date by triggers on usage_messages.
+DROP TABLE IF EXISTS `usage_messages_server`;
+CREATE TABLE `usage_messages_server` (
+	`server`	TEXT NOT NULL,
+	`user`	TEXT NOT NULL,
+	`message_count`	INTEGER DEFAULT 0,
+	`word_count`	INTEGER DEFAULT 0,
+	`character_count`	INTEGER DEFAULT 0,
+	`max_message_length`	INTEGER DEFAULT 0,
+	`url_count`	INTEGER DEFAULT 0,
+	PRIMARY KEY(`server`,`user`)
+);
+
+INSERT INTO usage_messages_server (server, user, message_count, word_count, character_count, max_message_length, url_count)
+    SELECT server, user, ifnull(sum(message_count), 0), ifnull(sum(word_count), 0), ifnull(sum(character_count), 0), ifnull(sum(max_message_length), 0), ifnull(sum(url_count), 0) FROM usage_messages GROUP BY server, user;
+
+DROP TRIGGER IF EXISTS `usage_messages_server_insert`;
+CREATE TRIGGER `usage_messages_server_insert` AFTER INSERT ON `usage_messages`
+BEGIN
+    INSERT INTO usage_messages_server (server, user, message_count, word_count, character_count, max_message_length, url_count)
+        VALUES (new.server, new.user, ifnull(new.message_count, 0), ifnull(new.word_count, 0), ifnull(new.character_count, 0), ifnull(new.max_message_length, 0), ifnull(new.url_count, 0))
+    ON CONFLICT(server, user) DO UPDATE
+    SET message_count = message_count + excluded.message_count,
+        word_count = word_count + excluded.word_count,
+        character_count = character_count + excluded.character_count,
+        max_message_length = max_message_length + excluded.max_message_length,
+        url_count = url_count + excluded.url_count;
+END;
+
+DROP TRIGGER IF EXISTS `usage_messages_server_update`;
+CREATE TRIGGER `usage_messages_server_update` AFTER UPDATE ON `usage_messages`
+BEGIN
+    UPDATE usage_messages_server
+    SET message_count = message_count + ifnull(new.message_count, 0) - ifnull(old.message_count, 0),
+        word_count = word_count + ifnull(new.word_count, 0) - ifnull(old.word_count, 0),
+        character_count = character_count + ifnull(new.character_count, 0) - ifnull(old.character_count, 0),
+        max_message_length = max_message_length + ifnull(new.max_message_length, 0) - ifnull(old.max_message_length, 0),
+        url_count = url_count + ifnull(new.url_count, 0) - ifnull(old.url_count, 0)
+    WHERE server = new.server AND user = new.user;
+END;
+
+DROP TRIGGER IF EXISTS `usage_messages_server_delete`;
+CREATE TRIGGER `usage_messages_server_delete` AFTER DELETE ON `usage_messages`
+BEGIN
+    UPDATE usage_messages_server
+    SET message_count = message_count - ifnull(old.message_count, 0),
+        word_count = word_count - ifnull(old.word_count, 0),
+        character_count = character_count - ifnull(old.character_count, 0),
+        max_message_length = max_message_length - ifnull(old.max_message_length, 0),
+        url_count = url_count - ifnull(old.url_count, 0)
+    WHERE server = old.server AND user = old.user;
+END;
+
+commit;
@@ -0,0 +1,52 @@
+begin transaction;
+
+-- The usage_reactions totals for each user across all of a server's channels, kept up to date by triggers on usage_reactions.
+DROP TABLE IF EXISTS `usage_reactions_server`;
+CREATE TABLE `usage_reactions_server` (
+	`server`	TEXT NOT NULL,
+	`user`	TEXT NOT NULL,
+	`messages_reacted_count`	INTEGER DEFAULT 0,
+	`user_reacted_count`	INTEGER DEFAULT 0,
+	`message_reactions_received_count`	INTEGER DEFAULT 0,
+	`reactions_received_count`	INTEGER DEFAULT 0,
+	PRIMARY KEY(`server`,`user`)
+);
+
+INSERT INTO usage_reactions_server (server, user, messages_reacted_count, user_reacted_count, message_reactions_received_count, reactions_received_count)
+    SELECT server, user, ifnull(sum(messages_reacted_count), 0), ifnull(sum(user_reacted_count), 0), ifnull(sum(message_reactions_received_count), 0), ifnull(sum(reactions_received_count), 0) FROM usage_reactions GROUP BY server, user;
+
+DROP TRIGGER IF EXISTS `usage_reactions_server_insert`;
+CREATE TRIGGER `usage_reactions_server_insert` AFTER INSERT ON `usage_reactions`
+BEGIN
+    INSERT INTO usage_reactions_server (server, user, messages_reacted_count, user_reacted_count, message_reactions_received_count, reactions_received_count)
+        VALUES (new.server, new.user, ifnull(new.messages_reacted_count, 0), ifnull(new.user_reacted_count, 0), ifnull(new.message_reactions_received_count, 0), ifnull(new.reactions_received_count, 0))
+    ON CONFLICT(server, user) DO UPDATE
+    SET messages_reacted_count = messages_reacted_count + excluded.messages_reacted_count,
+        user_reacted_count = user_reacted_count + excluded.user_reacted_count,
+        message_reactions_received_count = message_reactions_received_count + excluded.message_reactions_received_count,
+        reactions_received_count = reactions_received_count + excluded.reactions_received_count;
+END;
+
+DROP TRIGGER IF EXISTS `usage_reactions_server_update`;
+CREATE TRIGGER `usage_reactions_server_update` AFTER UPDATE ON `usage_reactions`
+BEGIN
+    UPDATE usage_reactions_server
+    SET messages_reacted_count = messages_reacted_count + ifnull(new.messages_reacted_count, 0) - ifnull(old.messages_reacted_count, 0),
+        user_reacted_count = user_reacted_count + ifnull(new.user_reacted_count, 0) - ifnull(old.user_reacted_count, 0),
+        message_reactions_received_count = message_reactions_received_count + ifnull(new.message_reactions_received_count, 0) - ifnull(old.message_reactions_received_count, 0),
+        reactions_received_count = reactions_received_count + ifnull(new.reactions_received_count, 0) - ifnull(old.reactions_received_count, 0)
+    WHERE server = new.server AND user = new.user;
+END;
+
+DROP TRIGGER IF EXISTS `usage_reactions_server_delete`;
+CREATE TRIGGER `usage_reactions_server_delete` AFTER DELETE ON `usage_reactions`
+BEGIN
+    UPDATE usage_reactions_server
+    SET messages_reacted_count = messages_reacted_count - ifnull(old.messages_reacted_count, 0),
+        user_reacted_count = user_reacted_count - ifnull(old.user_reacted_count, 0),
+        message_reactions_received_count = message_reactions_received_count - ifnull(old.message_reactions_received_count, 0),
+        reactions_received_count = reactions_received_count - ifnull(old.reactions_received_count, 0)
+    WHERE server = old.server AND user = old.user;
+END;
+
+commit;
@@ -0,0 +1,24 @@
+begin transaction;
+
+-- Messages and words for each user in each channel, per hour.  hour_bucket is the number of hours since the
+-- epoch (UTC), so a time range is a range of buckets.  These are not archived with the monthly totals.
+CREATE TABLE IF NOT EXISTS `usage_activity` (
+	`server`	TEXT NOT NULL,
+	`channel`	TEXT NOT NULL,
+	`user`	TEXT NOT NULL,
+	`hour_bucket`	INTEGER NOT NULL,
+	`messages`	INTEGER DEFAULT 0,
+	`words`	INTEGER DEFAULT 0,
+	PRIMARY KEY(`server`,`channel`,`hour_bucket`,`user`)
+);
+
+-- Covering indexes for range scans over a server, or one of its channels.  The channel index repeats the start of
+-- the primary key, but this is a rowid table, so the primary key does not hold messages and words, and a channel's
+-- range would otherwise look up every row in the table.
+CREATE INDEX IF NOT EXISTS `usage_activity_server` ON `usage_activity` (`server`, `hour_bucket`, `messages`, `words`);
+CREATE INDEX IF NOT EXISTS `usage_activity_channel` ON `usage_activity` (`server`, `channel`, `hour_bucket`, `messages`, `words`);
+
+-- Old hours are pruned across every server, so they are found by hour_bucket alone.
+CREATE INDEX IF NOT EXISTS `usage_activity_hour` ON `usage_activity` (`hour_bucket`);
+
+commit;
@@ -0,0 +1,26 @@
+begin transaction;
+
+-- HyperLogLog sketches (see sketches.py) of the distinct users related to each user, such as the users they have
+-- mentioned ('mentioned') or the users that have reacted to them ('reactors').  Sketches are merged with hll_merge
+-- and hll_union, which the bot adds to each connection.
+CREATE TABLE IF NOT EXISTS `usage_sketches` (
+	`user`	TEXT NOT NULL,
+	`server`	TEXT NOT NULL,
+	`channel`	TEXT NOT NULL,
+	`kind`	TEXT NOT NULL,
+	`sketch`	BLOB,
+	PRIMARY KEY(`user`,`server`,`channel`,`kind`)
+);
+
+CREATE TABLE IF NOT EXISTS `usage_sketches_archive` (
+	`user`	TEXT NOT NULL,
+	`server`	TEXT NOT NULL,
+	`channel`	TEXT NOT NULL,
+	`kind`	TEXT NOT NULL,
+	`sketch`	BLOB,
+	`year` INTEGER NOT NULL,
+	`month` INTEGER NOT NULL,
+	PRIMARY KEY(`user`,`server`,`channel`,`kind`,`year`,`month`)
+);
+
+commit;
@@ -0,0 +1,5 @@
+begin transaction;
+
+PRAGMA user_version = 9;
+
+commit;
\ No newline at end of file
@@ -68,6 +68,13 @@ def paginate(content, *, length=DISCORD_MSG_CHAR_LIMIT, reserve=0):
     return chunks
 
 
+def unique_mentions(message):
+    """
+    Get the unique users, channels, and roles mentioned in a message as three sets of ids.
+    """
+    return set(message.raw_mentions), set(message.raw_channel_mentions), set(message.raw_role_mentions)
+
+
 async def get_header(session, url, headerfield=None, *, timeout=5):
     with aiohttp.Timeout(timeout):
         async with session.head(url) as response: